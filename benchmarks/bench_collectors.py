@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Benchmark of the collection cost of every registered collector.
+
+Usage: python benchmarks/bench_collectors.py [--iterations N] [--collector NAME ...]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from amazing_iot_device.collectors import collector_registry  # noqa: E402
+
+
+def bench_collector(collector, iterations):
+    """Return the wall and CPU time of every collection of ``collector`` in milliseconds."""
+    wall, cpu = [], []
+    # The first collection establishes baselines and primes caches, it is not measured
+    collector.collect()
+    for _ in range(iterations):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        collector.collect()
+        wall.append((time.perf_counter() - wall_start) * 1000)
+        cpu.append((time.process_time() - cpu_start) * 1000)
+    return wall, cpu
+
+
+def percentile(values, fraction):
+    """Return the value below which ``fraction`` of the sorted values fall."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--collector", action="append", help="Only run the named collectors")
+    args = parser.parse_args()
+
+    print(f"{'collector':<10} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9} {'cpu ms':>9}")
+    for collector in collector_registry:
+        if args.collector and collector.name not in args.collector:
+            continue
+        wall, cpu = bench_collector(collector, args.iterations)
+        print(
+            f"{collector.name:<10} {statistics.fmean(wall):>9.3f} {percentile(wall, 0.95):>9.3f}"
+            f" {max(wall):>9.3f} {statistics.fmean(cpu):>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Benchmark of the end-to-end throughput and latency from devices through a broker to the receiver.
+
+Simulated devices of the load generator publish agent-shaped payloads to the embedded MQTT broker
+(or a real one given with --host), and the cloud receiver subscribes in the same process and
+stores every message in a temporary data directory. The end-to-end latency runs from the sampling
+timestamp of a full payload to the moment the receiver is handed the message.
+
+Usage: python benchmarks/bench_end_to_end.py [--devices N] [--interval SECONDS]
+                                             [--duration SECONDS] [--host HOST --port PORT]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import paho.mqtt.client as paho_mqtt
+
+# Add the src directory and the receiver to the Python path
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, "cloud-service", "mqtt-receiver"))
+
+import receiver  # noqa: E402
+
+from amazing_iot_device import codec  # noqa: E402
+from amazing_iot_device.broker import Broker  # noqa: E402
+from amazing_iot_device.loadgen import format_report, raise_open_file_limit, run_load  # noqa: E402
+
+
+class MeasuredReceiver:
+    """The receiver's callbacks on a paho client, counting messages and keeping receipt times."""
+
+    def __init__(self, host, port, topic, username="", password=""):
+        self.received = 0
+        self.full_messages = []
+        self.subscribed = threading.Event()
+        self.client = paho_mqtt.Client(
+            client_id=f"mqtt-receiver-{time.time()}",
+            userdata={"host": host, "port": port, "topic": topic},
+        )
+        if username and password:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = receiver.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_subscribe = lambda *args: self.subscribed.set()
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, msg):
+        """Time and count a message, then process it like the receiver service."""
+        if msg.topic.endswith("/full"):
+            # Payloads are decoded after the run, so the measurement costs the receiver nothing
+            self.full_messages.append((datetime.now(), msg.payload))
+        self.received += 1
+        receiver.on_message(client, userdata, msg)
+
+    def latencies(self):
+        """Return the end-to-end latencies of the full messages, in seconds."""
+        latencies = []
+        for received_at, payload in self.full_messages:
+            sampled_at = datetime.fromisoformat(codec.decode(payload)["timestamp"])
+            latencies.append((received_at - sampled_at).total_seconds())
+        return sorted(latencies)
+
+    def wait_idle(self, quiet=1.0, timeout=30.0):
+        """Wait until no message arrived for ``quiet`` seconds."""
+        deadline = time.monotonic() + timeout
+        count = -1
+        while count != self.received and time.monotonic() < deadline:
+            count = self.received
+            time.sleep(quiet)
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def percentile(values, fraction):
+    """Return the value below which ``fraction`` of the sorted values fall."""
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--format", choices=codec.FORMATS, default="json")
+    parser.add_argument("--host", help="Broker host, the embedded broker when omitted")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username", default="")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+    # The receiver logs every message it gets, which would dominate its cost
+    logging.getLogger("mqtt-receiver").setLevel(logging.WARNING)
+
+    broker = None
+    host, port = args.host, args.port
+    if host is None:
+        broker = Broker()
+        host, port = "127.0.0.1", broker.start()
+    raise_open_file_limit(args.devices * 2 + 64)
+    receiver.DATA_DIR = tempfile.mkdtemp(prefix="receiver-data-")
+    measured = MeasuredReceiver(host, port, "loadgen/#", args.username, args.password)
+    if not measured.subscribed.wait(timeout=10):
+        sys.exit("The receiver could not subscribe")
+
+    try:
+        report = asyncio.run(
+            run_load(
+                args.devices,
+                host,
+                port,
+                duration=args.duration,
+                username=args.username,
+                password=args.password,
+                interval=args.interval,
+                jitter=args.jitter,
+                payload_format=args.format,
+            )
+        )
+        measured.wait_idle()
+    finally:
+        measured.stop()
+        if broker is not None:
+            broker.stop()
+
+    latencies = measured.latencies()
+
+    def milliseconds(value):
+        return "-" if value is None else f"{value * 1000:.1f}"
+
+    print(format_report(report))
+    print(
+        f"received            {measured.received} messages,"
+        f" {measured.received / report['duration']:.1f} msgs/s (data in {receiver.DATA_DIR})"
+    )
+    print(
+        f"end-to-end ms       p50 {milliseconds(percentile(latencies, 0.5))}"
+        f"  p95 {milliseconds(percentile(latencies, 0.95))}"
+        f"  p99 {milliseconds(percentile(latencies, 0.99))}"
+        f"  max {milliseconds(latencies[-1] if latencies else None)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of the collection, serialization, publishing, dashboard and receiver hot paths.
+
+Every benchmark calls one operation repeatedly for at least --min-time seconds and reports its
+throughput, the p50 and p99 time of a call, and the peak memory a call allocates (measured in a
+separate pass under tracemalloc, so that tracing does not slow the timed calls down). Payloads
+are synthetic and seeded, so runs on different hosts serialize the same data. Timings are only
+comparable between runs on the same, otherwise idle, host.
+
+Results are written as JSON with --output. Given --baseline, a previous results file, every
+benchmark whose p50 time or allocations grew by more than --tolerance is reported as a regression
+and the script exits with status 1, so it can gate a release:
+
+    python benchmarks/bench_hot_paths.py --output benchmarks/baseline.json   # on the last release
+    python benchmarks/bench_hot_paths.py --baseline benchmarks/baseline.json  # on the candidate
+
+Usage: python benchmarks/bench_hot_paths.py [--min-time SECONDS] [--filter TEXT ...]
+                                            [--output FILE] [--baseline FILE] [--tolerance F]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+# Add the src directory and the receiver to the Python path
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, "cloud-service", "mqtt-receiver"))
+
+import receiver  # noqa: E402
+
+from amazing_iot_device import codec  # noqa: E402
+from amazing_iot_device.loadgen import SyntheticHardware  # noqa: E402
+from amazing_iot_device.mqtt_service import MQTTService  # noqa: E402
+
+# Calls of the allocation pass
+ALLOCATION_CALLS = 20
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark; the decorated function sets it up and returns the operation."""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def sample_payload(seed=0):
+    """Return seeded synthetic hardware information, the same on every host."""
+    return SyntheticHardware("bench-device", random.Random(seed)).sample()
+
+
+class FakeClient:
+    """Connected paho client stand-in that acknowledges every message before returning."""
+
+    def __init__(self, service):
+        self.service = service
+        self.mid = 0
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid += 1
+        # Acknowledged before the pipeline registers it, which completes it without waiting
+        self.service._on_publish(self, None, self.mid)
+        return SimpleNamespace(rc=0, mid=self.mid, is_published=lambda: True)
+
+
+@benchmark("collect.hardware_info")
+def bench_hardware_info(workdir):
+    service = MQTTService()
+    return service._get_hardware_info
+
+
+for _fmt in codec.FORMATS:
+
+    @benchmark(f"serialize.{_fmt}")
+    def bench_serialize(workdir, fmt=_fmt):
+        payload = sample_payload()
+        return lambda: codec.encode(payload, fmt)
+
+
+@benchmark("publish.hardware_info")
+def bench_publish(workdir):
+    service = MQTTService()
+    service.client = FakeClient(service)
+    return service._publish_hardware_info
+
+
+def logged_in_client(workdir, name, **config):
+    """Return a test client of a new app with its own database, logged in."""
+    from amazing_iot_device import create_app, db
+    from amazing_iot_device.models import User
+
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, f'{name}.db')}",
+            "WTF_CSRF_ENABLED": False,
+            **config,
+        }
+    )
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench")
+        user.set_password("bench")
+        db.session.add(user)
+        db.session.commit()
+    client = app.test_client()
+    client.post("/auth/login", data={"username": "bench", "password": "bench"})
+    return client
+
+
+# The authenticated request of a polling dashboard, with the logged-in user loaded from the
+# database on every request and from the user cache
+for _name, _ttl in (("uncached", 0), ("cached", 60)):
+
+    @benchmark(f"auth.request.{_name}")
+    def bench_auth_request(workdir, name=_name, ttl=_ttl):
+        client = logged_in_client(workdir, f"auth-{name}", USER_CACHE_TTL=ttl)
+
+        def request():
+            response = client.get("/dashboard/api/metrics")
+            assert response.status_code == 200
+
+        return request
+
+
+@benchmark("dashboard.render")
+def bench_dashboard(workdir):
+    client = logged_in_client(workdir, "dashboard")
+
+    def render():
+        response = client.get("/dashboard/")
+        assert response.status_code == 200
+
+    return render
+
+
+@benchmark("receiver.on_message")
+def bench_receiver_on_message(workdir):
+    receiver.DATA_DIR = os.path.join(workdir, "receiver")
+    message = SimpleNamespace(
+        topic="iot/device/bench-device/full", payload=codec.encode(sample_payload(), "json")
+    )
+    return lambda: receiver.on_message(None, None, message)
+
+
+@benchmark("receiver.store_data")
+def bench_receiver_store_data(workdir):
+    receiver.DATA_DIR = os.path.join(workdir, "receiver")
+    payload = sample_payload()
+    return lambda: receiver.store_data(
+        "bench-device", "iot/device/bench-device/full", payload["timestamp"], payload
+    )
+
+
+def measure(operation, min_time, rounds=5):
+    """Time calls of ``operation`` for at least ``min_time`` seconds, then trace its allocations.
+
+    The calls are split in rounds, and the p50 is the lowest median of a round: interference of
+    other processes only ever slows calls down, so it is the most reproducible estimate.
+    """
+    for _ in range(3):
+        operation()
+
+    durations, medians, elapsed = [], [], 0.0
+    for _ in range(rounds):
+        round_durations = []
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            while time.perf_counter() - started < min_time / rounds or len(round_durations) < 5:
+                call_started = time.perf_counter()
+                operation()
+                round_durations.append(time.perf_counter() - call_started)
+            elapsed += time.perf_counter() - started
+        finally:
+            gc.enable()
+        medians.append(statistics.median(round_durations))
+        durations.extend(round_durations)
+
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(ALLOCATION_CALLS):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            operation()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        "calls": len(durations),
+        "ops_per_s": len(durations) / elapsed,
+        "p50_us": min(medians) * 1e6,
+        "p99_us": durations[min(len(durations) - 1, int(0.99 * len(durations)))] * 1e6,
+        "alloc_peak_kib": statistics.median(peaks) / 1024,
+        "alloc_retained_kib": statistics.median(retained) / 1024,
+    }
+
+
+def environment():
+    """Return a description of the host and revision the results were measured on."""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "revision": revision or None,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of ``results`` against ``baseline`` as printable lines."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["p50_us"] > previous["p50_us"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {previous['p50_us']:.1f} -> {result['p50_us']:.1f} us"
+                f" ({result['p50_us'] / previous['p50_us'] - 1:+.0%})"
+            )
+        # Allocation changes of less than a KiB are noise of the interpreter
+        allocated = previous["alloc_peak_kib"] * (1 + tolerance) + 1
+        if result["alloc_peak_kib"] > allocated:
+            regressions.append(
+                f"{name}: allocations {previous['alloc_peak_kib']:.1f} ->"
+                f" {result['alloc_peak_kib']:.1f} KiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds per benchmark")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per benchmark")
+    parser.add_argument("--filter", action="append", help="Only run benchmarks containing TEXT")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+    # Log records of the hot paths are still built, but not written to the terminal
+    logging.disable(logging.INFO)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(
+        f"{'benchmark':<24} {'ops/s':>10} {'p50 us':>10} {'p99 us':>10} {'alloc KiB':>10}"
+        f" {'vs base':>8}"
+    )
+    with tempfile.TemporaryDirectory(prefix="bench-hot-paths-") as workdir:
+        for name, setup in BENCHMARKS.items():
+            if args.filter and not any(text in name for text in args.filter):
+                continue
+            result = results[name] = measure(setup(workdir), args.min_time, args.rounds)
+            change = ""
+            if name in baseline:
+                change = f"{result['p50_us'] / baseline[name]['p50_us'] - 1:+.0%}"
+            print(
+                f"{name:<24} {result['ops_per_s']:>10.1f} {result['p50_us']:>10.1f}"
+                f" {result['p99_us']:>10.1f} {result['alloc_peak_kib']:>10.1f} {change:>8}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+            f.write("\n")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}:")
+            print("\n".join(f"  {line}" for line in regressions))
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
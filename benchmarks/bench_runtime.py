@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Benchmark of the idle cost of the threads and asyncio agent runtimes.
+
+Every runtime runs the MQTT service in its own process against the embedded MQTT broker, and the
+threads, resident memory, CPU time and voluntary context switches (one per wakeup of a sleeping
+thread) of that process are measured once it has settled. Context switches are read from
+/proc, so the benchmark runs on Linux only.
+
+Usage: python benchmarks/bench_runtime.py [--duration SECONDS] [--publish-interval SECONDS]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from amazing_iot_device.broker import Broker  # noqa: E402
+
+
+def count_wakeups():
+    """Return the voluntary context switches of every live thread of this process."""
+    # The counters of /proc/self/status only cover the main thread
+    total = 0
+    for task in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{task}/status") as status:
+                for line in status:
+                    if line.startswith("voluntary_ctxt_switches:"):
+                        total += int(line.split()[1])
+        except FileNotFoundError:
+            # The thread exited in the meantime
+            continue
+    return total
+
+
+def measure(runtime, port, duration, warmup, publish_interval):
+    """Run the service with ``runtime`` and return the resource usage of this process."""
+    from amazing_iot_device.mqtt_service import MQTTService
+    from amazing_iot_device.outbox import Outbox
+    from amazing_iot_device.sampler import resource_sampler
+
+    service = MQTTService()
+    service.set_runtime(runtime)
+    service.outbox = Outbox(os.path.join(tempfile.mkdtemp(), "outbox.sqlite"))
+    service.broker_settings.update({"host": "127.0.0.1", "port": port})
+    service.publish_interval = publish_interval
+    service._setup_mqtt_client()
+    if runtime == "threads":
+        resource_sampler.start()
+    service.start()
+    time.sleep(warmup)
+
+    process = psutil.Process()
+    wakeups, cpu = count_wakeups(), process.cpu_times()
+    time.sleep(duration)
+    wakeups_end, cpu_end = count_wakeups(), process.cpu_times()
+    cpu_time = cpu_end.user + cpu_end.system - cpu.user - cpu.system
+    result = {
+        "runtime": runtime,
+        "threads": process.num_threads(),
+        "rss_mb": process.memory_info().rss / 2**20,
+        "wakeups_per_s": (wakeups_end - wakeups) / duration,
+        "cpu_ms_per_s": cpu_time * 1000 / duration,
+        "connected": service.client.is_connected(),
+    }
+    service.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--publish-interval", type=int, default=60)
+    parser.add_argument("--runtime", action="append", help="Only run the named runtimes")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.child, args.port, args.duration, args.warmup, args.publish_interval)
+        print(json.dumps(result))
+        return
+
+    port = Broker().start()
+    print(
+        f"{'runtime':<8} {'threads':>8} {'rss MiB':>9} {'wakeups/s':>10} {'cpu ms/s':>9}"
+        f" {'connected':>10}"
+    )
+    for runtime in args.runtime or ("threads", "asyncio"):
+        # A fresh process per runtime, so that neither inherits the memory of the other
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--child",
+                runtime,
+                "--port",
+                str(port),
+                "--duration",
+                str(args.duration),
+                "--warmup",
+                str(args.warmup),
+                "--publish-interval",
+                str(args.publish_interval),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{runtime:<8} {result['threads']:>8} {result['rss_mb']:>9.1f}"
+            f" {result['wakeups_per_s']:>10.1f} {result['cpu_ms_per_s']:>9.2f}"
+            f" {str(result['connected']):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
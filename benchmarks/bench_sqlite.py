@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Benchmark of the device database under mixed concurrent load, for every SQLite storage profile.
+
+Every profile gets a fresh database in a temporary directory. Reader threads look settings up and
+list the users, as the web interface does, while writer threads save settings, as the settings
+page does, all through the app's session and connection pool. Throughput, the p50 and p99 time of
+an operation and the number of "database is locked" errors are reported per operation kind.
+
+Usage: python benchmarks/bench_sqlite.py [--duration SECONDS] [--readers N] [--writers N]
+                                         [--profile NAME ...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from amazing_iot_device import create_app, db  # noqa: E402
+from amazing_iot_device.models import Settings, User  # noqa: E402
+from amazing_iot_device.storage import PROFILES  # noqa: E402
+
+SETTINGS_COUNT = 200
+
+
+def read(index):
+    """Look a setting up and list the users."""
+    Settings.query.filter_by(key=f"setting_{index}").first()
+    User.query.all()
+
+
+def write(index):
+    """Save a setting."""
+    Settings.query.filter_by(key=f"setting_{index}").first().value = str(time.time())
+    db.session.commit()
+
+
+def worker(app, operation, stop, seed, timings, errors):
+    """Run ``operation`` until ``stop`` is set, collecting its timings and lock errors."""
+    rng = random.Random(seed)
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                operation(rng.randrange(SETTINGS_COUNT))
+            except OperationalError:
+                db.session.rollback()
+                errors.append(1)
+                continue
+            timings.append(time.perf_counter() - start)
+        db.session.remove()
+
+
+def measure(profile, duration, readers, writers):
+    """Run the mixed load against a fresh database and return the results per operation."""
+    directory = tempfile.mkdtemp()
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.sqlite')}",
+            "SQLITE_PROFILE": profile,
+            "SQLITE_POOL_SIZE": readers + writers,
+        }
+    )
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            Settings(key=f"setting_{index}", value="0") for index in range(SETTINGS_COUNT)
+        )
+        user = User(username="admin")
+        user.set_password("admin")
+        db.session.add(user)
+        db.session.commit()
+
+    stop = threading.Event()
+    results = {kind: ([], []) for kind in ("read", "write")}
+    threads = [
+        threading.Thread(target=worker, args=(app, read, stop, index, *results["read"]))
+        for index in range(readers)
+    ] + [
+        threading.Thread(target=worker, args=(app, write, stop, -index, *results["write"]))
+        for index in range(1, writers + 1)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        db.engine.dispose()
+
+    summary = {}
+    for kind, (timings, errors) in results.items():
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else [0.0] * 99
+        summary[kind] = {
+            "ops_per_s": len(timings) / duration,
+            "p50_ms": quantiles[49] * 1000,
+            "p99_ms": quantiles[98] * 1000,
+            "locked": len(errors),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--profile", action="append", help="Only run the named profiles")
+    args = parser.parse_args()
+
+    print(f"{'profile':<9} {'op':<6} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'locked':>7}")
+    for profile in args.profile or PROFILES:
+        summary = measure(profile, args.duration, args.readers, args.writers)
+        for kind, result in summary.items():
+            print(
+                f"{profile:<9} {kind:<6} {result['ops_per_s']:>9.0f} {result['p50_ms']:>8.2f}"
+                f" {result['p99_ms']:>8.2f} {result['locked']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
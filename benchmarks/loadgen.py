@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+"""
+Load test of an MQTT broker and the cloud receiver with thousands of simulated devices.
+
+Without --host the devices publish to the embedded broker, so the tool works offline.
+
+Usage: python benchmarks/loadgen.py [--devices N] [--interval SECONDS] [--jitter FRACTION]
+                                    [--duration SECONDS] [--host HOST --port PORT]
+"""
+
+import os
+import sys
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from amazing_iot_device.loadgen import main  # noqa: E402
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,26 @@ def create_app(test_config=None):
         SECRET_KEY=os.environ.get("SECRET_KEY", "dev"),  # Should be overridden in production
         SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, "device.sqlite"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # "threads" or "asyncio", see async_runtime.py
+        AGENT_RUNTIME=os.environ.get("AGENT_RUNTIME", "threads"),
+        # Lets a scraper read /metrics with an "Authorization: Bearer <token>" header
+        METRICS_TOKEN=os.environ.get("METRICS_TOKEN", ""),
+        # Live dashboards beyond this number poll the JSON API instead of streaming
+        DASHBOARD_MAX_STREAMS=int(os.environ.get("DASHBOARD_MAX_STREAMS", "32")),
+        # SQLite pragmas and connection pool of the database, see storage.py
+        SQLITE_PROFILE=os.environ.get("SQLITE_PROFILE", "balanced"),
+        SQLITE_POOL_SIZE=int(os.environ.get("SQLITE_POOL_SIZE", "10")),
+        # Seconds a logged-in user is served from memory, 0 to load it on every request
+        USER_CACHE_TTL=float(os.environ.get("USER_CACHE_TTL", "60")),
+        # Login attempts per minute per client address and per username, 0 for no limit
+        LOGIN_ADDRESS_RATE=float(os.environ.get("LOGIN_ADDRESS_RATE", "10")),
+        LOGIN_USERNAME_RATE=float(os.environ.get("LOGIN_USERNAME_RATE", "5")),
+        # Concurrent MQTT broker connection tests, and seconds their results are reused
+        PROBE_WORKERS=int(os.environ.get("PROBE_WORKERS", "2")),
+        PROBE_CACHE_TTL=float(os.environ.get("PROBE_CACHE_TTL", "10")),
+        # Directory sharing the connection tests between worker processes, in the instance folder
+        # by default
+        PROBE_JOBS_PATH=os.environ.get("PROBE_JOBS_PATH", ""),
     )
 
     if test_config is None:
@@ -43,18 +63,44 @@ def create_app(test_config=None):
         pass
 
     # Initialize extensions with the app
+    from amazing_iot_device.storage import configure_storage, init_storage
+
+    configure_storage(app)
     db.init_app(app)
+    with app.app_context():
+        init_storage(app, db.engine)
     login_manager.init_app(app)
+
+    # Serve settings from memory, loaded from this app's database on first read
+    from amazing_iot_device.settings_repository import settings_repository
+
+    settings_repository.init_app(app)
     login_manager.login_view = "auth.login"
 
     # Register blueprints
-    from amazing_iot_device.auth import auth_bp
+    from amazing_iot_device.auth import auth_bp, init_auth
     from amazing_iot_device.dashboard import dashboard_bp
     from amazing_iot_device.settings import settings_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(settings_bp)
+    init_auth(app)
+
+    # Check MQTT brokers for the settings page in the background
+    from amazing_iot_device.probe import probe_service
+
+    probe_service.init_app(app)
+
+    # Time every request and serve the agent metrics
+    from amazing_iot_device.metrics import init_metrics
+
+    init_metrics(app)
+
+    # Push resource snapshots to the live dashboards
+    from amazing_iot_device.dashboard import init_dashboard
+
+    init_dashboard(app)
 
     # Create a route for the index page that redirects to dashboard if logged in
     @app.route("/")
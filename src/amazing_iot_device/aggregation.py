@@ -0,0 +1,190 @@
+"""
+Aggregation module for IoT device agent.
+This module rolls resource samples taken at a fast rate up into one summary per metric and publish
+window: minimum, maximum, mean, last value and a streaming quantile. Memory use is constant per
+metric whatever the number of samples in the window.
+"""
+
+import threading
+import time
+
+# Identifies the layout of an aggregate payload so that receivers can tell it from raw samples
+AGGREGATE_SCHEMA = "aggregate/1"
+
+
+class P2Quantile:
+    """Streaming quantile estimate using the P-square algorithm of Jain and Chlamtac (1985).
+
+    Five markers track the minimum, the maximum, the quantile and two points half way to it. Their
+    heights are adjusted with a piecewise parabolic prediction as samples arrive, so no sample is
+    stored after the first five.
+    """
+
+    __slots__ = ("quantile", "count", "_heights", "_positions", "_desired", "_increments")
+
+    def __init__(self, quantile=0.95):
+        """Initialize an estimator of the given quantile (between 0 and 1)."""
+        if not 0 < quantile < 1:
+            raise ValueError("Quantile must be between 0 and 1")
+        self.quantile = quantile
+        self.count = 0
+        self._heights = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4]
+        self._increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def add(self, value):
+        """Add a sample."""
+        self.count += 1
+        heights = self._heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find the cell the value falls into, extending the extremes if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        positions = self._positions
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            self._desired[index] += self._increments[index]
+
+        # Move the three middle markers towards their desired positions
+        for index in (1, 2, 3):
+            offset = self._desired[index] - positions[index]
+            if (offset >= 1 and positions[index + 1] - positions[index] > 1) or (
+                offset <= -1 and positions[index - 1] - positions[index] < -1
+            ):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = self._linear(index, step)
+                heights[index] = height
+                positions[index] += step
+
+    def value(self):
+        """Return the current estimate, or None without samples."""
+        if self.count == 0:
+            return None
+        if self.count > 5:
+            return self._heights[2]
+        # Too few samples for the markers, interpolate between the sorted samples instead
+        rank = self.quantile * (self.count - 1)
+        lower = int(rank)
+        upper = min(lower + 1, self.count - 1)
+        fraction = rank - lower
+        return self._heights[lower] + (self._heights[upper] - self._heights[lower]) * fraction
+
+    def _parabolic(self, index, step):
+        heights, positions = self._heights, self._positions
+        return heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+            (positions[index] - positions[index - 1] + step)
+            * (heights[index + 1] - heights[index])
+            / (positions[index + 1] - positions[index])
+            + (positions[index + 1] - positions[index] - step)
+            * (heights[index] - heights[index - 1])
+            / (positions[index] - positions[index - 1])
+        )
+
+    def _linear(self, index, step):
+        heights, positions = self._heights, self._positions
+        return heights[index] + step * (heights[index + step] - heights[index]) / (
+            positions[index + step] - positions[index]
+        )
+
+
+class MetricSummary:
+    """Constant-memory summary of the samples of one metric."""
+
+    __slots__ = ("count", "minimum", "maximum", "total", "last", "quantile")
+
+    def __init__(self, quantile=0.95):
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.last = None
+        self.quantile = P2Quantile(quantile)
+
+    def add(self, value):
+        """Add a sample."""
+        self.count += 1
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.total += value
+        self.last = value
+        self.quantile.add(value)
+
+    def to_dict(self):
+        """Return the rollup of the summarized samples."""
+        return {
+            "min": round(self.minimum, 2),
+            "max": round(self.maximum, 2),
+            "mean": round(self.total / self.count, 2),
+            "last": round(self.last, 2),
+            f"p{round(self.quantile.quantile * 100)}": round(self.quantile.value(), 2),
+            "count": self.count,
+        }
+
+
+class WindowAggregator:
+    """Per-metric summaries of the samples taken during one publish window."""
+
+    def __init__(self, quantile=0.95):
+        """Initialize an empty window estimating the given quantile of every metric."""
+        self.quantile = quantile
+        self._summaries = {}
+        self._start = None
+        self._end = None
+        self._count = 0
+        # Samples are added by the scheduler thread and flushed by a worker thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, resources, timestamp=None):
+        """Add a sample of resource metrics taken at ``timestamp`` (seconds since epoch)."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._start is None:
+                self._start = timestamp
+            self._end = timestamp
+            self._count += 1
+            for name, value in resources.items():
+                if not isinstance(value, int | float) or isinstance(value, bool):
+                    continue
+                summary = self._summaries.get(name)
+                if summary is None:
+                    summary = self._summaries[name] = MetricSummary(self.quantile)
+                summary.add(value)
+
+    def flush(self, device_id):
+        """Return the rollup payload of the window and start a new one."""
+        with self._lock:
+            summaries, self._summaries = self._summaries, {}
+            start, end, count = self._start, self._end, self._count
+            self._start = self._end = None
+            self._count = 0
+        if not count:
+            return None
+
+        return {
+            "schema": AGGREGATE_SCHEMA,
+            "device_id": device_id,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "count": count,
+            "metrics": {name: summary.to_dict() for name, summary in summaries.items()},
+        }
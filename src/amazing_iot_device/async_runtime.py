@@ -0,0 +1,586 @@
+"""
+Asyncio runtime module for IoT device agent.
+This module runs the MQTT service on a single asyncio event loop instead of a service thread, a
+worker pool, a connection thread and the paho network thread. The paho client socket is watched
+by the event loop, collectors and publish cycles are callbacks and tasks of the loop, waiting for
+acknowledgements suspends a task instead of blocking a thread, and connection probes from the
+settings page are multiplexed on the same loop.
+
+Calls that can only block, the TCP connect and DNS lookups, run on short-lived threads which exit
+as soon as the call returns, so an idle agent has a single thread besides the web server.
+"""
+
+import asyncio
+import inspect
+import logging
+import socket
+import threading
+import time
+
+import paho.mqtt.client as paho_mqtt
+
+from amazing_iot_device.connection import (
+    BACKOFF,
+    CONNECTED,
+    CONNECTING,
+    DISCONNECTED,
+    ExponentialBackoff,
+)
+from amazing_iot_device.metrics import PUBLISH_CYCLE_DURATION, SERVICE_ERRORS
+from amazing_iot_device.mqtt_protocol import DISCONNECT_PACKET, connect_packet
+from amazing_iot_device.sampler import resource_sampler
+from amazing_iot_device.scheduler import Scheduler
+
+logger = logging.getLogger("async_runtime")
+
+# Names of the runtimes an MQTT service can run on
+RUNTIMES = ("threads", "asyncio")
+
+# Longest time between two runs of the paho keepalive housekeeping, in seconds
+MISC_INTERVAL = 15.0
+
+
+def _call_on_loop(loop, func, *args):
+    """Call ``func`` right away on the loop thread, or hand it over to the loop otherwise."""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        func(*args)
+        return
+    try:
+        loop.call_soon_threadsafe(func, *args)
+    except RuntimeError:
+        # The loop was closed while the call was pending, nobody waits for it anymore
+        pass
+
+
+def _set_result(future, result=None, exception=None):
+    if future.cancelled():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def run_in_thread(loop, func, *args):
+    """Run a blocking call on a short-lived thread, returning a future of ``loop``.
+
+    Unlike ``loop.run_in_executor`` no worker thread is kept alive once the call has returned.
+    """
+    future = loop.create_future()
+
+    def target():
+        try:
+            result = func(*args)
+        except Exception as e:
+            _call_on_loop(loop, _set_result, future, None, e)
+        else:
+            _call_on_loop(loop, _set_result, future, result)
+
+    threading.Thread(target=target, name="async-runtime-call", daemon=True).start()
+    return future
+
+
+def _discard(future):
+    """Retrieve the outcome of a future nobody waits for, so that it is not reported."""
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncSocket:
+    """Drives the network I/O of a paho client from an asyncio event loop.
+
+    paho reports the socket it opens, closes and wants to write to through its external loop
+    callbacks. The socket is watched with the reader and writer callbacks of the loop instead of
+    a network thread, and the keepalive housekeeping runs as a periodic task.
+    """
+
+    def __init__(self, loop, client, misc_interval=MISC_INTERVAL):
+        """Attach to ``client``, whose socket events must then be served by ``loop``."""
+        self.loop = loop
+        self.client = client
+        self.misc_interval = misc_interval
+        self._fd = None
+        self._misc = None
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def suspend(self):
+        """Stop watching the current socket, before it is replaced from another thread."""
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self.loop.remove_writer(self._fd)
+            self._fd = None
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+    def close(self):
+        """Stop watching the current socket and close it."""
+        self.suspend()
+        sock = self.client.socket()
+        if sock is not None:
+            sock.close()
+
+    # The callbacks run on the loop thread, except while reconnect() runs on its own thread
+    def _on_socket_open(self, client, userdata, sock):
+        _call_on_loop(self.loop, self._watch, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        # Pass the descriptor, the socket is closed by the time a handed over call runs
+        _call_on_loop(self.loop, self._unwatch, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        _call_on_loop(self.loop, self._set_writing, sock.fileno(), True)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        _call_on_loop(self.loop, self._set_writing, sock.fileno(), False)
+
+    def _watch(self, fd):
+        self.suspend()
+        self._fd = fd
+        self.loop.add_reader(fd, self.client.loop_read)
+        self._misc = self.loop.create_task(self._run_misc())
+
+    def _unwatch(self, fd):
+        # A descriptor number may already have been reused by another socket of the loop
+        if fd == self._fd:
+            self.suspend()
+
+    def _set_writing(self, fd, writing):
+        if fd != self._fd:
+            return
+        if writing:
+            self.loop.add_writer(fd, self.client.loop_write)
+        else:
+            self.loop.remove_writer(fd)
+
+    async def _run_misc(self):
+        """Send keepalive pings and detect a silent broker until the connection ends."""
+        while self.client.loop_misc() == paho_mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(self.misc_interval)
+
+
+class AsyncConnection:
+    """Connection manager of the asyncio runtime, a task of the event loop.
+
+    It has the interface of ``connection.ConnectionManager`` and the same backoff behaviour, but
+    its methods must be called on the loop thread.
+    """
+
+    def __init__(
+        self,
+        loop,
+        client,
+        host,
+        port,
+        keepalive=60,
+        backoff=None,
+        connect_timeout=30.0,
+        stable_after=None,
+    ):
+        """Initialize the manager for ``client`` and the given broker."""
+        self.loop = loop
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff = backoff or ExponentialBackoff()
+        # Seconds to wait for the CONNACK of an attempt before giving up on it
+        self.connect_timeout = connect_timeout
+        # Seconds a connection must last before the backoff starts over, a keepalive by default
+        self.stable_after = keepalive if stable_after is None else stable_after
+        self.state = DISCONNECTED
+        # The broker tolerates one and a half keepalive periods of silence
+        self.socket = AsyncSocket(loop, client, misc_interval=min(MISC_INTERVAL, keepalive / 4))
+
+        self._task = None
+        self._connack = None
+        self._closed = None
+
+    def start(self):
+        """Start connecting in the background."""
+        # Only stores the broker address, the attempts are made by the manager task
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self._task = self.loop.create_task(self._run())
+
+    def stop(self, timeout=5):
+        """Disconnect and stop reconnecting."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.state == CONNECTED:
+            # The DISCONNECT packet is written by the loop, which then closes the socket
+            self.client.disconnect()
+        else:
+            self.socket.close()
+        self.state = DISCONNECTED
+
+    def connected(self, rc):
+        """Report the result of a CONNACK, from the client on_connect callback."""
+        _call_on_loop(self.loop, self._resolve, self._connack, rc)
+
+    def disconnected(self, rc):
+        """Report a lost connection, from the client on_disconnect callback."""
+        # A connection closed before its CONNACK counts as a failed attempt
+        _call_on_loop(self.loop, self._resolve, self._connack, None)
+        _call_on_loop(self.loop, self._resolve, self._closed, rc)
+
+    def _resolve(self, future, result):
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def _run(self):
+        while True:
+            if await self._attempt():
+                # Wait until the connection drops, starting the backoff over once it lasted
+                self._closed = self.loop.create_future()
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._closed), self.stable_after)
+                except TimeoutError:
+                    self.backoff.reset()
+                    await self._closed
+                self.state = DISCONNECTED
+                logger.warning("Connection to MQTT broker lost")
+
+            self.state = BACKOFF
+            delay = self.backoff.next_delay()
+            logger.info(f"Reconnecting to MQTT broker in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _attempt(self):
+        """Make one connection attempt, returning True once the broker accepted it."""
+        self.state = CONNECTING
+        self._connack = self.loop.create_future()
+        # reconnect() closes the previous socket from its own thread, stop reading it first
+        self.socket.suspend()
+        attempt = run_in_thread(self.loop, self.client.reconnect)
+        try:
+            await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            # Close the socket the abandoned attempt may still open
+            attempt.add_done_callback(lambda future: (_discard(future), self.socket.close()))
+            raise
+        except Exception as e:
+            logger.error(f"Failed to connect to MQTT broker at {self.host}:{self.port}: {str(e)}")
+            return False
+
+        # The CONNACK is read by the loop
+        try:
+            rc = await asyncio.wait_for(self._connack, self.connect_timeout)
+        except TimeoutError:
+            logger.error("No answer from MQTT broker")
+            return False
+        if rc == 0:
+            self.state = CONNECTED
+            return True
+        return False
+
+
+class AsyncScheduler(Scheduler):
+    """Scheduler running its jobs on an asyncio event loop.
+
+    Coroutine functions run as tasks and blocking jobs on short-lived threads, and like on the
+    threaded scheduler a run is skipped while the previous run of the same job is still going.
+    """
+
+    def __init__(self):
+        """Initialize the scheduler; the loop is the one calling ``run_async``."""
+        super().__init__(max_workers=0)
+        self.loop = None
+        self._wake_event = asyncio.Event()
+
+    def wake(self):
+        """Interrupt the current wait, from any thread."""
+        if self.loop is not None:
+            _call_on_loop(self.loop, self._wake_event.set)
+
+    async def run_async(self, stop_event):
+        """Run jobs until ``stop_event`` is set."""
+        self.loop = asyncio.get_running_loop()
+        while not stop_event.is_set():
+            self._wake_event.clear()
+            timeout = self.run_pending()
+            if stop_event.is_set():
+                break
+            # Sleep until the next deadline, a job change, or the stop request
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def shutdown(self, wait=False):
+        """Cancel the runs that are still going."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.future is not None and not job.future.done():
+                job.future.cancel()
+
+    def _execute(self, job):
+        """Run a job inline, as a task when it is a coroutine, or on a thread when blocking."""
+        asynchronous = inspect.iscoroutinefunction(job.func)
+        if not asynchronous and not job.blocking:
+            self._call(job)
+            return
+
+        if job.future is not None and not job.future.done():
+            # Never queue a second run of a slow job behind the first one
+            logger.warning(f"Job {job.name} is still running, skipping this run")
+            return
+        if asynchronous:
+            job.future = self.loop.create_task(self._call_async(job))
+        else:
+            job.future = run_in_thread(self.loop, self._call, job)
+
+    async def _call_async(self, job):
+        """Await the job coroutine, logging instead of propagating errors."""
+        try:
+            await job.func()
+        except Exception as e:
+            logger.error(f"Error in job {job.name}: {str(e)}")
+
+
+class AsyncRuntime:
+    """Runs an MQTT service on a single asyncio event loop.
+
+    The service keeps its settings, topic builders, pipeline and outbox; this class replaces the
+    threads that drive them.
+    """
+
+    def __init__(self, service):
+        """Initialize the runtime of ``service``."""
+        self.service = service
+        self.loop = None
+        # Set on broker acknowledgements; an event belongs to one loop, so one is made per run
+        self._acked = None
+        self._tasks = set()
+
+    def create_scheduler(self):
+        """Return a scheduler for the event loop, refreshing the shared resource snapshot."""
+        scheduler = AsyncScheduler()
+        # Replaces the sampler thread while the service runs, readers still refresh a stale
+        # snapshot themselves
+        scheduler.add_job("sample:resources", self._refresh_snapshot, resource_sampler.interval)
+        return scheduler
+
+    def create_connection(self, client, host, port, backoff=None):
+        """Return a connection manager running on the event loop."""
+        return AsyncConnection(asyncio.get_running_loop(), client, host, port, backoff=backoff)
+
+    def run(self, scheduler, stop_event):
+        """Run the service on a new event loop until ``stop_event`` is set."""
+        asyncio.run(self._main(scheduler, stop_event))
+
+    def spawn(self, coroutine):
+        """Run ``coroutine`` as a task of the loop, keeping a reference until it is done."""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def acknowledged(self):
+        """Wake the publish task up after a broker acknowledgement, from on_publish."""
+        loop, acked = self.loop, self._acked
+        if loop is not None and acked is not None:
+            _call_on_loop(loop, acked.set)
+
+    def probe(self, host, port, username="", password="", timeout=5.0):
+        """Check a broker from another thread, running the probe on the event loop."""
+        loop = self.loop
+        if loop is None:
+            raise RuntimeError("The asyncio runtime is not running")
+        future = asyncio.run_coroutine_threadsafe(
+            probe_broker(host, port, username, password, timeout=timeout), loop
+        )
+        return future.result(timeout + 1)
+
+    async def _main(self, scheduler, stop_event):
+        service = self.service
+        self._acked = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        # The event loop refreshes the snapshot while it runs, the sampler thread otherwise
+        sampler_thread = resource_sampler.is_running and resource_sampler.source is None
+        if sampler_thread:
+            resource_sampler.stop()
+        try:
+            # Connect in the background, sampling starts right away and samples taken while
+            # disconnected go to the outbox
+            service.connection = service._create_connection()
+            service.connection.start()
+
+            await scheduler.run_async(stop_event)
+
+        except Exception as e:
+            logger.error(f"Error in MQTT service: {str(e)}")
+            SERVICE_ERRORS.inc()
+        finally:
+            scheduler.shutdown()
+            # The last connection and client of this run, replaced by reconnects on this loop
+            # only, see MQTTService._wait_for_previous_run
+            connection, client = service.connection, service.client
+            if connection:
+                connection.stop()
+            # Give the loop a moment to write the DISCONNECT packet
+            deadline = time.monotonic() + 1.0
+            while client.socket() is not None and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            self.loop = None
+            self._acked = None
+            if sampler_thread and not resource_sampler.is_running:
+                resource_sampler.start()
+
+    def _refresh_snapshot(self):
+        resource_sampler.get_snapshot(max_age=resource_sampler.interval / 2)
+
+    async def publish(self, build_topics):
+        """Publish the topics of a cycle, waiting for acknowledgements without blocking."""
+        with PUBLISH_CYCLE_DURATION.time():
+            await self._publish_cycle(build_topics)
+
+    async def _publish_cycle(self, build_topics):
+        service = self.service
+        cycle = build_topics()
+        if cycle is None:
+            return
+        topics, timestamp = cycle
+        if not service.client.is_connected():
+            logger.warning("Not connected to MQTT broker, keeping the sample in the outbox")
+            service._store_offline(topics, timestamp)
+            return
+
+        deadline = time.monotonic() + service.pipeline.timeout
+        content_hashes = {}
+        unsent = {}
+        for topic_suffix, topic, payload, message, retain in service._encode_topics(
+            topics, content_hashes
+        ):
+            sent = await self._submit(topic, message, 1, retain, deadline)
+            if sent is None:
+                logger.warning(f"Failed to publish to {topic}")
+                unsent[topic_suffix] = payload
+
+        completed, pending = await self._drain(deadline)
+        if service._finish_publish(completed, pending, content_hashes, unsent, timestamp):
+            # Fresh samples went out first, now forward part of the backlog
+            await self._drain_outbox()
+
+    async def _drain_outbox(self):
+        """Forward queued messages at the configured drain rate, like the threaded drain."""
+        service = self.service
+        outbox, pipeline = service.outbox, service.pipeline
+        outbox.evict_expired()
+        start = time.monotonic()
+        end = start + service.publish_interval / 2
+        forwarded = 0
+
+        while outbox.depth and service.client.is_connected():
+            now = time.monotonic()
+            if now >= end:
+                break
+
+            budget = outbox.take_drain_budget(pipeline.window * 4)
+            if budget == 0:
+                await asyncio.sleep(min(1.0 / max(outbox.drain_rate, 1.0), end - now))
+                continue
+
+            batch_deadline = min(end, now + pipeline.timeout)
+            tracked = {}
+            for queued in outbox.peek(budget):
+                sent = await self._submit(
+                    queued.topic, queued.payload, queued.qos, queued.retain, batch_deadline
+                )
+                if sent is None:
+                    break
+                tracked[sent] = queued.id
+
+            completed, pending = await self._drain(batch_deadline)
+            acked = service._remove_forwarded(tracked, completed)
+            forwarded += acked
+
+            if pending or acked < budget:
+                # The broker is not keeping up, try again in the next cycle
+                break
+
+        service._record_drain(forwarded, start)
+
+    async def _submit(self, topic, payload, qos, retain, deadline):
+        """Publish once a slot of the in-flight window is free, or return None at the deadline."""
+        pipeline = self.service.pipeline
+        while not pipeline.available:
+            if not await self._wait_for_ack(deadline):
+                logger.warning(f"Publish window full, dropping message for {topic}")
+                return None
+        return pipeline.submit(
+            self.service.client, topic, payload, qos=qos, retain=retain, deadline=time.monotonic()
+        )
+
+    async def _drain(self, deadline):
+        """Wait until every in-flight message is acknowledged or the deadline expires."""
+        pipeline = self.service.pipeline
+        while pipeline.inflight and await self._wait_for_ack(deadline):
+            pass
+        return pipeline.drain(deadline=time.monotonic())
+
+    async def _wait_for_ack(self, deadline):
+        """Wait for the next acknowledgement, returning False once the deadline has passed."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        self._acked.clear()
+        try:
+            await asyncio.wait_for(self._acked.wait(), remaining)
+        except TimeoutError:
+            pass
+        return True
+
+
+async def probe_broker(host, port, username="", password="", client_id=None, timeout=5.0):
+    """
+    Check that an MQTT broker accepts a connection with the given credentials.
+
+    A bare CONNECT and CONNACK exchange over an asyncio stream, so many probes can run on the
+    event loop at once. Returns a dict with ``success`` and a human readable ``message``.
+    """
+    client_id = client_id or f"amazingiot-test-{int(time.time())}"
+    packet = connect_packet(client_id, username, password, keepalive=10)
+    try:
+        rc = await asyncio.wait_for(_exchange_connect(host, port, packet), timeout)
+    except TimeoutError:
+        return {"success": False, "message": f"Timed out connecting to {host}:{port}"}
+    except Exception as e:
+        return {"success": False, "message": f"Error connecting to MQTT broker: {str(e)}"}
+
+    if rc == 0:
+        return {
+            "success": True,
+            "message": f"Successfully connected to MQTT broker at {host}:{port}",
+        }
+    return {"success": False, "message": f"Failed to connect with code {rc}"}
+
+
+async def _exchange_connect(host, port, packet):
+    """Send a CONNECT packet and return the return code of the CONNACK."""
+    loop = asyncio.get_running_loop()
+    # Resolve on a short-lived thread, the default executor would keep its threads around
+    addresses = await run_in_thread(loop, socket.getaddrinfo, host, port, 0, socket.SOCK_STREAM)
+    address = addresses[0][4]
+    reader, writer = await asyncio.open_connection(address[0], address[1])
+    try:
+        writer.write(packet)
+        await writer.drain()
+        connack = await reader.readexactly(4)
+        if connack[0] != 0x20:
+            raise ConnectionError(f"Unexpected answer from MQTT broker: {connack.hex()}")
+        if connack[3] == 0:
+            writer.write(DISCONNECT_PACKET)
+            await writer.drain()
+        return connack[3]
+    finally:
+        writer.close()
@@ -2,19 +2,75 @@
 Authentication module for IoT device agent.
 """
 
-from flask import Blueprint, flash, redirect, render_template, request, url_for
-from flask_login import login_required, login_user, logout_user
+import math
+
+from flask import Blueprint, flash, make_response, redirect, render_template, request, url_for
+from flask_login import UserMixin, login_required, login_user, logout_user
 from flask_wtf import FlaskForm
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from werkzeug.security import check_password_hash
 from wtforms import PasswordField, StringField, SubmitField
 from wtforms.validators import DataRequired
 
 from amazing_iot_device import db, login_manager
+from amazing_iot_device.cache import TTLCache
+from amazing_iot_device.metrics import LOGIN_ATTEMPTS, LOGIN_LIMITER_KEYS
 from amazing_iot_device.models import User
+from amazing_iot_device.ratelimit import TokenBucketLimiter
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
+class UserCache(TTLCache):
+    """Cache of users, dropped when another process changes a user, see coordination.py."""
+
+    def __init__(self, maxsize=64, ttl=60.0):
+        """Initialize an empty cache, not shared with other processes."""
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._shared = None  # Users version counter shared with other processes
+        self._seen = None  # Value of the shared counter the entries were loaded at
+
+    def share(self, counter):
+        """
+        Follow the user changes of other processes through ``counter``, an object with a
+        ``users_version`` property and a ``bump_users_version`` method, or stop with None.
+        """
+        self.clear()
+        self._shared = counter
+        self._seen = None if counter is None else counter.users_version
+
+    def get(self, key, default=None):
+        """Return the cached user of ``key``, after dropping all if another process changed one."""
+        shared = self._shared
+        if shared is not None:
+            version = shared.users_version
+            if version != self._seen:
+                self.clear()
+                self._seen = version
+        return super().get(key, default)
+
+    def changed(self, user_ids):
+        """Drop users whose change was committed, here and in the other processes."""
+        for user_id in user_ids:
+            self.pop(user_id)
+        shared = self._shared
+        if shared is not None and user_ids:
+            seen = shared.bump_users_version()
+            # When another process changed users meanwhile, everything is dropped on the next get
+            if self._seen is not None and seen == self._seen + 1:
+                self._seen = seen
+
+
+# Users of authenticated requests, so that loading the logged-in user skips the database
+user_cache = UserCache(maxsize=64, ttl=60.0)
+
+# Login attempts per client address and per username, refilled every minute. Password hashing is
+# deliberately slow, so a flood of attempts would otherwise starve the agent of CPU
+address_limiter = TokenBucketLimiter(rate=10 / 60, burst=10)
+username_limiter = TokenBucketLimiter(rate=5 / 60, burst=5)
+
+
 class LoginForm(FlaskForm):
     """Login form for user authentication."""
 
@@ -23,10 +79,70 @@ class LoginForm(FlaskForm):
     submit = SubmitField("Log In")
 
 
+class SessionUser(UserMixin):
+    """Read-only copy of a user, safe to share between requests and threads."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+
+    def __repr__(self):
+        return f"<SessionUser {self.username}>"
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    """Load a user from the database."""
-    return User.query.get(int(user_id))
+    """Load the logged-in user, from the user cache or the database."""
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    user = user_cache.get(user_id)
+    if user is None:
+        stored = db.session.get(User, user_id)
+        if stored is None:
+            return None
+        user = SessionUser(stored)
+        user_cache.set(user_id, user)
+    return user
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    """Drop a changed user from the cache, now and once the change is committed."""
+    user_cache.pop(target.id)
+    # A request loading the user before the commit would cache the old row again
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_committed_users(session):
+    user_cache.changed(session.info.pop("changed_users", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changed_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        user_cache.pop(user_id)
+
+
+def init_auth(app):
+    """Size the user cache and the login limiters from the app config, resetting them."""
+    user_cache.configure(
+        maxsize=app.config.get("USER_CACHE_SIZE", user_cache.maxsize),
+        ttl=app.config.get("USER_CACHE_TTL", user_cache.ttl),
+    )
+    maxsize = app.config.get("LOGIN_LIMITER_SIZE", 1024)
+    for limiter, key in (
+        (address_limiter, "LOGIN_ADDRESS_RATE"),
+        (username_limiter, "LOGIN_USERNAME_RATE"),
+    ):
+        # Attempts per minute, which may also be made at once
+        rate = float(app.config.get(key, limiter.burst))
+        limiter.configure(rate=rate / 60, burst=rate, maxsize=maxsize)
 
 
 @auth_bp.route("/login", methods=["GET", "POST"])
@@ -34,15 +150,38 @@ def login():
     """Handle user login."""
     form = LoginForm()
     if form.validate_on_submit():
+        retry_after = _throttle(request.remote_addr or "", form.username.data)
+        if retry_after:
+            LOGIN_ATTEMPTS.labels("throttled").inc()
+            flash(f"Too many login attempts, try again in {retry_after} seconds")
+            response = make_response(render_template("auth/login.html", form=form), 429)
+            response.headers["Retry-After"] = str(retry_after)
+            return response
         user = User.query.filter_by(username=form.username.data).first()
         if user and check_password_hash(user.password_hash, form.password.data):
+            LOGIN_ATTEMPTS.labels("success").inc()
             login_user(user)
             next_page = request.args.get("next")
             return redirect(next_page or url_for("dashboard.index"))
+        LOGIN_ATTEMPTS.labels("failure").inc()
         flash("Invalid username or password")
     return render_template("auth/login.html", form=form)
 
 
+def _throttle(address, username):
+    """Count a login attempt, returning 0 or the seconds to wait when over the limit."""
+    # Usernames are normalized, so that case variants share a bucket
+    username = username.strip().lower()[:64]
+    retry_after = 0.0
+    if not address_limiter.acquire(address):
+        retry_after = address_limiter.retry_after(address)
+    elif not username_limiter.acquire(username):
+        retry_after = username_limiter.retry_after(username)
+    LOGIN_LIMITER_KEYS.labels("address").set(len(address_limiter))
+    LOGIN_LIMITER_KEYS.labels("username").set(len(username_limiter))
+    return math.ceil(retry_after)
+
+
 @auth_bp.route("/logout")
 @login_required
 def logout():
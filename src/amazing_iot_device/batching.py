@@ -0,0 +1,69 @@
+"""
+Batching module for IoT device agent.
+This module buffers resource samples taken at a fast rate and packs them into a single columnar
+message per flush window.
+"""
+
+import threading
+import time
+
+# Identifies the layout of a batch payload so that receivers can expand it
+BATCH_SCHEMA = "batch/1"
+
+
+class SampleBatch:
+    """In-memory buffer of resource samples stored column by column."""
+
+    def __init__(self, max_samples=3600):
+        """Initialize an empty batch holding at most ``max_samples`` samples."""
+        self.max_samples = int(max_samples)
+        self._timestamps = []
+        self._columns = {}
+        # Samples are added by the scheduler thread and flushed by a worker thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    @property
+    def is_full(self):
+        """Return True when the batch cannot take more samples."""
+        return len(self._timestamps) >= self.max_samples
+
+    def add(self, resources, timestamp=None):
+        """Append a sample of resource metrics taken at ``timestamp`` (seconds since epoch)."""
+        with self._lock:
+            index = len(self._timestamps)
+            self._timestamps.append(time.time() if timestamp is None else timestamp)
+            for name, value in resources.items():
+                column = self._columns.get(name)
+                if column is None:
+                    # A metric that appears mid-window is padded for the earlier samples
+                    column = self._columns[name] = [None] * index
+                column.append(value)
+            # Metrics missing from this sample are padded as well
+            for column in self._columns.values():
+                if len(column) <= index:
+                    column.append(None)
+
+    def flush(self, device_id):
+        """Return the columnar payload of the buffered samples and empty the buffer."""
+        with self._lock:
+            timestamps, self._timestamps = self._timestamps, []
+            columns, self._columns = self._columns, {}
+        if not timestamps:
+            return None
+
+        start = timestamps[0]
+        return {
+            "schema": BATCH_SCHEMA,
+            "device_id": device_id,
+            "count": len(timestamps),
+            "start": round(start, 3),
+            # Offsets in milliseconds from the start of the batch keep the timestamps compact
+            "offsets": [round((timestamp - start) * 1000) for timestamp in timestamps],
+            "columns": {
+                name: [round(value, 2) if isinstance(value, float) else value for value in column]
+                for name, column in columns.items()
+            },
+        }
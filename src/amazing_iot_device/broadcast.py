@@ -0,0 +1,109 @@
+"""
+Broadcast module for IoT device agent.
+This module fans the messages of a single producer out to any number of Server-Sent Events
+streams. Every message is formatted once and the same text is handed to every stream, and a
+stream that falls behind skips to the latest message instead of queueing, so the cost of a
+message stays flat as viewers are added.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger("broadcast")
+
+# Milliseconds a browser waits before reconnecting a dropped stream
+RETRY_MS = 5000
+
+
+class Broadcaster:
+    """Latest-value fan-out of messages to Server-Sent Events streams."""
+
+    def __init__(self, event="message", max_streams=32, keepalive=15.0):
+        """Initialize a broadcaster without a message yet."""
+        self.event = event
+        self.max_streams = max_streams
+        self.keepalive = keepalive
+        self._cond = threading.Condition()
+        self._version = 0
+        self._data = None
+        self._frame = None
+        self._streams = 0
+
+    @property
+    def streams(self):
+        """Return the number of open streams."""
+        return self._streams
+
+    def publish(self, data):
+        """Publish a message, ``data`` being a single line of text such as JSON."""
+        with self._cond:
+            self._version += 1
+            self._data = data
+            self._frame = f"id: {self._version}\nevent: {self.event}\ndata: {data}\n\n"
+            self._cond.notify_all()
+
+    def latest(self):
+        """Return the latest message, or None before the first one."""
+        return self._data
+
+    def stream(self, on_idle=None, keepalive=None):
+        """
+        Open a stream, returning a generator of Server-Sent Events text, or None when the
+        maximum number of streams is open.
+
+        When no message arrived for ``keepalive`` seconds, ``on_idle`` is called, for example to
+        have the producer refresh a stale value, and a comment keeps the connection open.
+        """
+        with self._cond:
+            if self._streams >= self.max_streams:
+                logger.warning(f"Refusing a {self.event} stream, {self._streams} are open")
+                return None
+            self._streams += 1
+        return _Stream(self, self._events(on_idle, keepalive or self.keepalive))
+
+    def _release(self):
+        with self._cond:
+            self._streams -= 1
+
+    def _events(self, on_idle, keepalive):
+        yield f"retry: {RETRY_MS}\n\n"
+        version = 0
+        while True:
+            with self._cond:
+                if self._version == version:
+                    self._cond.wait(keepalive)
+                current, frame = self._version, self._frame
+            if current == version and on_idle is not None:
+                on_idle()
+                with self._cond:
+                    current, frame = self._version, self._frame
+            if current == version:
+                yield ": keepalive\n\n"
+                continue
+            version = current
+            yield frame
+
+
+class _Stream:
+    """Iterable of the events of one stream, giving its slot back when closed.
+
+    WSGI servers close the response iterable when the client disconnects or the response ends,
+    also when iteration never started, which a bare generator would not notice.
+    """
+
+    def __init__(self, broadcaster, events):
+        self._broadcaster = broadcaster
+        self._events = events
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            self._broadcaster._release()
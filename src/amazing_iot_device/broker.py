@@ -0,0 +1,298 @@
+"""
+Embedded MQTT broker module for IoT device agent.
+This module is a small asyncio MQTT 3.1.1 broker that stands in for Mosquitto in tests and
+benchmarks. It handles CONNECT with optional credentials, SUBSCRIBE and UNSUBSCRIBE with ``+`` and
+``#`` wildcards, QoS 0 and 1 PUBLISH with PUBACK, retained messages and keepalive. Sessions live in
+memory only: persistent sessions, QoS 2 and redelivery of unacknowledged messages are not
+supported.
+
+Usage: python -m amazing_iot_device.broker [--host HOST] [--port PORT]
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+
+from amazing_iot_device.mqtt_protocol import (
+    CONNECT,
+    DISCONNECT,
+    PINGREQ,
+    PINGRESP_PACKET,
+    PUBACK,
+    PUBLISH,
+    SUBSCRIBE,
+    UNSUBSCRIBE,
+    MQTTProtocolError,
+    connack_packet,
+    parse_connect,
+    parse_publish,
+    parse_subscribe,
+    parse_unsubscribe,
+    puback_packet,
+    publish_packet,
+    read_packet,
+    suback_packet,
+    topic_matches,
+    unsuback_packet,
+)
+
+logger = logging.getLogger("broker")
+
+# CONNACK return codes
+ACCEPTED = 0
+BAD_CREDENTIALS = 4
+NOT_AUTHORIZED = 5
+
+# Topics of the latest received messages kept for inspection
+RECENT_TOPICS = 1000
+
+
+class _Session:
+    """A connected client."""
+
+    def __init__(self, client_id, writer):
+        self.client_id = client_id
+        self.writer = writer
+        self.subscriptions = {}
+        self.packet_ids = itertools.cycle(range(1, 65536))
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class Broker:
+    """Asyncio MQTT 3.1.1 broker for tests and benchmarks.
+
+    ``credentials`` maps user names to passwords; when set, clients have to log in. A broker
+    answering every CONNECT with ``return_code``, or not at all when ``silent``, helps to test
+    connection failures.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        credentials=None,
+        return_code=ACCEPTED,
+        silent=False,
+        max_packet_size=1024 * 1024,
+    ):
+        """Initialize a stopped broker; port 0 picks a free port."""
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.return_code = return_code
+        self.silent = silent
+        self.max_packet_size = max_packet_size
+        self.connects = 0
+        self.received = 0
+        self.delivered = 0
+        self.published = collections.deque(maxlen=RECENT_TOPICS)
+        self.retained = {}
+        self._sessions = {}
+        self._handlers = set()
+        self._anonymous_ids = itertools.count(1)
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def clients(self):
+        """Return the number of connected clients."""
+        return len(self._sessions)
+
+    async def start_server(self):
+        """Start listening on the running event loop, returning the port."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"MQTT broker listening on {self.host}:{self.port}")
+        return self.port
+
+    async def close(self):
+        """Stop listening and disconnect every client."""
+        if self._server is not None:
+            self._server.close()
+        handlers = [task for task in self._handlers if not task.done()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    async def serve_forever(self):
+        """Run the broker on the running event loop until cancelled."""
+        await self.start_server()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    def start(self):
+        """Run the broker on an event loop of a background thread, returning the port."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="mqtt-broker")
+        self._thread.daemon = True
+        self._thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start_server(), self._loop).result(timeout=5)
+
+    def stop(self):
+        """Stop a broker started with ``start``."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        session = None
+        try:
+            packet_type, _, body = await asyncio.wait_for(
+                read_packet(reader, self.max_packet_size), 10
+            )
+            if packet_type != CONNECT:
+                raise MQTTProtocolError(f"Expected CONNECT, got packet type {packet_type}")
+            if self.silent:
+                await reader.read()
+                return
+            session, keepalive = self._connect(parse_connect(body), writer)
+            await writer.drain()
+            if session is None:
+                return
+
+            # A client silent for one and a half keepalive periods is disconnected
+            timeout = keepalive * 1.5 if keepalive else None
+            while True:
+                packet_type, flags, body = await asyncio.wait_for(
+                    read_packet(reader, self.max_packet_size), timeout
+                )
+                if packet_type == PUBLISH:
+                    await self._publish(session, flags, body)
+                elif packet_type == PUBACK:
+                    # Messages are not redelivered, so acknowledgements need no tracking
+                    pass
+                elif packet_type == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    packet_id, topic_filters = parse_unsubscribe(body)
+                    for topic_filter in topic_filters:
+                        session.subscriptions.pop(topic_filter, None)
+                    session.send(unsuback_packet(packet_id))
+                elif packet_type == PINGREQ:
+                    session.send(PINGRESP_PACKET)
+                elif packet_type == DISCONNECT:
+                    break
+                else:
+                    raise MQTTProtocolError(f"Unexpected packet type {packet_type}")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, TimeoutError):
+            pass
+        except MQTTProtocolError as e:
+            logger.warning(f"Closing connection after a protocol error: {str(e)}")
+        finally:
+            if session is not None and self._sessions.get(session.client_id) is session:
+                del self._sessions[session.client_id]
+            self._handlers.discard(task)
+            writer.close()
+
+    def _connect(self, connect, writer):
+        """Answer a CONNECT, returning the new session and its keepalive."""
+        self.connects += 1
+        return_code = self.return_code
+        if return_code == ACCEPTED and self.credentials is not None:
+            if connect["username"] is None:
+                return_code = NOT_AUTHORIZED
+            elif self.credentials.get(connect["username"]) != connect["password"]:
+                return_code = BAD_CREDENTIALS
+        writer.write(connack_packet(return_code))
+        if return_code != ACCEPTED:
+            return None, 0
+
+        client_id = connect["client_id"] or f"anonymous-{next(self._anonymous_ids)}"
+        previous = self._sessions.get(client_id)
+        if previous is not None:
+            # A client connecting again with the same ID takes over the session
+            previous.writer.close()
+        session = self._sessions[client_id] = _Session(client_id, writer)
+        return session, connect["keepalive"]
+
+    def _subscribe(self, session, body):
+        packet_id, topics = parse_subscribe(body)
+        granted = []
+        for topic_filter, qos in topics:
+            qos = min(qos, 1)
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+        session.send(suback_packet(packet_id, granted))
+
+        for topic, (payload, qos) in self.retained.items():
+            for topic_filter, granted_qos in topics:
+                if topic_matches(topic_filter, topic):
+                    self._deliver(session, topic, payload, min(qos, granted_qos), retain=True)
+                    break
+
+    async def _publish(self, session, flags, body):
+        topic, payload, qos, packet_id, retain = parse_publish(flags, body)
+        if qos > 1:
+            raise MQTTProtocolError("QoS 2 is not supported")
+        self.received += 1
+        self.published.append(topic)
+        if retain:
+            # An empty retained message clears the retained message of the topic
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+
+        subscribers = []
+        for subscriber in list(self._sessions.values()):
+            granted = [
+                sub_qos
+                for topic_filter, sub_qos in subscriber.subscriptions.items()
+                if topic_matches(topic_filter, topic)
+            ]
+            if granted:
+                self._deliver(subscriber, topic, payload, min(qos, max(granted)))
+                subscribers.append(subscriber)
+        if qos == 1:
+            session.send(puback_packet(packet_id))
+
+        # Waiting for slow subscribers pushes back on the publisher instead of queueing
+        for subscriber in subscribers:
+            if subscriber is not session:
+                try:
+                    await subscriber.writer.drain()
+                except ConnectionError:
+                    pass
+
+    def _deliver(self, session, topic, payload, qos, retain=False):
+        packet_id = next(session.packet_ids) if qos else None
+        session.send(publish_packet(topic, payload, qos, packet_id, retain))
+        self.delivered += 1
+
+
+def main(argv=None):
+    """Command line entry point of the broker."""
+    parser = argparse.ArgumentParser(description="Run a lightweight MQTT broker.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username", help="Require this user name to connect")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    credentials = {args.username: args.password} if args.username else None
+    broker = Broker(args.host, args.port, credentials=credentials)
+    try:
+        asyncio.run(broker.serve_forever())
+    except KeyboardInterrupt:
+        logger.info("MQTT broker stopped")
+
+
+if __name__ == "__main__":
+    main()
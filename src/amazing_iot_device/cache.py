@@ -0,0 +1,70 @@
+"""
+Cache module for IoT device agent.
+This module provides a small thread-safe cache whose entries expire a fixed time after they were
+stored, and which evicts the least recently used entry when full.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded least-recently-used cache with a time to live per entry."""
+
+    def __init__(self, maxsize=128, ttl=60.0, clock=time.monotonic):
+        """Initialize an empty cache; a ``ttl`` of 0 disables it."""
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()  # Key -> (expiry, value), least recently used first
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        """Change the size or time to live, dropping all entries."""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+            if ttl is not None:
+                self.ttl = float(ttl)
+            self._entries.clear()
+
+    def get(self, key, default=None):
+        """Return the value stored for ``key``, or ``default`` if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Store ``value`` for ``key``, evicting the least recently used entry when full."""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Drop the entry of ``key``, if any."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
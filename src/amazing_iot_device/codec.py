@@ -0,0 +1,271 @@
+"""
+Payload codec for IoT device messages.
+This module implements the compact binary wire format used as an alternative to JSON. It only
+depends on the standard library so that the same file can be shipped with the cloud receiver
+(src/cloud-service/mqtt-receiver/codec.py must stay an identical copy).
+
+A binary payload starts with a four byte header:
+
+    magic (0xA7) | format version | schema id | flags
+
+The magic byte can never start a JSON document, which lets receivers tell both formats apart
+without any out-of-band negotiation. The body is either a struct-packed record for well-known
+schemas, or a CBOR (RFC 8949) encoding of the payload for anything else. Bodies may be compressed
+with raw deflate primed with a preset dictionary of the key names the agent sends.
+"""
+
+import json
+import struct
+import zlib
+
+MAGIC = 0xA7
+FORMAT_VERSION = 1
+
+# Schema ids
+SCHEMA_CBOR = 0
+SCHEMA_RESOURCES = 1
+
+# Header flags
+FLAG_ZLIB = 0x01
+
+# Wire formats selectable on the device
+FORMATS = ("json", "binary", "binary+zlib")
+
+HEADER = struct.Struct("<BBBB")
+
+# Field order of the struct-packed resources record
+RESOURCES_FIELDS = (
+    "cpu_percent",
+    "memory_percent",
+    "memory_used_mb",
+    "memory_total_mb",
+    "disk_percent",
+    "disk_used_gb",
+    "disk_total_gb",
+)
+RESOURCES_RECORD = struct.Struct("<" + "f" * len(RESOURCES_FIELDS))
+
+# Formats of the CBOR arguments and floats following the initial byte, by additional info
+CBOR_ARGUMENTS = {
+    24: struct.Struct(">B"),
+    25: struct.Struct(">H"),
+    26: struct.Struct(">I"),
+    27: struct.Struct(">Q"),
+}
+CBOR_FLOATS = {26: struct.Struct(">f"), 27: struct.Struct(">d")}
+
+# Preset dictionary for deflate, ordered from least to most frequent since later bytes are
+# cheaper to reference. Changing it requires a new FORMAT_VERSION.
+ZDICT = (
+    b"os_nameos_versionos_releasedevice_versionpython_versionprocessorarchitecture"
+    b"ip_addresshostnamesystemnetworkfullbatch/1schemacountstartoffsetscolumns"
+    b"disk_total_gbdisk_used_gbdisk_percentmemory_total_mbmemory_used_mbmemory_percent"
+    b"cpu_percentresourcesdevice_idtimestamp"
+)
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be encoded or decoded."""
+
+
+def is_binary(data):
+    """Return True when ``data`` is a binary payload produced by this codec."""
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+
+def encode(payload, fmt="binary"):
+    """Encode a payload in the given wire format, returning bytes."""
+    if fmt == "json":
+        return json.dumps(payload).encode("utf-8")
+    if fmt not in FORMATS:
+        raise CodecError(f"Unknown payload format: {fmt}")
+
+    if _is_resources_record(payload):
+        schema = SCHEMA_RESOURCES
+        body = RESOURCES_RECORD.pack(*payload.values())
+    else:
+        schema = SCHEMA_CBOR
+        body = _cbor_encode(payload)
+
+    flags = 0
+    if fmt == "binary+zlib":
+        compressed = _compress(body)
+        # Small bodies can grow when compressed, keep whatever is smaller
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_ZLIB
+
+    return HEADER.pack(MAGIC, FORMAT_VERSION, schema, flags) + body
+
+
+def decode(data):
+    """Decode a binary or JSON payload."""
+    if not is_binary(data):
+        return json.loads(data)
+
+    _, version, schema, flags = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise CodecError(f"Unsupported payload format version: {version}")
+
+    body = bytes(data[HEADER.size :])
+    if flags & FLAG_ZLIB:
+        body = _decompress(body)
+
+    try:
+        if schema == SCHEMA_RESOURCES:
+            values = RESOURCES_RECORD.unpack(body)
+            return {
+                name: _round_float32(value)
+                for name, value in zip(RESOURCES_FIELDS, values, strict=True)
+            }
+        if schema == SCHEMA_CBOR:
+            value, offset = _cbor_decode(body, 0)
+            if offset != len(body):
+                raise CodecError("Trailing bytes after payload")
+            return value
+    except (struct.error, UnicodeDecodeError) as e:
+        raise CodecError(f"Malformed payload: {e}") from e
+    raise CodecError(f"Unknown payload schema: {schema}")
+
+
+def _is_resources_record(payload):
+    """Return True when the payload matches the struct-packed resources schema exactly."""
+    return (
+        isinstance(payload, dict)
+        and tuple(payload) == RESOURCES_FIELDS
+        and all(isinstance(value, int | float) for value in payload.values())
+    )
+
+
+def _compress(body):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _decompress(body):
+    try:
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+        return decompressor.decompress(body) + decompressor.flush()
+    except zlib.error as e:
+        raise CodecError(f"Invalid compressed payload: {e}") from e
+
+
+def _round_float32(value):
+    """Drop the noise digits a float32 round trip adds (12.3 instead of 12.300000190734863)."""
+    return float(f"{value:.7g}")
+
+
+def _cbor_head(major, length):
+    """Encode a CBOR major type with its argument."""
+    if length < 24:
+        return bytes([major << 5 | length])
+    if length < 0x100:
+        return bytes([major << 5 | 24, length])
+    if length < 0x10000:
+        return bytes([major << 5 | 25]) + struct.pack(">H", length)
+    if length < 0x100000000:
+        return bytes([major << 5 | 26]) + struct.pack(">I", length)
+    if length < 0x10000000000000000:
+        return bytes([major << 5 | 27]) + struct.pack(">Q", length)
+    raise CodecError(f"Integer too large for CBOR: {length}")
+
+
+def _cbor_encode(value):
+    """Encode a JSON compatible value (plus bytes) as CBOR."""
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        if value >= 0:
+            return _cbor_head(0, value)
+        return _cbor_head(1, -1 - value)
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 2**53:
+            # Whole numbers are smaller as integers
+            return _cbor_encode(int(value))
+        single = struct.pack(">f", value)
+        # Use single precision when it is accurate to a thousandth, which suits telemetry
+        # values but keeps full precision for large numbers such as epoch timestamps
+        if abs(struct.unpack(">f", single)[0] - value) <= 1e-3:
+            return b"\xfa" + single
+        return b"\xfb" + struct.pack(">d", value)
+    if isinstance(value, str):
+        encoded = value.encode("utf-8")
+        return _cbor_head(3, len(encoded)) + encoded
+    if isinstance(value, bytes | bytearray):
+        return _cbor_head(2, len(value)) + bytes(value)
+    if isinstance(value, list | tuple):
+        return _cbor_head(4, len(value)) + b"".join(_cbor_encode(item) for item in value)
+    if isinstance(value, dict):
+        parts = [_cbor_head(5, len(value))]
+        for key, item in value.items():
+            parts.append(_cbor_encode(str(key)))
+            parts.append(_cbor_encode(item))
+        return b"".join(parts)
+    raise CodecError(f"Cannot encode value of type {type(value).__name__}")
+
+
+def _cbor_read(fmt, data, offset):
+    """Read a number of format ``fmt`` at ``offset``, returning it and the next offset."""
+    if offset + fmt.size > len(data):
+        raise CodecError("Truncated payload")
+    return fmt.unpack_from(data, offset)[0], offset + fmt.size
+
+
+def _cbor_decode(data, offset):
+    """Decode one CBOR item starting at ``offset``, returning the value and the next offset."""
+    if offset >= len(data):
+        raise CodecError("Truncated payload")
+    initial = data[offset]
+    major, info = initial >> 5, initial & 0x1F
+    offset += 1
+
+    if major == 7:
+        if info == 20:
+            return False, offset
+        if info == 21:
+            return True, offset
+        if info == 22:
+            return None, offset
+        if info == 26:
+            value, offset = _cbor_read(CBOR_FLOATS[info], data, offset)
+            return _round_float32(value), offset
+        if info == 27:
+            return _cbor_read(CBOR_FLOATS[info], data, offset)
+        raise CodecError(f"Unsupported CBOR simple value: {info}")
+
+    if info < 24:
+        argument = info
+    elif info in CBOR_ARGUMENTS:
+        argument, offset = _cbor_read(CBOR_ARGUMENTS[info], data, offset)
+    else:
+        raise CodecError(f"Unsupported CBOR length encoding: {info}")
+
+    if major == 0:
+        return argument, offset
+    if major == 1:
+        return -1 - argument, offset
+    if major in (2, 3):
+        end = offset + argument
+        if end > len(data):
+            raise CodecError("Truncated payload")
+        chunk = bytes(data[offset:end])
+        return (chunk if major == 2 else chunk.decode("utf-8")), end
+    if major == 4:
+        items = []
+        for _ in range(argument):
+            item, offset = _cbor_decode(data, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        result = {}
+        for _ in range(argument):
+            key, offset = _cbor_decode(data, offset)
+            if not isinstance(key, str | int):
+                raise CodecError(f"Unsupported CBOR map key of type {type(key).__name__}")
+            result[key], offset = _cbor_decode(data, offset)
+        return result, offset
+    raise CodecError(f"Unsupported CBOR major type: {major}")
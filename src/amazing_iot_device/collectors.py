@@ -0,0 +1,389 @@
+"""
+Collectors module for IoT device agent.
+A collector gathers one group of metrics on its own schedule. The MQTT service runs every
+registered collector through the scheduler and merges their latest results into the published
+hardware information, keyed by the collector section ("system", "network", "resources", ...).
+
+Custom collectors can be added with ``register_collector``, either as a ``Collector`` subclass or
+by wrapping a function in a ``FunctionCollector``.
+"""
+
+import logging
+import threading
+import time
+
+import psutil
+
+from amazing_iot_device.rates import RateTracker
+from amazing_iot_device.sampler import resource_sampler
+from amazing_iot_device.system_info import get_system_info, network_info
+
+logger = logging.getLogger("collectors")
+
+
+class Collector:
+    """Base class of the collector plugins."""
+
+    # Unique name of the collector
+    name = None
+    # Key of the hardware information the collected values are merged into
+    section = "resources"
+    # Seconds between two collections
+    interval = 60.0
+    # Slow collectors run on the scheduler worker pool instead of the scheduler thread
+    blocking = False
+
+    def collect(self):
+        """Return a dict of collected values."""
+        raise NotImplementedError
+
+
+class FunctionCollector(Collector):
+    """Collector calling a plain function."""
+
+    def __init__(self, name, func, interval=60.0, section="resources", blocking=False):
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.section = section
+        self.blocking = blocking
+
+    def collect(self):
+        return self.func()
+
+
+def cpu_metrics(snapshot):
+    """Return the published CPU metrics of a sampler snapshot."""
+    return {"cpu_percent": snapshot.cpu_percent}
+
+
+def memory_metrics(snapshot):
+    """Return the published memory metrics of a sampler snapshot."""
+    return {
+        "memory_percent": snapshot.memory_percent,
+        "memory_used_mb": snapshot.memory_used / (1024 * 1024),
+        "memory_total_mb": snapshot.memory_total / (1024 * 1024),
+    }
+
+
+def disk_metrics(snapshot):
+    """Return the published disk metrics of a sampler snapshot."""
+    return {
+        "disk_percent": snapshot.disk_percent,
+        "disk_used_gb": snapshot.disk_used / (1024**3),
+        "disk_total_gb": snapshot.disk_total / (1024**3),
+    }
+
+
+class CPUCollector(Collector):
+    """CPU usage from the shared resource sampler."""
+
+    name = "cpu"
+    interval = 5.0
+
+    def collect(self):
+        return cpu_metrics(resource_sampler.get_snapshot())
+
+
+class MemoryCollector(Collector):
+    """Memory usage from the shared resource sampler."""
+
+    name = "memory"
+    interval = 10.0
+
+    def collect(self):
+        return memory_metrics(resource_sampler.get_snapshot())
+
+
+class DiskCollector(Collector):
+    """Usage of the root filesystem from the shared resource sampler."""
+
+    name = "disk"
+    interval = 60.0
+
+    def collect(self):
+        return disk_metrics(resource_sampler.get_snapshot())
+
+
+class NetworkCollector(Collector):
+    """Host name and IP address; the lookup may hit DNS, so it runs on the worker pool."""
+
+    name = "network"
+    section = "network"
+    interval = 300.0
+    blocking = True
+
+    def collect(self):
+        return network_info.get()
+
+
+class SystemCollector(Collector):
+    """Static system information."""
+
+    name = "system"
+    section = "system"
+    interval = 3600.0
+
+    def collect(self):
+        return get_system_info()
+
+
+class RatesCollector(Collector):
+    """Rate based diagnostics: per-core CPU, per-disk I/O, per-interface traffic and more.
+
+    Rates are computed from the counters of the previous collection, so the first collection only
+    reports the gauges (load, filesystems, temperatures). The number of disks, interfaces,
+    filesystems and sensors reported is capped by ``max_devices`` to keep the cost of a collection
+    bounded on hosts with many devices.
+    """
+
+    name = "rates"
+    section = "rates"
+    interval = 10.0
+
+    # Block devices without diagnostic value
+    IGNORED_DISK_PREFIXES = ("loop", "ram")
+    # Network and image filesystems whose usage is slow to query or meaningless
+    IGNORED_FSTYPES = frozenset(
+        ("nfs", "nfs4", "cifs", "smbfs", "smb3", "sshfs", "fuse.sshfs", "9p", "squashfs", "iso9660")
+    )
+    # Seconds the list of mounted filesystems is reused before it is read again
+    PARTITIONS_TTL = 300.0
+
+    def __init__(self, max_devices=32):
+        """Initialize the collector reporting at most ``max_devices`` entries per group."""
+        self.max_devices = max_devices
+        self._tracker = RateTracker()
+        self._boot_time = None
+        self._partitions = []
+        self._partitions_expiry = 0.0
+        # The collector keeps counter baselines and may be called from several threads
+        self._lock = threading.Lock()
+
+    def collect(self):
+        with self._lock:
+            now = time.monotonic()
+            self._check_boot_time()
+
+            result = {}
+            cpu_cores = self._cpu_cores(now)
+            if cpu_cores is not None:
+                result["cpu_cores"] = cpu_cores
+            result.update(self._cpu_stats(now))
+            result.update(self._load())
+            result["disks"] = self._disks(now)
+            result["interfaces"] = self._interfaces(now)
+            result["filesystems"] = self._filesystems(now)
+            temperatures = self._temperatures()
+            if temperatures:
+                result["temperatures"] = temperatures
+            return result
+
+    def _check_boot_time(self):
+        """Forget every baseline when the host rebooted since the previous collection."""
+        boot_time = psutil.boot_time()
+        # The boot time is derived from the wall clock and may jitter slightly
+        if self._boot_time is not None and abs(boot_time - self._boot_time) > 1:
+            logger.info("Host rebooted, resetting counter baselines")
+            self._tracker.reset()
+        self._boot_time = boot_time
+
+    def _cpu_cores(self, now):
+        """Return the busy percentage of every core."""
+        cores = []
+        for index, times in enumerate(psutil.cpu_times(percpu=True)):
+            # Guest time is already part of user and nice time on Linux, psutil.cpu_percent
+            # leaves it out of the total too
+            total = sum(times) - getattr(times, "guest", 0.0) - getattr(times, "guest_nice", 0.0)
+            idle = times.idle + getattr(times, "iowait", 0.0)
+            counters = {"busy": total - idle, "total": total}
+            rates = self._tracker.update(f"cpu{index}", counters, now)
+            if not rates or len(rates) < 2 or rates["total"] <= 0:
+                cores.append(None)
+                continue
+            cores.append(round(min(100.0, rates["busy"] / rates["total"] * 100), 2))
+        if all(core is None for core in cores):
+            return None
+        return cores
+
+    def _cpu_stats(self, now):
+        """Return context switches and interrupts per second."""
+        stats = psutil.cpu_stats()
+        counters = {"ctx_switches": stats.ctx_switches, "interrupts": stats.interrupts}
+        rates = self._tracker.update("cpu_stats", counters, now) or {}
+        return {f"{name}_per_s": round(value, 2) for name, value in rates.items()}
+
+    def _load(self):
+        """Return the 1, 5 and 15 minute load averages."""
+        try:
+            load_1, load_5, load_15 = psutil.getloadavg()
+        except (AttributeError, OSError):
+            return {}
+        return {
+            "load_1": round(load_1, 2),
+            "load_5": round(load_5, 2),
+            "load_15": round(load_15, 2),
+        }
+
+    def _disks(self, now):
+        """Return the throughput and IOPS of every block device."""
+        counters = psutil.disk_io_counters(perdisk=True, nowrap=False) or {}
+        names = sorted(
+            name for name in counters if not name.startswith(self.IGNORED_DISK_PREFIXES)
+        )[: self.max_devices]
+
+        disks = {}
+        for name in names:
+            io = counters[name]
+            rates = self._tracker.update(
+                f"disk:{name}",
+                {
+                    "read_bytes": io.read_bytes,
+                    "write_bytes": io.write_bytes,
+                    "read_count": io.read_count,
+                    "write_count": io.write_count,
+                },
+                now,
+            )
+            if rates:
+                disks[name] = {
+                    "read_bytes_per_s": round(rates.get("read_bytes", 0.0), 2),
+                    "write_bytes_per_s": round(rates.get("write_bytes", 0.0), 2),
+                    "read_iops": round(rates.get("read_count", 0.0), 2),
+                    "write_iops": round(rates.get("write_count", 0.0), 2),
+                }
+        self._prune("disk:", names)
+        return disks
+
+    def _interfaces(self, now):
+        """Return the traffic of every network interface."""
+        counters = psutil.net_io_counters(pernic=True, nowrap=False) or {}
+        names = sorted(counters)[: self.max_devices]
+
+        interfaces = {}
+        for name in names:
+            io = counters[name]
+            rates = self._tracker.update(
+                f"nic:{name}",
+                {
+                    "bytes_recv": io.bytes_recv,
+                    "bytes_sent": io.bytes_sent,
+                    "packets_recv": io.packets_recv,
+                    "packets_sent": io.packets_sent,
+                    "errors": io.errin + io.errout,
+                    "drops": io.dropin + io.dropout,
+                },
+                now,
+            )
+            if rates:
+                interfaces[name] = {
+                    f"{counter}_per_s": round(value, 2) for counter, value in rates.items()
+                }
+        self._prune("nic:", names)
+        return interfaces
+
+    def _filesystems(self, now):
+        """Return the usage of every mounted local filesystem."""
+        if now >= self._partitions_expiry:
+            partitions = psutil.disk_partitions(all=False)
+            self._partitions = sorted(
+                {
+                    partition.mountpoint
+                    for partition in partitions
+                    if partition.fstype not in self.IGNORED_FSTYPES
+                }
+            )[: self.max_devices]
+            self._partitions_expiry = now + self.PARTITIONS_TTL
+
+        filesystems = {}
+        for mountpoint in self._partitions:
+            try:
+                usage = psutil.disk_usage(mountpoint)
+            except OSError:
+                # Unmounted since the list was read
+                continue
+            filesystems[mountpoint] = {
+                "percent": usage.percent,
+                "used_gb": round(usage.used / (1024**3), 2),
+                "total_gb": round(usage.total / (1024**3), 2),
+            }
+        return filesystems
+
+    def _temperatures(self):
+        """Return the current temperature of every sensor in degrees Celsius."""
+        sensors_temperatures = getattr(psutil, "sensors_temperatures", None)
+        if sensors_temperatures is None:
+            return {}
+        try:
+            sensors = sensors_temperatures()
+        except (OSError, RuntimeError):
+            return {}
+
+        temperatures = {}
+        for chip, entries in sorted(sensors.items()):
+            for index, entry in enumerate(entries):
+                if len(temperatures) >= self.max_devices:
+                    return temperatures
+                temperatures[f"{chip}_{entry.label or index}"] = round(entry.current, 1)
+        return temperatures
+
+    def _prune(self, prefix, names):
+        """Drop the baselines of devices with the given key prefix that disappeared."""
+        keys = {f"{prefix}{name}" for name in names}
+        stale = [key for key in self._tracker.keys() if key.startswith(prefix) and key not in keys]
+        if stale:
+            self._tracker.forget(stale)
+
+
+class CollectorRegistry:
+    """Ordered set of collectors; results are merged in registration order."""
+
+    def __init__(self):
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def register(self, collector):
+        """Add a collector, replacing any collector registered under the same name."""
+        if not collector.name:
+            raise ValueError("Collectors must have a name")
+        if collector.interval <= 0:
+            raise ValueError(f"Interval of collector {collector.name} must be positive")
+        with self._lock:
+            self._collectors[collector.name] = collector
+        logger.debug(f"Registered collector {collector.name} every {collector.interval}s")
+        return collector
+
+    def unregister(self, name):
+        """Remove a collector. Unknown names are ignored."""
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def get(self, name):
+        """Return the collector registered under ``name``, or None."""
+        return self._collectors.get(name)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._collectors.values()))
+
+    def __len__(self):
+        return len(self._collectors)
+
+
+collector_registry = CollectorRegistry()
+
+
+def register_collector(collector):
+    """Register a collector with the default registry."""
+    return collector_registry.register(collector)
+
+
+for _collector in (
+    SystemCollector(),
+    NetworkCollector(),
+    CPUCollector(),
+    MemoryCollector(),
+    DiskCollector(),
+    RatesCollector(),
+):
+    register_collector(_collector)
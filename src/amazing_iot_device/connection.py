@@ -0,0 +1,167 @@
+"""
+Connection module for IoT device agent.
+This module keeps the MQTT client connected from a dedicated thread. Failed attempts and lost
+connections are retried after an exponential backoff with full jitter, so that a fleet of devices
+spreads its reconnects out instead of hitting a restarted broker all at once. The backoff only
+starts over once a connection has lasted a while, so a broker that accepts and then drops the
+client at once does not get hammered either. Publishing and
+sampling never wait for a connection attempt.
+"""
+
+import logging
+import math
+import random
+import threading
+import time
+
+logger = logging.getLogger("connection")
+
+# Connection states
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+BACKOFF = "backoff"
+
+
+class ExponentialBackoff:
+    """Exponential backoff with full jitter.
+
+    The n-th consecutive delay is drawn uniformly between 0 and ``min(cap, base * factor**n)``.
+    """
+
+    def __init__(self, base=1.0, cap=120.0, factor=2.0, rng=None):
+        """Initialize the backoff; ``rng`` defaults to the random module."""
+        if base <= 0 or cap < base or factor < 1:
+            raise ValueError("Backoff needs 0 < base <= cap and factor >= 1")
+        self.base = float(base)
+        self.cap = float(cap)
+        self.factor = float(factor)
+        self.attempts = 0
+        self._rng = rng or random
+
+    def ceiling(self):
+        """Return the largest delay the next attempt may wait."""
+        # Compares exponents rather than delays: the delay of attempt 1024 overflows a float
+        if self.factor > 1 and self.attempts < math.log(self.cap / self.base, self.factor):
+            return min(self.cap, self.base * self.factor**self.attempts)
+        return self.cap if self.factor > 1 else self.base
+
+    def next_delay(self):
+        """Return the delay in seconds before the next attempt."""
+        delay = self._rng.uniform(0, self.ceiling())
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        """Start over from the base delay, after a connection that lasted."""
+        self.attempts = 0
+
+
+class ConnectionManager:
+    """Connects an MQTT client and reconnects it whenever the connection is lost.
+
+    The client must be created with ``reconnect_on_failure=False`` so that its network thread
+    stops when the connection drops, and it must report its CONNACK and disconnections through
+    ``connected()`` and ``disconnected()``.
+    """
+
+    def __init__(
+        self,
+        client,
+        host,
+        port,
+        keepalive=60,
+        backoff=None,
+        connect_timeout=30.0,
+        stable_after=None,
+    ):
+        """Initialize the manager for ``client`` and the given broker."""
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff = backoff or ExponentialBackoff()
+        # Seconds to wait for the CONNACK of an attempt before giving up on it
+        self.connect_timeout = connect_timeout
+        # Seconds a connection must last before the backoff starts over, a keepalive by default
+        self.stable_after = keepalive if stable_after is None else stable_after
+        self.state = DISCONNECTED
+        self.thread = None
+
+        self._changed = threading.Event()
+        self._stop_event = threading.Event()
+        self._connack = None
+
+    def start(self):
+        """Start connecting in the background."""
+        self._stop_event.clear()
+        # Only stores the broker address, the attempts are made by the manager thread
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.thread = threading.Thread(target=self._run, name="mqtt-connection", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Disconnect, stop reconnecting and wait for the manager thread."""
+        self._stop_event.set()
+        self._changed.set()
+        if self.state == CONNECTED:
+            self.client.disconnect()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        self.state = DISCONNECTED
+
+    def connected(self, rc):
+        """Report the result of a CONNACK, from the client on_connect callback."""
+        self._connack = rc
+        self._changed.set()
+
+    def disconnected(self, rc):
+        """Report a lost connection, from the client on_disconnect callback."""
+        self._changed.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if self._attempt():
+                # Wait until the connection drops or the manager is stopped
+                stable_at = time.monotonic() + self.stable_after
+                while self.client.is_connected() and not self._stop_event.is_set():
+                    self._changed.wait(1.0)
+                    self._changed.clear()
+                    if self.backoff.attempts and time.monotonic() >= stable_at:
+                        self.backoff.reset()
+                self.state = DISCONNECTED
+                # Join the network thread, which ends when the connection is lost
+                self.client.loop_stop()
+                if not self._stop_event.is_set():
+                    logger.warning("Connection to MQTT broker lost")
+
+            if self._stop_event.is_set():
+                break
+            self.state = BACKOFF
+            delay = self.backoff.next_delay()
+            logger.info(f"Reconnecting to MQTT broker in {delay:.1f}s")
+            self._stop_event.wait(delay)
+
+    def _attempt(self):
+        """Make one connection attempt, returning True once the broker accepted it."""
+        self.state = CONNECTING
+        self._connack = None
+        self._changed.clear()
+        try:
+            self.client.reconnect()
+        except Exception as e:
+            logger.error(f"Failed to connect to MQTT broker at {self.host}:{self.port}: {str(e)}")
+            return False
+
+        # The CONNACK is read by the client network thread
+        self.client.loop_start()
+        self._changed.wait(self.connect_timeout)
+        if self._connack == 0 and not self._stop_event.is_set():
+            self.state = CONNECTED
+            return True
+
+        if self._connack is None and not self._stop_event.is_set():
+            logger.error("No answer from MQTT broker")
+        self.client.loop_stop()
+        return False
@@ -0,0 +1,430 @@
+"""
+Coordination module for IoT device agent.
+This module lets several web server processes serve the agent without duplicating its work. A
+file lock elects the one process that samples resources, records their history and runs the MQTT
+publisher. It shares its latest resource snapshot with the other processes through a small
+memory-mapped file, which also carries the settings and users versions that tell them to reload
+settings and drop cached users. It also reports its MQTT status and metrics in a status file every
+polling interval, which the other processes show instead of their own idle ones. When the elected
+process exits, the operating system releases the lock and another process takes over within a
+polling interval.
+"""
+
+import contextlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from amazing_iot_device.auth import user_cache
+from amazing_iot_device.history import history_store, init_history
+from amazing_iot_device.metrics import metrics_registry
+from amazing_iot_device.mqtt_service import init_mqtt_service, mqtt_service
+from amazing_iot_device.sampler import ResourceSnapshot, init_resource_sampler, resource_sampler
+from amazing_iot_device.settings_repository import settings_repository
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows, where every process serves alone
+    fcntl = None
+
+logger = logging.getLogger("coordination")
+
+# Layout of the shared state file: a header, the settings and users versions, then a resource
+# snapshot guarded by a sequence number that is odd while the snapshot is being written
+MAGIC = b"AIOT"
+LAYOUT_VERSION = 2
+HEADER = struct.Struct("<4sI")
+COUNTER = struct.Struct("<Q")
+SNAPSHOT = struct.Struct("<ddddQQdQQ")
+SETTINGS_VERSION_OFFSET = HEADER.size
+USERS_VERSION_OFFSET = SETTINGS_VERSION_OFFSET + COUNTER.size
+SEQUENCE_OFFSET = USERS_VERSION_OFFSET + COUNTER.size
+SNAPSHOT_OFFSET = SEQUENCE_OFFSET + COUNTER.size
+STATE_SIZE = SNAPSHOT_OFFSET + SNAPSHOT.size
+
+# Attempts of a reader to get a snapshot that was not being written meanwhile
+READ_ATTEMPTS = 100
+
+# Polling intervals after which the status reported by the elected process is considered stale
+STATUS_MAX_INTERVALS = 3
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock of the existing file at ``path``, waiting for other processes."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
+
+
+class SharedState:
+    """Memory-mapped state shared by the processes serving the agent.
+
+    The resource snapshot has a single writer, the elected process, and is read without locks:
+    readers retry when the sequence number shows a concurrent write. Settings and users version
+    bumps may come from any process and take a file lock.
+    """
+
+    def __init__(self, path):
+        """Map the state file at ``path``, creating or resetting it when needed."""
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock():
+            if os.fstat(self._fd).st_size != STATE_SIZE or os.pread(
+                self._fd, HEADER.size, 0
+            ) != HEADER.pack(MAGIC, LAYOUT_VERSION):
+                # A new file, or one written by another version of the agent
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, STATE_SIZE)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, LAYOUT_VERSION), 0)
+        self._map = mmap.mmap(self._fd, STATE_SIZE)
+
+    @property
+    def settings_version(self):
+        """Return the number of settings writes made by all processes."""
+        return COUNTER.unpack_from(self._map, SETTINGS_VERSION_OFFSET)[0]
+
+    def bump_settings_version(self):
+        """Count a settings write, returning the new version."""
+        with self._file_lock():
+            version = self.settings_version + 1
+            COUNTER.pack_into(self._map, SETTINGS_VERSION_OFFSET, version)
+        return version
+
+    @property
+    def users_version(self):
+        """Return the number of user changes committed by all processes."""
+        return COUNTER.unpack_from(self._map, USERS_VERSION_OFFSET)[0]
+
+    def bump_users_version(self):
+        """Count a user change, returning the new version."""
+        with self._file_lock():
+            version = self.users_version + 1
+            COUNTER.pack_into(self._map, USERS_VERSION_OFFSET, version)
+        return version
+
+    def write_snapshot(self, snapshot):
+        """Share a resource snapshot, for use as a resource sampler listener."""
+        sequence = COUNTER.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+        # Odd while writing, also when a previous writer died halfway
+        sequence = (sequence + 1) | 1
+        COUNTER.pack_into(self._map, SEQUENCE_OFFSET, sequence)
+        SNAPSHOT.pack_into(
+            self._map,
+            SNAPSHOT_OFFSET,
+            snapshot.timestamp,
+            snapshot.monotonic,
+            snapshot.cpu_percent,
+            snapshot.memory_percent,
+            snapshot.memory_used,
+            snapshot.memory_total,
+            snapshot.disk_percent,
+            snapshot.disk_used,
+            snapshot.disk_total,
+        )
+        COUNTER.pack_into(self._map, SEQUENCE_OFFSET, sequence + 1)
+
+    def read_snapshot(self):
+        """Return the shared resource snapshot, or None when there is none."""
+        for _ in range(READ_ATTEMPTS):
+            before = COUNTER.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+            if before % 2:
+                continue
+            fields = SNAPSHOT.unpack_from(self._map, SNAPSHOT_OFFSET)
+            if COUNTER.unpack_from(self._map, SEQUENCE_OFFSET)[0] != before:
+                continue
+            if not before:
+                return None
+            # The monotonic clock is system wide, so the snapshot age is valid here too, unless
+            # the snapshot was taken before a reboot
+            snapshot = ResourceSnapshot(*fields)
+            return snapshot if snapshot.age() >= 0 else None
+        return None
+
+    def close(self):
+        """Unmap and close the state file."""
+        self._map.close()
+        os.close(self._fd)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock of the state file, between processes."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class StatusFile:
+    """JSON file holding the latest status report of the elected process."""
+
+    def __init__(self, path):
+        """Initialize the status file at ``path``, which may not exist yet."""
+        self.path = path
+
+    def write(self, status):
+        """Replace the report with ``status``, so that readers never see a partial one."""
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(status, file)
+        os.replace(temporary, self.path)
+
+    def read(self):
+        """Return the latest report, or None when there is none."""
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+
+class LeaderLock:
+    """Non-blocking exclusive file lock, held by at most one process at a time."""
+
+    def __init__(self, path):
+        """Initialize the lock of the file at ``path``, not held yet."""
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        """Return whether this process holds the lock."""
+        return self._fd is not None
+
+    def try_acquire(self):
+        """Take the lock if no other process holds it, returning whether it is held."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        # The process ID is only written for people looking for the owner
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Give the lock up."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Coordinator:
+    """Elects the process that runs the agent services and keeps the others in sync."""
+
+    def __init__(self, interval=2.0):
+        """Initialize a stopped coordinator."""
+        # Seconds between two attempts to take over and two checks for settings changes
+        self.interval = float(interval)
+        self.lock = None
+        self.shared = None
+        self.status_file = None
+        self.is_leader = False
+        self.thread = None
+        self.is_running = False
+        self._on_leader = None
+        self._on_resign = None
+        self._stop_event = threading.Event()
+
+    def start(self, lock_path, state_path, on_leader, on_resign=None, status_path=None):
+        """
+        Join the processes serving the agent; ``on_leader`` is called in the one process that
+        holds the lock, when it takes it. When it fails, ``on_resign`` is called to undo what it
+        started, and the lock is given up. The elected process reports its status at
+        ``status_path``, by default next to the state file.
+        """
+        self.lock = LeaderLock(lock_path)
+        self.shared = SharedState(state_path)
+        self.status_file = StatusFile(
+            status_path or f"{os.path.splitext(state_path)[0]}-status.json"
+        )
+        self._on_leader = on_leader
+        self._on_resign = on_resign
+        settings_repository.share(self.shared)
+        user_cache.share(self.shared)
+        # Followers serve the metrics of the elected process
+        metrics_registry.source = self.leader_metrics
+
+        if not self._try_lead():
+            logger.info(f"Process {os.getpid()} serves the web interface only")
+            self._follow()
+
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="coordinator")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop coordinating and give the lock up."""
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if metrics_registry.source == self.leader_metrics:
+            metrics_registry.source = None
+        if self.shared is not None:
+            settings_repository.share(None)
+            user_cache.share(None)
+            self.shared.close()
+            self.shared = None
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+        self.is_leader = False
+
+    def _try_lead(self):
+        """Take the lock if it is free and start the agent services."""
+        if not self.lock.try_acquire():
+            return False
+        logger.info(f"Process {os.getpid()} runs the MQTT publisher and the resource sampler")
+        if resource_sampler.source is not None:
+            # A follower taking over after the previous owner exited
+            resource_sampler.stop()
+        try:
+            self._on_leader()
+        except Exception as e:
+            # Retried on the next interval, by this process or another one
+            logger.error(f"Error starting the agent services: {str(e)}")
+            self._resign()
+            return False
+        self.is_leader = True
+        self._report_status()
+        return True
+
+    def _resign(self):
+        """Undo a partial start of the agent services and give the lock up."""
+        if self._on_resign is not None:
+            try:
+                self._on_resign()
+            except Exception as e:
+                logger.error(f"Error stopping the agent services: {str(e)}")
+        self.lock.release()
+
+    def _follow(self):
+        """Take the snapshots of the elected process, unless already doing so."""
+        if not resource_sampler.is_running:
+            resource_sampler.follow(self.shared)
+
+    def leader_status(self):
+        """
+        Return the latest status report of the elected process when another process is elected,
+        or None when there is no recent one.
+        """
+        if self.is_leader or self.status_file is None:
+            return None
+        status = self.status_file.read()
+        if not status:
+            return None
+        age = time.time() - status.get("time", 0)
+        if not 0 <= age <= self.interval * STATUS_MAX_INTERVALS:
+            return None
+        return {**status, "age": age}
+
+    def leader_metrics(self):
+        """
+        Return the metrics to serve instead of those of this process, which does not publish: the
+        ones reported by the elected process, or these with a note when it has not reported.
+        """
+        if self.is_leader:
+            return None
+        status = self.leader_status()
+        if status is None:
+            return (
+                f"# Metrics of process {os.getpid()}, which does not publish; the publishing "
+                "process has not reported its metrics\n" + metrics_registry.render()
+            )
+        return (
+            f"# Metrics of the publishing process {status['pid']}, reported {status['age']:.1f}s "
+            f"ago, served by process {os.getpid()}\n" + status["metrics"]
+        )
+
+    def _report_status(self):
+        """Report the status of the agent services to the other processes."""
+        try:
+            self.status_file.write(
+                {
+                    "pid": os.getpid(),
+                    "time": time.time(),
+                    "mqtt": mqtt_service.status(),
+                    "metrics": metrics_registry.render(),
+                }
+            )
+        except OSError as e:
+            logger.error(f"Error reporting the agent status: {str(e)}")
+
+    def _run(self):
+        """Take over from a departed owner and pick up settings changes until stopped."""
+        while not self._stop_event.wait(self.interval):
+            try:
+                if self.is_leader:
+                    self._report_status()
+                elif not self._try_lead():
+                    self._follow()
+                # Notifies the MQTT service of settings saved by other processes
+                settings_repository.refresh()
+            except Exception as e:
+                logger.error(f"Error coordinating the agent processes: {str(e)}")
+
+
+coordinator = Coordinator()
+
+
+def agent_status():
+    """
+    Return the MQTT status of the process running the agent services, with its process ID and
+    the age of its report when it is another one, or None when it has not reported recently.
+    """
+    if not coordinator.is_running or coordinator.is_leader:
+        return mqtt_service.status()
+    status = coordinator.leader_status()
+    if status is None:
+        return None
+    return {**status["mqtt"], "pid": status["pid"], "age": round(status["age"], 1)}
+
+
+def init_coordination(app):
+    """Start the agent services in exactly one of the processes serving the app."""
+    coordinator.interval = float(app.config.get("COORDINATION_INTERVAL", coordinator.interval))
+    # Every process serves the history charts, only the elected one records it
+    history_store.init_app(app)
+
+    def lead():
+        init_resource_sampler(app)
+        resource_sampler.add_listener(coordinator.shared.write_snapshot)
+        init_history(app)
+        init_mqtt_service(app)
+
+    def resign():
+        if mqtt_service.is_running:
+            mqtt_service.stop()
+        resource_sampler.remove_listener(history_store.record)
+        resource_sampler.remove_listener(coordinator.shared.write_snapshot)
+        if resource_sampler.is_running:
+            resource_sampler.stop()
+
+    coordinator.start(
+        os.path.join(app.instance_path, "agent.lock"),
+        os.path.join(app.instance_path, "agent.state"),
+        lead,
+        resign,
+    )
@@ -2,43 +2,105 @@
 Dashboard module for IoT device agent.
 """
 
-import os
-import platform
+import json
+import time
 
-import psutil
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, jsonify, render_template, request
 from flask_login import login_required
 
+from amazing_iot_device.broadcast import Broadcaster
+from amazing_iot_device.history import TIERS, history_store
+from amazing_iot_device.metrics import DASHBOARD_STREAMS
+from amazing_iot_device.sampler import resource_sampler
+from amazing_iot_device.system_info import get_system_info
+
 dashboard_bp = Blueprint("dashboard", __name__, url_prefix="/dashboard")
 
+# Pushes every resource snapshot to the open dashboards
+metrics_broadcaster = Broadcaster(event="metrics")
+
+
+def resource_usage(snapshot):
+    """Convert a sampler snapshot into the resource usage shown on the dashboard."""
+    return {
+        "timestamp": snapshot.timestamp,
+        "cpu_percent": snapshot.cpu_percent,
+        "memory_percent": snapshot.memory_percent,
+        "memory_used": f"{snapshot.memory_used / (1024**3):.2f} GB",
+        "memory_total": f"{snapshot.memory_total / (1024**3):.2f} GB",
+        "disk_percent": snapshot.disk_percent,
+        "disk_used": f"{snapshot.disk_used / (1024**3):.2f} GB",
+        "disk_total": f"{snapshot.disk_total / (1024**3):.2f} GB",
+    }
+
+
+def broadcast_snapshot(snapshot):
+    """Send a new snapshot to the live dashboards, serialized once for all of them."""
+    metrics_broadcaster.publish(json.dumps(resource_usage(snapshot)))
+
 
 @dashboard_bp.route("/")
 @login_required
 def index():
     """Display the main dashboard with system information."""
     # Get system information
-    system_info = {
-        "os_name": platform.system(),
-        "os_version": platform.version(),
-        "os_release": platform.release(),
-        "device_version": os.environ.get("DEVICE_VERSION", "0.1.0"),
-        "python_version": platform.python_version(),
-        "hostname": platform.node(),
-        "processor": platform.processor(),
-        "architecture": platform.machine(),
-    }
+    system_info = get_system_info()
 
-    # Get CPU and memory usage
-    resource_usage = {
-        "cpu_percent": psutil.cpu_percent(interval=1),
-        "memory_percent": psutil.virtual_memory().percent,
-        "memory_used": f"{psutil.virtual_memory().used / (1024**3):.2f} GB",
-        "memory_total": f"{psutil.virtual_memory().total / (1024**3):.2f} GB",
-        "disk_percent": psutil.disk_usage("/").percent,
-        "disk_used": f"{psutil.disk_usage('/').used / (1024**3):.2f} GB",
-        "disk_total": f"{psutil.disk_usage('/').total / (1024**3):.2f} GB",
-    }
+    # Get CPU and memory usage from the shared sampler snapshot
+    resource_usage_info = resource_usage(resource_sampler.get_snapshot())
 
     return render_template(
-        "dashboard/index.html", system_info=system_info, resource_usage=resource_usage
+        "dashboard/index.html", system_info=system_info, resource_usage=resource_usage_info
+    )
+
+
+@dashboard_bp.route("/api/metrics")
+@login_required
+def api_metrics():
+    """Return the current resource usage as JSON."""
+    snapshot = resource_sampler.get_snapshot()
+    response = jsonify(resource_usage(snapshot))
+    # Pollers get a 304 until the sampler has taken a new snapshot
+    response.set_etag(repr(snapshot.timestamp))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@dashboard_bp.route("/api/stream")
+@login_required
+def api_stream():
+    """Stream resource usage updates as Server-Sent Events."""
+    # When the sampler thread is not running, an idle stream refreshes the stale snapshot
+    events = metrics_broadcaster.stream(
+        on_idle=resource_sampler.get_snapshot, keepalive=resource_sampler.max_age
+    )
+    if events is None:
+        # The page falls back to polling the JSON endpoint
+        return jsonify({"error": "Too many live dashboards"}), 503, {"Retry-After": "60"}
+    return Response(
+        events,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@dashboard_bp.route("/api/history")
+@login_required
+def api_history():
+    """Return the resource usage history of the last ``range`` seconds as JSON."""
+    if not history_store.is_open:
+        return jsonify({"error": "The resource history is not recorded"}), 503
+    # Defaults to an hour, and is limited to the retention of the coarsest rollup
+    seconds = min(max(request.args.get("range", 3600, type=int), 60), TIERS[-1][2])
+    response = jsonify(history_store.query(time.time() - seconds))
+    response.cache_control.no_cache = True
+    return response
+
+
+def init_dashboard(app):
+    """Connect the live dashboards to the resource sampler."""
+    metrics_broadcaster.max_streams = int(
+        app.config.get("DASHBOARD_MAX_STREAMS", metrics_broadcaster.max_streams)
     )
+    resource_sampler.add_listener(broadcast_snapshot)
+    DASHBOARD_STREAMS.set_function(lambda: metrics_broadcaster.streams)
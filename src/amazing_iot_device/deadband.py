@@ -0,0 +1,109 @@
+"""
+Deadband module for IoT device agent.
+This module suppresses resource samples that did not change meaningfully. A metric is reported
+only when it moves past its absolute or relative deadband since the value last reported, and the
+complete state is re-sent whenever the heartbeat interval expires.
+
+Every filtered payload carries a ``deadband`` metadata object so that receivers can rebuild
+step-wise series: ``seq`` increases by one per message (a gap means a message was lost), ``full``
+marks payloads containing every metric, and ``heartbeat`` is the longest silence to expect.
+"""
+
+import time
+from dataclasses import dataclass
+
+# Key of the metadata object added to filtered payloads
+DEADBAND_KEY = "deadband"
+
+
+@dataclass(frozen=True)
+class Deadband:
+    """Change threshold of one metric.
+
+    A value is reported when it differs from the last reported value by more than ``absolute``
+    units, or by more than ``relative`` times the last reported value, whichever band is wider.
+    """
+
+    absolute: float = 0.0
+    relative: float = 0.0
+
+    @classmethod
+    def parse(cls, text):
+        """Parse an ``"absolute,relative"`` setting value such as ``"2"`` or ``"0,0.05"``."""
+        if not text or not text.strip():
+            return cls()
+        parts = [part.strip() for part in text.split(",")]
+        if len(parts) > 2:
+            raise ValueError(f"Invalid deadband: {text}")
+        absolute = float(parts[0]) if parts[0] else 0.0
+        relative = float(parts[1]) if len(parts) > 1 and parts[1] else 0.0
+        if absolute < 0 or relative < 0:
+            raise ValueError(f"Deadband must not be negative: {text}")
+        return cls(absolute, relative)
+
+    def exceeded(self, reference, value):
+        """Return True when ``value`` moved out of the band around ``reference``."""
+        if not isinstance(value, int | float) or not isinstance(reference, int | float):
+            return value != reference
+        threshold = max(self.absolute, self.relative * abs(reference))
+        if threshold == 0:
+            return value != reference
+        return abs(value - reference) > threshold
+
+
+class DeadbandFilter:
+    """Reports only the metrics that moved past their deadband, plus a periodic full state."""
+
+    def __init__(self, bands=None, default=None, heartbeat=300.0):
+        """Initialize the filter.
+
+        ``bands`` maps metric names to ``Deadband`` instances; other metrics use ``default``,
+        which reports every change. ``heartbeat`` is the maximum number of seconds between two
+        payloads containing every metric.
+        """
+        self.bands = dict(bands or {})
+        self.default = default or Deadband()
+        self.heartbeat = float(heartbeat)
+        self.reset()
+
+    def configure(self, bands=None, default=None, heartbeat=None):
+        """Update the thresholds; the next payload contains every metric."""
+        if bands is not None:
+            self.bands = dict(bands)
+        if default is not None:
+            self.default = default
+        if heartbeat is not None:
+            self.heartbeat = float(heartbeat)
+        self.reset()
+
+    def reset(self):
+        """Forget the reported values so that the next payload contains every metric."""
+        self._reported = {}
+        self._last_full = None
+        self._seq = 0
+
+    def filter(self, values, now=None):
+        """Return the payload to report for ``values``, or None when nothing changed."""
+        now = time.monotonic() if now is None else now
+        full = self._last_full is None or now - self._last_full >= self.heartbeat
+        if full:
+            changed = dict(values)
+            self._last_full = now
+        else:
+            changed = {
+                name: value
+                for name, value in values.items()
+                if name not in self._reported
+                or self.bands.get(name, self.default).exceeded(self._reported[name], value)
+            }
+            if not changed:
+                return None
+
+        # Reported values become the new references; values inside the band keep the old
+        # reference so that a slow drift is still reported once it adds up
+        self._reported.update(changed)
+        self._seq += 1
+        return {
+            **changed,
+            DEADBAND_KEY: {"seq": self._seq, "full": full, "heartbeat": self.heartbeat},
+        }
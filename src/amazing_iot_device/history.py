@@ -0,0 +1,286 @@
+"""
+History module for IoT device agent.
+This module keeps the resource usage of the device in a local SQLite time-series store, so that
+the dashboard can chart it while the device is offline. Samples are kept raw for an hour and rolled
+up into 1-minute buckets kept for a day and 15-minute buckets kept for 30 days. Rollups are updated
+incrementally as samples arrive, and expired rows are pruned on every write, which bounds the store
+to about 8000 rows whatever the sampling rate.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from amazing_iot_device.sampler import resource_sampler
+
+logger = logging.getLogger("history")
+
+# Metrics kept in the history, with their column name
+METRICS = (("cpu_percent", "cpu"), ("memory_percent", "memory"), ("disk_percent", "disk"))
+
+# Percentages are stored as integer tenths, which SQLite packs in one or two bytes
+SCALE = 10
+
+# Table, bucket size and retention in seconds of every tier; raw rows are keyed by the second
+RAW = ("history_raw", 1, 3600)
+ROLLUPS = (
+    ("history_1m", 60, 24 * 3600),
+    ("history_15m", 900, 30 * 24 * 3600),
+)
+TIERS = (RAW, *ROLLUPS)
+
+# Rows this many seconds ahead of the clock are dropped, they date from before a clock change
+FUTURE_TOLERANCE = 300
+
+# Seconds a queried range may reach beyond the retention of a tier and still be served from it
+RANGE_TOLERANCE = 60
+
+_COLUMNS = [column for _, column in METRICS]
+_ROLLUP_COLUMNS = [f"{column}_{part}" for column in _COLUMNS for part in ("min", "avg", "max")]
+_RAW_VALUES = ", ".join("?" * (1 + len(_COLUMNS)))
+_ROLLUP_VALUES = ", ".join("?" * (2 + len(_ROLLUP_COLUMNS)))
+
+SCHEMA = (
+    f"CREATE TABLE IF NOT EXISTS {RAW[0]} (ts INTEGER PRIMARY KEY, "
+    + ", ".join(f"{column} INTEGER NOT NULL" for column in _COLUMNS)
+    + ");\n"
+    + "".join(
+        f"CREATE TABLE IF NOT EXISTS {table} (ts INTEGER PRIMARY KEY, samples INTEGER NOT NULL, "
+        + ", ".join(f"{column} INTEGER NOT NULL" for column in _ROLLUP_COLUMNS)
+        + ");\n"
+        for table, _, _ in ROLLUPS
+    )
+)
+
+
+class _Bucket:
+    """Running minimum, maximum and sum of the samples of one rollup bucket."""
+
+    __slots__ = ("start", "samples", "minimum", "maximum", "total")
+
+    def __init__(self, start):
+        self.start = start
+        self.samples = 0
+        self.minimum = [None] * len(METRICS)
+        self.maximum = [None] * len(METRICS)
+        self.total = [0] * len(METRICS)
+
+    @classmethod
+    def from_row(cls, row):
+        """Resume a bucket from its stored row."""
+        bucket = cls(row[0])
+        bucket.samples = row[1]
+        for i in range(len(METRICS)):
+            minimum, average, maximum = row[2 + 3 * i : 5 + 3 * i]
+            bucket.minimum[i] = minimum
+            bucket.maximum[i] = maximum
+            bucket.total[i] = average * bucket.samples
+        return bucket
+
+    def add(self, values):
+        self.samples += 1
+        for i, value in enumerate(values):
+            if self.minimum[i] is None or value < self.minimum[i]:
+                self.minimum[i] = value
+            if self.maximum[i] is None or value > self.maximum[i]:
+                self.maximum[i] = value
+            self.total[i] += value
+
+    def row(self):
+        row = [self.start, self.samples]
+        for i in range(len(METRICS)):
+            row += [self.minimum[i], round(self.total[i] / self.samples), self.maximum[i]]
+        return row
+
+
+class HistoryStore:
+    """SQLite time-series store of the resource usage with tiered rollups and retention."""
+
+    def __init__(self, flush_interval=60.0):
+        """Initialize a closed store; samples added before ``open`` are ignored."""
+        self.path = None
+        # Seconds samples are buffered in memory, so the flash storage sees one write a minute
+        self.flush_interval = float(flush_interval)
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending = []  # Raw rows not written yet
+        self._buckets = {}  # Open bucket of every rollup table
+        self._dirty = {}  # Buckets changed since the last write, by (table, start)
+        self._last_flush = time.monotonic()
+
+    @property
+    def is_open(self):
+        """Return whether the store has a database."""
+        return self._conn is not None
+
+    def init_app(self, app):
+        """Open the store next to the application database, unless configured elsewhere."""
+        self.flush_interval = float(app.config.get("HISTORY_FLUSH_INTERVAL", self.flush_interval))
+        if not self.is_open:
+            self.open(
+                app.config.get("HISTORY_PATH") or os.path.join(app.instance_path, "history.sqlite")
+            )
+
+    def open(self, path):
+        """Open, and create if needed, the SQLite file at ``path``."""
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        with self._lock:
+            self.path = path
+            self._conn = conn
+            self._last_flush = time.monotonic()
+        logger.info(f"Resource history stored in {path}")
+
+    def record(self, snapshot):
+        """Add a resource snapshot, for use as a resource sampler listener."""
+        self.add(snapshot.timestamp, [getattr(snapshot, name) for name, _ in METRICS])
+
+    def add(self, timestamp, values):
+        """Add the values of the metrics sampled at ``timestamp``, in the order of METRICS."""
+        if self._conn is None:
+            return
+        second = int(timestamp)
+        row = [round(value * SCALE) for value in values]
+        with self._lock:
+            self._pending.append((second, *row))
+            for table, size, _ in ROLLUPS:
+                bucket = self._buckets.get(table)
+                start = second - second % size
+                if bucket is None or bucket.start != start:
+                    bucket = self._buckets[table] = self._open_bucket(table, start)
+                bucket.add(row)
+                self._dirty[(table, start)] = bucket
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered samples and rollups, and prune the expired rows."""
+        with self._lock:
+            # Processes that only query the store never write to it
+            if self._conn is None or not (self._pending or self._dirty):
+                return
+            now = time.time()
+            self._conn.execute("BEGIN")
+            try:
+                # Two samples within a second share a row, the later one wins
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {RAW[0]} VALUES ({_RAW_VALUES})", self._pending
+                )
+                for table, _, _ in ROLLUPS:
+                    self._conn.executemany(
+                        f"INSERT OR REPLACE INTO {table} VALUES ({_ROLLUP_VALUES})",
+                        [
+                            bucket.row()
+                            for (bucket_table, _), bucket in self._dirty.items()
+                            if bucket_table == table
+                        ],
+                    )
+                for table, _, retention in TIERS:
+                    self._conn.execute(
+                        f"DELETE FROM {table} WHERE ts < ? OR ts > ?",
+                        (now - retention, now + FUTURE_TOLERANCE),
+                    )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                logger.error(f"Error writing the resource history: {str(e)}")
+            # Dropped on errors too, so a broken database does not grow the buffer without bound
+            self._pending = []
+            self._dirty = {}
+            self._last_flush = time.monotonic()
+
+    def query(self, start, end=None):
+        """
+        Return the history between two timestamps, from the finest tier that still covers
+        ``start``, as lists of timestamps and of the values of every metric.
+
+        Rollups also report the minimum and maximum of every bucket next to its average.
+        """
+        now = time.time()
+        end = now if end is None else end
+        # A range of exactly the retention, computed a moment earlier, stays in its tier
+        table, size, _ = next(
+            (tier for tier in TIERS if now - tier[2] - RANGE_TOLERANCE <= start), TIERS[-1]
+        )
+        rollup = table != RAW[0]
+        columns = _ROLLUP_COLUMNS if rollup else _COLUMNS
+
+        self.flush()
+        with self._lock:
+            if self._conn is None:
+                rows = []
+            else:
+                rows = self._conn.execute(
+                    f"SELECT ts, {', '.join(columns)} FROM {table} "
+                    "WHERE ts >= ? AND ts <= ? ORDER BY ts",
+                    (int(start) - int(start) % size, end),
+                ).fetchall()
+
+        history = {
+            "start": start,
+            "end": end,
+            "resolution": size,
+            "timestamps": [row[0] for row in rows],
+        }
+        if rollup:
+            for part, offset in (("avg", 1), ("min", 0), ("max", 2)):
+                history[part] = {
+                    name: [row[1 + 3 * i + offset] / SCALE for row in rows]
+                    for i, (name, _) in enumerate(METRICS)
+                }
+        else:
+            history["avg"] = {
+                name: [row[1 + i] / SCALE for row in rows] for i, (name, _) in enumerate(METRICS)
+            }
+        return history
+
+    def stats(self):
+        """Return the number of rows of every tier and the size of the database file."""
+        self.flush()
+        with self._lock:
+            if self._conn is None:
+                return {}
+            rows = {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table, _, _ in TIERS
+            }
+        return {"rows": rows, "file_size": os.path.getsize(self.path)}
+
+    def close(self):
+        """Write the buffered samples and close the database."""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._buckets = {}
+
+    def _open_bucket(self, table, start):
+        """
+        Return the bucket of ``table`` starting at ``start``, resumed from memory or the database
+        when samples were already added to it, for example before a restart. Must be called with
+        the lock held.
+        """
+        bucket = self._dirty.get((table, start))
+        if bucket is not None:
+            return bucket
+        row = self._conn.execute(
+            f"SELECT ts, samples, {', '.join(_ROLLUP_COLUMNS)} FROM {table} WHERE ts = ?",
+            (start,),
+        ).fetchone()
+        return _Bucket.from_row(row) if row else _Bucket(start)
+
+
+history_store = HistoryStore()
+
+
+def init_history(app):
+    """Open the history store and record every resource snapshot in it."""
+    history_store.init_app(app)
+    resource_sampler.add_listener(history_store.record)
@@ -0,0 +1,436 @@
+"""
+Load generator module for IoT device agent.
+This module simulates a fleet of devices in a single process to measure the capacity of an MQTT
+broker and the cloud receiver behind it. Every virtual device has its own client ID and topic
+prefix and publishes synthetic hardware information, shaped like the payloads of the MQTT
+service, on the same topics. All devices share one asyncio event loop; without a broker address
+they publish to the embedded broker on a second thread, so the tool also works offline.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import resource
+import time
+import uuid
+from datetime import datetime
+
+from amazing_iot_device import codec
+from amazing_iot_device.broker import Broker
+from amazing_iot_device.mqtt_protocol import AsyncMQTTClient, MQTTProtocolError
+
+logger = logging.getLogger("loadgen")
+
+# Latencies kept for the percentiles, a uniform sample of all of them past this size
+LATENCY_SAMPLE_SIZE = 100000
+
+
+def _walk(rng, value, step, low=0.0, high=100.0):
+    """Take one bounded random walk step."""
+    return min(high, max(low, value + rng.gauss(0, step)))
+
+
+class SyntheticHardware:
+    """Hardware information of one simulated device, following a random walk between samples."""
+
+    def __init__(self, device_id, rng):
+        """Draw the static properties and the starting point of a device."""
+        self.device_id = device_id
+        self.rng = rng
+        self.cores = [rng.uniform(5, 40) for _ in range(rng.choice((1, 2, 4, 8)))]
+        self.memory_total_mb = float(rng.choice((512, 1024, 2048, 4096, 8192)))
+        self.memory_percent = rng.uniform(20, 60)
+        self.disk_total_gb = float(rng.choice((8, 16, 32, 64, 128)))
+        self.disk_percent = rng.uniform(10, 80)
+        self.load = rng.uniform(0.1, 1.5)
+        hostname = f"sim-{device_id}"
+        self.system = {
+            "os_name": "Linux",
+            "os_version": "#1 SMP PREEMPT",
+            "os_release": rng.choice(("5.15.0-1050-raspi", "6.1.0-rpi7-rpi-v8", "6.6.31+rpt")),
+            "device_version": "0.1.0",
+            "python_version": "3.11.2",
+            "hostname": hostname,
+            "processor": "",
+            "architecture": rng.choice(("aarch64", "armv7l", "x86_64")),
+        }
+        self.network = {
+            "hostname": hostname,
+            "ip_address": f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+        }
+
+    def sample(self):
+        """Advance the random walk and return hardware information like ``_get_hardware_info``."""
+        rng = self.rng
+        self.cores = [_walk(rng, core, 8.0) for core in self.cores]
+        self.memory_percent = _walk(rng, self.memory_percent, 1.0)
+        # Disks mostly fill up
+        self.disk_percent = _walk(rng, self.disk_percent + 0.01, 0.05)
+        self.load = _walk(rng, self.load, 0.1, high=len(self.cores) * 2.0)
+
+        cpu_percent = sum(self.cores) / len(self.cores)
+        memory_used_mb = self.memory_total_mb * self.memory_percent / 100
+        disk_used_gb = self.disk_total_gb * self.disk_percent / 100
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "device_id": self.device_id,
+            "system": self.system,
+            "network": self.network,
+            "resources": {
+                "cpu_percent": round(cpu_percent, 1),
+                "memory_percent": round(self.memory_percent, 1),
+                "memory_used_mb": memory_used_mb,
+                "memory_total_mb": self.memory_total_mb,
+                "disk_percent": round(self.disk_percent, 1),
+                "disk_used_gb": disk_used_gb,
+                "disk_total_gb": self.disk_total_gb,
+            },
+            "rates": {
+                "cpu_cores": [round(core, 1) for core in self.cores],
+                "ctx_switches_per_s": round(rng.uniform(200, 5000), 1),
+                "interrupts_per_s": round(rng.uniform(100, 3000), 1),
+                "load_1": round(self.load, 2),
+                "load_5": round(self.load * 0.9, 2),
+                "load_15": round(self.load * 0.8, 2),
+                "disks": {
+                    "mmcblk0": {
+                        "read_bytes_per_s": round(rng.expovariate(1 / 20000), 1),
+                        "write_bytes_per_s": round(rng.expovariate(1 / 50000), 1),
+                        "read_iops": round(rng.expovariate(1 / 2), 1),
+                        "write_iops": round(rng.expovariate(1 / 5), 1),
+                    }
+                },
+                "interfaces": {
+                    "eth0": {
+                        "bytes_recv_per_s": round(rng.expovariate(1 / 3000), 1),
+                        "bytes_sent_per_s": round(rng.expovariate(1 / 2000), 1),
+                        "packets_recv_per_s": round(rng.expovariate(1 / 20), 1),
+                        "packets_sent_per_s": round(rng.expovariate(1 / 15), 1),
+                    }
+                },
+                "filesystems": {
+                    "/": {
+                        "percent": round(self.disk_percent, 1),
+                        "used_gb": round(disk_used_gb, 2),
+                        "total_gb": round(self.disk_total_gb, 2),
+                    }
+                },
+            },
+        }
+
+
+class LoadStats:
+    """Counters and publish latencies of a load run, shared by all devices."""
+
+    def __init__(self, seed=None):
+        """Initialize empty statistics."""
+        self._rng = random.Random(seed)
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnections = 0
+        self.errors = 0
+        self.reset()
+
+    def reset(self):
+        """Start a new measurement window."""
+        self.started = time.monotonic()
+        self.sent = 0
+        self.acknowledged = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.latencies = []
+        self._observed = 0
+
+    def record_sent(self, size):
+        """Count a published message."""
+        self.sent += 1
+        self.bytes_sent += size
+
+    def record_ack(self, latency):
+        """Count an acknowledged message and keep its latency in a uniform sample."""
+        self.acknowledged += 1
+        if latency is None:
+            return
+        self._observed += 1
+        if len(self.latencies) < LATENCY_SAMPLE_SIZE:
+            self.latencies.append(latency)
+        else:
+            # Reservoir sampling keeps memory flat on long runs
+            index = self._rng.randrange(self._observed)
+            if index < LATENCY_SAMPLE_SIZE:
+                self.latencies[index] = latency
+
+    def percentile(self, fraction):
+        """Return the latency below which ``fraction`` of the sampled latencies fall."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def report(self, elapsed=None):
+        """Return a summary of the measurement window."""
+        elapsed = elapsed if elapsed is not None else time.monotonic() - self.started
+        latencies = {
+            f"p{round(fraction * 100)}": self.percentile(fraction) for fraction in (0.5, 0.95, 0.99)
+        }
+        latencies["max"] = max(self.latencies) if self.latencies else None
+        return {
+            "duration": elapsed,
+            "connected": self.connected,
+            "connect_failures": self.connect_failures,
+            "disconnections": self.disconnections,
+            "errors": self.errors,
+            "sent": self.sent,
+            "acknowledged": self.acknowledged,
+            "failed": self.failed,
+            "messages_per_s": self.acknowledged / elapsed if elapsed > 0 else 0.0,
+            "bytes_per_s": self.bytes_sent / elapsed if elapsed > 0 else 0.0,
+            "latency": latencies,
+        }
+
+
+class VirtualDevice:
+    """One simulated device publishing synthetic hardware information over its own connection."""
+
+    def __init__(
+        self,
+        index,
+        run_id,
+        prefix="loadgen",
+        interval=60.0,
+        jitter=0.1,
+        qos=1,
+        payload_format="json",
+        full_only=False,
+        seed=None,
+    ):
+        """Initialize a device; ``jitter`` is the relative random spread of the interval."""
+        self.client_id = f"loadgen-{run_id}-{index:05d}"
+        self.topic_prefix = f"{prefix}/{self.client_id}"
+        self.interval = interval
+        self.jitter = jitter
+        self.qos = qos
+        self.payload_format = payload_format
+        self.full_only = full_only
+        self.rng = random.Random(None if seed is None else f"{seed}-{index}")
+        self.hardware = SyntheticHardware(self.client_id, self.rng)
+        self.client = None
+
+    def messages(self):
+        """Return the ``(topic, payload)`` pairs of one publish cycle, like the MQTT service."""
+        hardware_info = self.hardware.sample()
+        if self.full_only:
+            topics = {"full": hardware_info}
+        else:
+            topics = {
+                name: section
+                for name, section in hardware_info.items()
+                if isinstance(section, dict)
+            }
+            topics["full"] = hardware_info
+        return [
+            (f"{self.topic_prefix}/{suffix}", codec.encode(payload, self.payload_format))
+            for suffix, payload in topics.items()
+        ]
+
+    def next_delay(self):
+        """Return the time until the next publish cycle."""
+        return max(0.0, self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    async def connect(self, host, port, stats, username="", password="", timeout=10.0):
+        """Connect the device, returning whether it succeeded."""
+        self.client = AsyncMQTTClient(self.client_id, username, password)
+        try:
+            await self.client.connect(host, port, timeout)
+        except (OSError, TimeoutError, MQTTProtocolError) as e:
+            stats.connect_failures += 1
+            logger.debug(f"{self.client_id} failed to connect: {e}")
+            return False
+        stats.connected += 1
+        return True
+
+    async def run(self, stats, stop_event, timeout=10.0):
+        """Publish a cycle every interval until ``stop_event`` is set."""
+        # A random phase spreads the devices evenly over the interval
+        delay = self.rng.uniform(0, self.interval)
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), delay)
+                break
+            except TimeoutError:
+                pass
+            if not self.client.is_connected:
+                stats.disconnections += 1
+                break
+            await asyncio.gather(
+                *(
+                    self._publish(topic, payload, stats, timeout)
+                    for topic, payload in self.messages()
+                )
+            )
+            delay = self.next_delay()
+
+    async def close(self):
+        """Disconnect the device."""
+        if self.client is not None:
+            await self.client.disconnect()
+
+    async def _publish(self, topic, payload, stats, timeout):
+        try:
+            stats.record_sent(len(payload))
+            latency = await self.client.publish(topic, payload, self.qos, timeout=timeout)
+        except (ConnectionError, TimeoutError):
+            stats.failed += 1
+            return
+        except Exception as e:
+            stats.errors += 1
+            logger.debug(f"{self.client_id} failed to publish on {topic}: {e}")
+            return
+        stats.record_ack(latency)
+
+
+def raise_open_file_limit(needed):
+    """Raise the soft limit of open files towards ``needed``, returning the new limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        soft = target
+    return soft
+
+
+async def run_load(
+    devices,
+    host,
+    port,
+    duration=60.0,
+    connect_rate=500.0,
+    username="",
+    password="",
+    timeout=10.0,
+    seed=None,
+    **device_options,
+):
+    """Connect ``devices`` virtual devices, let them publish for ``duration`` seconds and
+    return the report of that window.
+    """
+    run_id = uuid.uuid4().hex[:6]
+    fleet = [VirtualDevice(index, run_id, seed=seed, **device_options) for index in range(devices)]
+    stats = LoadStats(seed)
+
+    # Ramp the connections up, a burst of thousands of handshakes overflows the listen backlog
+    async def connect(index, device):
+        await asyncio.sleep(index / connect_rate)
+        if await device.connect(host, port, stats, username, password, timeout):
+            return device
+        return None
+
+    ramp_started = time.monotonic()
+    connected = [
+        device
+        for device in await asyncio.gather(*(connect(i, d) for i, d in enumerate(fleet)))
+        if device is not None
+    ]
+    logger.info(
+        f"Connected {len(connected)} of {devices} devices in {time.monotonic() - ramp_started:.1f}s"
+    )
+
+    stop_event = asyncio.Event()
+    stats.reset()
+    tasks = [asyncio.create_task(device.run(stats, stop_event, timeout)) for device in connected]
+    await asyncio.sleep(duration)
+    report = stats.report(time.monotonic() - stats.started)
+    stop_event.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*(device.close() for device in connected), return_exceptions=True)
+    return report
+
+
+def format_report(report):
+    """Return the report as printable text."""
+
+    def milliseconds(value):
+        return "-" if value is None else f"{value * 1000:.1f}"
+
+    latency = report["latency"]
+    return "\n".join(
+        (
+            f"devices connected   {report['connected']} ({report['connect_failures']} failed,"
+            f" {report['disconnections']} disconnected)",
+            f"messages            {report['acknowledged']} acknowledged of {report['sent']} sent"
+            f" ({report['failed']} failed, {report['errors']} errors)",
+            f"throughput          {report['messages_per_s']:.1f} msgs/s,"
+            f" {report['bytes_per_s'] / 1024:.1f} KiB/s over {report['duration']:.1f}s",
+            f"publish latency ms  p50 {milliseconds(latency['p50'])}"
+            f"  p95 {milliseconds(latency['p95'])}  p99 {milliseconds(latency['p99'])}"
+            f"  max {milliseconds(latency['max'])}",
+        )
+    )
+
+
+def main(argv=None):
+    """Command line entry point of the load generator."""
+    parser = argparse.ArgumentParser(
+        description="Simulate a fleet of devices publishing to an MQTT broker."
+    )
+    parser.add_argument("--devices", type=int, default=1000, help="Number of virtual devices")
+    parser.add_argument(
+        "--interval", type=float, default=60.0, help="Seconds between publish cycles"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.1, help="Relative random spread of the interval"
+    )
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to measure")
+    parser.add_argument(
+        "--connect-rate", type=float, default=500.0, help="New connections per second"
+    )
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=1)
+    parser.add_argument("--format", choices=codec.FORMATS, default="json")
+    parser.add_argument("--topics", choices=("all", "full"), default="all")
+    parser.add_argument("--prefix", default="loadgen", help="Topic prefix of all devices")
+    parser.add_argument("--host", help="Broker host, the embedded broker when omitted")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username", default="")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--seed", type=int, help="Seed of the synthetic data")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    # One socket per device, plus the broker side of it when the broker runs here
+    sockets = args.devices * (1 if args.host else 2)
+    limit = raise_open_file_limit(sockets + 64)
+    if limit < sockets + 64:
+        logger.warning(f"The open file limit of {limit} is too low for {args.devices} devices")
+
+    broker = None
+    host, port = args.host, args.port
+    if host is None:
+        broker = Broker()
+        host, port = "127.0.0.1", broker.start()
+        logger.info(f"Publishing to the embedded broker on port {port}")
+
+    try:
+        report = asyncio.run(
+            run_load(
+                args.devices,
+                host,
+                port,
+                duration=args.duration,
+                connect_rate=args.connect_rate,
+                username=args.username,
+                password=args.password,
+                seed=args.seed,
+                prefix=args.prefix,
+                interval=args.interval,
+                jitter=args.jitter,
+                qos=args.qos,
+                payload_format=args.format,
+                full_only=args.topics == "full",
+            )
+        )
+    finally:
+        if broker is not None:
+            broker.stop()
+    print(format_report(report))
+    return report
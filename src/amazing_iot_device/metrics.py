@@ -0,0 +1,446 @@
+"""
+Metrics module for IoT device agent.
+This module instruments the agent itself: counters, gauges and fixed-bucket histograms kept in
+memory and rendered in the Prometheus text exposition format at ``/metrics``. Updating a metric
+costs a dictionary lookup and an uncontended lock, so it can be used on the hot paths.
+"""
+
+import bisect
+import hmac
+import math
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, request
+from flask_login import current_user
+
+from amazing_iot_device import login_manager
+
+# Bucket upper bounds in seconds, for operations taking microseconds to a few seconds
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Bucket upper bounds in seconds, for network round trips and publish cycles
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values, strict=True), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Timer:
+    """Context manager observing the time spent in its block."""
+
+    __slots__ = ("_observe", "_start")
+
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._observe(time.perf_counter() - self._start)
+
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        """Increase the counter by ``amount``, which must not be negative."""
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """Set the gauge to ``value``."""
+        self.value = float(value)
+
+    def inc(self, amount=1.0):
+        """Increase the gauge by ``amount``."""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        """Decrease the gauge by ``amount``."""
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record an observation."""
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Return a context manager observing the duration of its block in seconds."""
+        return _Timer(self.observe)
+
+    def quantile(self, fraction):
+        """Estimate a quantile by interpolating inside its bucket, or None without data."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = fraction * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.bounds[index - 1] if index else 0.0
+                if index == len(self.bounds):
+                    # Nothing is known above the last bound
+                    return lower
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bounds[-1]
+
+
+class Metric:
+    """Base class of a metric family, with one child per combination of label values."""
+
+    kind = None
+    value_class = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Initialize the family ``name`` described by ``documentation``."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def labels(self, *values):
+        """Return the child of the given label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def set_function(self, function):
+        """Read the value of an unlabelled metric from ``function`` when it is rendered."""
+        self._function = function
+
+    def children(self):
+        """Return the ``(label values, child)`` pairs of the family."""
+        with self._lock:
+            return list(self._children.items())
+
+    def total(self):
+        """Return the sum of the values of every child."""
+        if self._function is not None:
+            return self._function()
+        return sum(child.value for _, child in self.children())
+
+    def render(self):
+        """Return the exposition lines of the family."""
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        if self._function is not None:
+            lines.append(f"{self.name} {_format_value(float(self._function()))}")
+            return lines
+        for values, child in sorted(self.children(), key=lambda item: item[0]):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _new_child(self):
+        return self.value_class()
+
+    def _render_child(self, values, child):
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+    def _default(self):
+        """Return the only child of an unlabelled metric."""
+        return self.labels()
+
+
+class Counter(Metric):
+    """Monotonically increasing count, such as messages sent."""
+
+    kind = "counter"
+    value_class = _CounterValue
+
+    def inc(self, amount=1.0):
+        """Increase an unlabelled counter."""
+        self._default().inc(amount)
+
+
+class Gauge(Metric):
+    """Value that can go up and down, such as a queue depth."""
+
+    kind = "gauge"
+    value_class = _GaugeValue
+
+    def set(self, value):
+        """Set an unlabelled gauge."""
+        self._default().set(value)
+
+    def inc(self, amount=1.0):
+        """Increase an unlabelled gauge."""
+        self._default().inc(amount)
+
+    def dec(self, amount=1.0):
+        """Decrease an unlabelled gauge."""
+        self._default().dec(amount)
+
+
+class Histogram(Metric):
+    """Distribution of observations, counted in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Initialize the family; ``buckets`` are the sorted upper bounds, without +Inf."""
+        if list(buckets) != sorted(buckets) or not buckets:
+            raise ValueError(f"Buckets of {name} must be sorted and not empty")
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, value):
+        """Record an observation of an unlabelled histogram."""
+        self._default().observe(value)
+
+    def time(self):
+        """Time a block with an unlabelled histogram."""
+        return self._default().time()
+
+    def total(self):
+        """Return the number of observations of every child."""
+        return sum(child.count for _, child in self.children())
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, math.inf), counts, strict=True):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, values, (("le", _format_value(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metric families, rendered together."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # Callable returning the metrics text to serve instead of these, or None to serve these;
+        # set in processes that do not run the agent services, see coordination.py
+        self.source = None
+
+    def register(self, metric):
+        """Add a metric family; names must be unique."""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a counter."""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Create and register a gauge."""
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a histogram."""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        """Return a registered metric family by name."""
+        return self._metrics[name]
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+# Metrics of the agent itself
+COLLECTION_DURATION = metrics_registry.histogram(
+    "agent_collection_duration_seconds",
+    "Time spent in one run of a collector",
+    ("collector",),
+    buckets=FAST_BUCKETS,
+)
+PUBLISH_CYCLE_DURATION = metrics_registry.histogram(
+    "agent_publish_cycle_duration_seconds",
+    "Duration of a publish cycle, waiting for the acknowledgements included",
+)
+PUBLISH_ACK_LATENCY = metrics_registry.histogram(
+    "agent_publish_ack_latency_seconds",
+    "Time between sending a QoS 1 message and its broker acknowledgement",
+)
+MESSAGES_PUBLISHED = metrics_registry.counter(
+    "agent_mqtt_messages_published_total", "Messages acknowledged by the broker"
+)
+PUBLISH_FAILURES = metrics_registry.counter(
+    "agent_mqtt_publish_failures_total",
+    "Messages that could not be sent or were not acknowledged in time",
+    ("reason",),
+)
+CONNECTIONS = metrics_registry.counter(
+    "agent_mqtt_connections_total", "Connection attempts answered by the broker", ("result",)
+)
+DISCONNECTIONS = metrics_registry.counter(
+    "agent_mqtt_disconnections_total", "Closed connections to the broker", ("reason",)
+)
+MQTT_CONNECTED = metrics_registry.gauge(
+    "agent_mqtt_connected", "Whether the agent is connected to the broker"
+)
+LAST_PUBLISH = metrics_registry.gauge(
+    "agent_last_publish_timestamp_seconds", "Time of the last acknowledged message"
+)
+SAMPLES_DROPPED = metrics_registry.counter(
+    "agent_samples_dropped_total",
+    "Samples dropped before reaching the broker or the outbox",
+    ("reason",),
+)
+OUTBOX_DEPTH = metrics_registry.gauge("agent_outbox_depth", "Messages waiting in the outbox")
+OUTBOX_EVICTED = metrics_registry.counter(
+    "agent_outbox_evicted_total", "Messages evicted from the outbox for size or age"
+)
+SERVICE_ERRORS = metrics_registry.counter(
+    "agent_mqtt_service_errors_total", "Errors that stopped the MQTT service"
+)
+DASHBOARD_STREAMS = metrics_registry.gauge(
+    "agent_dashboard_streams", "Open live dashboard event streams"
+)
+LOGIN_ATTEMPTS = metrics_registry.counter(
+    "agent_login_attempts_total",
+    "Login form submissions, by result; throttled ones are rejected before hashing",
+    ("result",),
+)
+LOGIN_LIMITER_KEYS = metrics_registry.gauge(
+    "agent_login_limiter_keys",
+    "Client addresses and usernames tracked by the login limiter",
+    ("key",),
+)
+HTTP_REQUEST_DURATION = metrics_registry.histogram(
+    "agent_http_request_duration_seconds",
+    "Duration of the web requests",
+    ("method", "endpoint", "status"),
+    buckets=FAST_BUCKETS,
+)
+
+
+def agent_summary():
+    """Return the headline agent metrics for display on the settings page."""
+    cycle_p95 = PUBLISH_CYCLE_DURATION.labels().quantile(0.95)
+    return {
+        "published": int(MESSAGES_PUBLISHED.total()),
+        "failures": int(PUBLISH_FAILURES.total()),
+        "connections": int(CONNECTIONS.labels("accepted").value),
+        "refused": int(CONNECTIONS.labels("refused").value),
+        "disconnections": int(DISCONNECTIONS.labels("lost").value),
+        "dropped": int(SAMPLES_DROPPED.total()),
+        "cycle_p95_ms": round(cycle_p95 * 1000, 1) if cycle_p95 is not None else None,
+        "collections": [
+            (values[0], round(child.sum / child.count * 1000, 2))
+            for values, child in sorted(COLLECTION_DURATION.children())
+            if child.count
+        ],
+    }
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        # The route pattern keeps the number of label values bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_DURATION.labels(request.method, endpoint, str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+    return response
+
+
+def init_metrics(app):
+    """Time every request of the app and serve the metrics."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(metrics_bp)
+
+
+@metrics_bp.route("/metrics")
+def metrics():
+    """Serve the metrics to a logged in user, or to a scraper presenting the metrics token."""
+    token = current_app.config.get("METRICS_TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    if not (token and hmac.compare_digest(authorization, f"Bearer {token}")) and not (
+        current_user.is_authenticated
+    ):
+        return login_manager.unauthorized()
+    text = metrics_registry.source() if metrics_registry.source is not None else None
+    if text is None:
+        text = metrics_registry.render()
+    return Response(text, mimetype="text/plain; version=0.0.4")
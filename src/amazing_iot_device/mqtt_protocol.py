@@ -0,0 +1,372 @@
+"""
+MQTT protocol module for IoT device agent.
+This module encodes and decodes the MQTT 3.1.1 packets used by the agent tooling, and provides a
+minimal asyncio client. The client needs neither a thread nor a paho instance per connection, so
+thousands of them fit on one event loop, for example to simulate a fleet of devices.
+"""
+
+import asyncio
+import itertools
+import struct
+import time
+
+# Packet types, the high nibble of the first byte
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# Largest value of the variable length "remaining length" field
+MAX_REMAINING_LENGTH = 268435455
+
+PINGREQ_PACKET = b"\xc0\x00"
+PINGRESP_PACKET = b"\xd0\x00"
+DISCONNECT_PACKET = b"\xe0\x00"
+
+
+class MQTTProtocolError(Exception):
+    """A malformed or unexpected packet."""
+
+
+class ConnectionRefused(Exception):
+    """The broker answered a CONNECT with a non-zero return code."""
+
+    def __init__(self, return_code):
+        super().__init__(f"Connection refused with code {return_code}")
+        self.return_code = return_code
+
+
+def encode_remaining_length(length):
+    """Encode the remaining length of a packet as a variable length integer."""
+    if not 0 <= length <= MAX_REMAINING_LENGTH:
+        raise MQTTProtocolError(f"Packet too large: {length} bytes")
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(text):
+    """Encode a length-prefixed UTF-8 string."""
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    return struct.pack("!H", len(data)) + data
+
+
+def decode_string(data, offset=0):
+    """Decode a length-prefixed UTF-8 string, returning it with the offset after it."""
+    if len(data) < offset + 2:
+        raise MQTTProtocolError("Truncated string")
+    (length,) = struct.unpack_from("!H", data, offset)
+    end = offset + 2 + length
+    if len(data) < end:
+        raise MQTTProtocolError("Truncated string")
+    return data[offset + 2 : end].decode("utf-8"), end
+
+
+def packet(packet_type, flags, body):
+    """Return a packet made of a fixed header and ``body``."""
+    return bytes(((packet_type << 4) | flags,)) + encode_remaining_length(len(body)) + body
+
+
+def connect_packet(client_id, username="", password="", keepalive=60, clean_session=True):
+    """Return a CONNECT packet."""
+    flags = 0x02 if clean_session else 0x00
+    payload = encode_string(client_id)
+    # Like the paho client, credentials are only sent when both are set
+    if username and password:
+        flags |= 0x80 | 0x40
+        payload += encode_string(username) + encode_string(password)
+    body = encode_string("MQTT") + bytes((4, flags)) + struct.pack("!H", keepalive) + payload
+    return packet(CONNECT, 0, body)
+
+
+def connack_packet(return_code, session_present=False):
+    """Return a CONNACK packet."""
+    return packet(CONNACK, 0, bytes((int(session_present), return_code)))
+
+
+def publish_packet(topic, payload, qos=0, packet_id=None, retain=False, dup=False):
+    """Return a PUBLISH packet; QoS 1 and 2 messages need a ``packet_id``."""
+    flags = (0x08 if dup else 0) | (qos << 1) | (0x01 if retain else 0)
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return packet(PUBLISH, flags, body + payload)
+
+
+def puback_packet(packet_id):
+    """Return the PUBACK of a QoS 1 message."""
+    return packet(PUBACK, 0, struct.pack("!H", packet_id))
+
+
+def subscribe_packet(packet_id, topics):
+    """Return a SUBSCRIBE packet for ``(topic filter, qos)`` pairs."""
+    body = struct.pack("!H", packet_id)
+    for topic_filter, qos in topics:
+        body += encode_string(topic_filter) + bytes((qos,))
+    return packet(SUBSCRIBE, 0x02, body)
+
+
+def suback_packet(packet_id, granted):
+    """Return the SUBACK of a SUBSCRIBE, with the granted QoS of every topic filter."""
+    return packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(granted))
+
+
+def unsuback_packet(packet_id):
+    """Return the UNSUBACK of an UNSUBSCRIBE."""
+    return packet(UNSUBACK, 0, struct.pack("!H", packet_id))
+
+
+def parse_connect(body):
+    """Decode the body of a CONNECT packet into a dict."""
+    protocol, offset = decode_string(body)
+    if protocol != "MQTT" or len(body) < offset + 4:
+        raise MQTTProtocolError(f"Unsupported protocol {protocol!r}")
+    level, flags = body[offset], body[offset + 1]
+    (keepalive,) = struct.unpack_from("!H", body, offset + 2)
+    client_id, offset = decode_string(body, offset + 4)
+    connect = {
+        "level": level,
+        "clean_session": bool(flags & 0x02),
+        "keepalive": keepalive,
+        "client_id": client_id,
+        "username": None,
+        "password": None,
+    }
+    if flags & 0x04:
+        # The will message is not used, but has to be skipped
+        _, offset = decode_string(body, offset)
+        (length,) = struct.unpack_from("!H", body, offset)
+        offset += 2 + length
+    if flags & 0x80:
+        connect["username"], offset = decode_string(body, offset)
+    if flags & 0x40:
+        (length,) = struct.unpack_from("!H", body, offset)
+        connect["password"] = body[offset + 2 : offset + 2 + length].decode("utf-8")
+    return connect
+
+
+def parse_subscribe(body):
+    """Decode the body of a SUBSCRIBE packet into the packet ID and ``(filter, qos)`` pairs."""
+    (packet_id,) = struct.unpack_from("!H", body)
+    topics, offset = [], 2
+    while offset < len(body):
+        topic_filter, offset = decode_string(body, offset)
+        if offset >= len(body):
+            raise MQTTProtocolError("Truncated SUBSCRIBE")
+        topics.append((topic_filter, body[offset] & 0x03))
+        offset += 1
+    if not topics:
+        raise MQTTProtocolError("SUBSCRIBE without topic filters")
+    return packet_id, topics
+
+
+def parse_unsubscribe(body):
+    """Decode the body of an UNSUBSCRIBE packet into the packet ID and topic filters."""
+    (packet_id,) = struct.unpack_from("!H", body)
+    topic_filters, offset = [], 2
+    while offset < len(body):
+        topic_filter, offset = decode_string(body, offset)
+        topic_filters.append(topic_filter)
+    return packet_id, topic_filters
+
+
+def topic_matches(topic_filter, topic):
+    """Return True when ``topic`` matches a filter with ``+`` and ``#`` wildcards."""
+    # Wildcards at the root do not match the $SYS style topics of brokers
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def parse_publish(flags, body):
+    """Decode the body of a PUBLISH packet into ``(topic, payload, qos, packet_id, retain)``."""
+    qos = (flags >> 1) & 0x03
+    if qos == 3:
+        raise MQTTProtocolError("Invalid QoS 3")
+    topic, offset = decode_string(body)
+    packet_id = None
+    if qos:
+        if len(body) < offset + 2:
+            raise MQTTProtocolError("Truncated PUBLISH")
+        (packet_id,) = struct.unpack_from("!H", body, offset)
+        offset += 2
+    return topic, body[offset:], qos, packet_id, bool(flags & 0x01)
+
+
+async def read_packet(reader, max_size=MAX_REMAINING_LENGTH):
+    """Read one packet from a stream, returning ``(packet type, flags, body)``."""
+    first = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MQTTProtocolError("Malformed remaining length")
+    if length > max_size:
+        raise MQTTProtocolError(f"Packet of {length} bytes exceeds the {max_size} bytes limit")
+    body = await reader.readexactly(length) if length else b""
+    return first >> 4, first & 0x0F, body
+
+
+class AsyncMQTTClient:
+    """Minimal MQTT 3.1.1 client on asyncio streams, publishing with QoS 0 or 1.
+
+    Incoming messages of subscriptions are passed to ``on_message(topic, payload)``.
+    """
+
+    def __init__(self, client_id, username="", password="", keepalive=60, on_message=None):
+        """Initialize a disconnected client."""
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.on_message = on_message
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+        self._pending = {}
+        self._packet_ids = itertools.cycle(range(1, 65536))
+        self._closed = None
+
+    @property
+    def is_connected(self):
+        """Return True while the connection is open."""
+        return self._closed is not None and not self._closed.done()
+
+    async def connect(self, host, port, timeout=10.0):
+        """Connect to a broker, raising ``ConnectionRefused`` when it rejects the client."""
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout
+        )
+        self._writer.write(
+            connect_packet(self.client_id, self.username, self.password, self.keepalive)
+        )
+        packet_type, _, body = await asyncio.wait_for(read_packet(self._reader), timeout)
+        if packet_type != CONNACK or len(body) != 2:
+            self._writer.close()
+            raise MQTTProtocolError(f"Expected CONNACK, got packet type {packet_type}")
+        if body[1] != 0:
+            self._writer.close()
+            raise ConnectionRefused(body[1])
+
+        self._closed = asyncio.get_running_loop().create_future()
+        self._tasks = [asyncio.create_task(self._read_loop())]
+        if self.keepalive:
+            self._tasks.append(asyncio.create_task(self._ping_loop()))
+
+    async def publish(self, topic, payload, qos=1, retain=False, timeout=10.0):
+        """Publish a message, returning the acknowledgement latency of a QoS 1 message."""
+        if not self.is_connected:
+            raise ConnectionError("Not connected")
+        if qos == 0:
+            self._writer.write(publish_packet(topic, payload, retain=retain))
+            await self._writer.drain()
+            return None
+        if qos != 1:
+            raise ValueError("Only QoS 0 and 1 are supported")
+
+        packet_id = self._next_packet_id()
+        acknowledged = self._pending[packet_id] = asyncio.get_running_loop().create_future()
+        sent_at = time.perf_counter()
+        try:
+            self._writer.write(publish_packet(topic, payload, 1, packet_id, retain))
+            await self._writer.drain()
+            await asyncio.wait_for(asyncio.shield(acknowledged), timeout)
+        finally:
+            self._pending.pop(packet_id, None)
+        return time.perf_counter() - sent_at
+
+    async def subscribe(self, topic_filter, qos=0, timeout=10.0):
+        """Subscribe to a topic filter, returning the QoS granted by the broker."""
+        packet_id = self._next_packet_id()
+        granted = self._pending[packet_id] = asyncio.get_running_loop().create_future()
+        try:
+            self._writer.write(subscribe_packet(packet_id, [(topic_filter, qos)]))
+            await self._writer.drain()
+            return await asyncio.wait_for(asyncio.shield(granted), timeout)
+        finally:
+            self._pending.pop(packet_id, None)
+
+    async def disconnect(self):
+        """Send a DISCONNECT packet and close the connection."""
+        if self.is_connected:
+            try:
+                self._writer.write(DISCONNECT_PACKET)
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+        await self._close()
+
+    def _next_packet_id(self):
+        for packet_id in self._packet_ids:
+            if packet_id not in self._pending:
+                return packet_id
+
+    async def _read_loop(self):
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(self._reader)
+                if packet_type in (PUBACK, SUBACK):
+                    (packet_id,) = struct.unpack_from("!H", body)
+                    future = self._pending.get(packet_id)
+                    if future is not None and not future.done():
+                        future.set_result(body[2] if packet_type == SUBACK else None)
+                elif packet_type == PUBLISH:
+                    topic, payload, qos, packet_id, _ = parse_publish(flags, body)
+                    if qos == 1:
+                        self._writer.write(puback_packet(packet_id))
+                    if self.on_message is not None:
+                        self.on_message(topic, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, MQTTProtocolError):
+            pass
+        finally:
+            self._fail_pending()
+            if self._closed is not None and not self._closed.done():
+                self._closed.set_result(None)
+
+    async def _ping_loop(self):
+        # Half the keepalive leaves the broker one and a half periods of margin
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self._writer.write(PINGREQ_PACKET)
+
+    def _fail_pending(self):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection lost"))
+
+    async def _close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+        self._fail_pending()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
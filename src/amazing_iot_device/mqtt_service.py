@@ -4,21 +4,51 @@ This module provides functionality to collect and publish hardware information t
 via MQTT.
 """
 
-import json
+import functools
+import hashlib
 import logging
 import os
-import platform
-import socket
 import threading
 import time
 import uuid
 from datetime import datetime
 
 import paho.mqtt.client as paho_mqtt
-import psutil
 from dotenv import load_dotenv
 
-from amazing_iot_device.models import Settings
+from amazing_iot_device import codec
+from amazing_iot_device.aggregation import WindowAggregator
+from amazing_iot_device.async_runtime import RUNTIMES, AsyncRuntime
+from amazing_iot_device.batching import SampleBatch
+from amazing_iot_device.collectors import (
+    collector_registry,
+    cpu_metrics,
+    disk_metrics,
+    memory_metrics,
+)
+from amazing_iot_device.connection import ConnectionManager, ExponentialBackoff
+from amazing_iot_device.deadband import Deadband, DeadbandFilter
+from amazing_iot_device.metrics import (
+    COLLECTION_DURATION,
+    CONNECTIONS,
+    DISCONNECTIONS,
+    LAST_PUBLISH,
+    MESSAGES_PUBLISHED,
+    MQTT_CONNECTED,
+    OUTBOX_DEPTH,
+    OUTBOX_EVICTED,
+    PUBLISH_ACK_LATENCY,
+    PUBLISH_CYCLE_DURATION,
+    PUBLISH_FAILURES,
+    SAMPLES_DROPPED,
+    SERVICE_ERRORS,
+    agent_summary,
+)
+from amazing_iot_device.outbox import Outbox
+from amazing_iot_device.publish_pipeline import PublishPipeline
+from amazing_iot_device.sampler import resource_sampler
+from amazing_iot_device.scheduler import Scheduler
+from amazing_iot_device.settings_repository import settings_repository
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,6 +59,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger("mqtt_service")
 
+# Keys of the MQTT related settings stored in the database
+MQTT_SETTINGS_KEYS = [
+    "mqtt_enabled",
+    "mqtt_broker_host",
+    "mqtt_broker_port",
+    "mqtt_client_id",
+    "mqtt_username",
+    "mqtt_password",
+    "mqtt_topic_prefix",
+    "mqtt_publish_interval",
+    "mqtt_delta_publish",
+    "mqtt_inflight_window",
+    "mqtt_publish_timeout",
+    "mqtt_outbox_max_messages",
+    "mqtt_outbox_max_age",
+    "mqtt_outbox_drain_rate",
+    "mqtt_publish_mode",
+    "mqtt_sample_interval",
+    "mqtt_payload_format",
+    "mqtt_reconnect_max_delay",
+    "mqtt_deadband_enabled",
+    "mqtt_deadband_heartbeat",
+    # Per-metric deadbands, stored as "absolute,relative"
+    *(f"mqtt_deadband_{name}" for name in codec.RESOURCES_FIELDS),
+]
+
+# Publishing modes: one message per topic and sample, many samples in one batch message, or one
+# min/max/mean/last/p95 rollup per metric and window
+PUBLISH_MODES = ("raw", "batch", "aggregate")
+
+# Topics whose content rarely changes and which are retained in delta publishing mode
+STATIC_TOPICS = ("system", "network")
+
 
 class MQTTService:
     """MQTT client service for publishing device information to a broker."""
@@ -42,6 +105,39 @@ class MQTTService:
         self.thread = None
         self.is_running = False
         self.publish_interval = 60  # Default interval in seconds
+        # Connects in the background and reconnects with exponential backoff and jitter
+        self.connection = None
+        self.reconnect_max_delay = 120.0
+        # Publish the static topics as retained messages only when their content changes
+        self.delta_publish = False
+        self._published_hashes = {}
+        # Keeps several QoS 1 messages in flight and tracks their acknowledgements
+        self.pipeline = PublishPipeline(window=4, timeout=10.0)
+        # Store-and-forward queue for samples taken while the broker is unreachable
+        self.outbox = None
+        # In batch mode resources are sampled every sample_interval and flushed every
+        # publish_interval as a single columnar message
+        self.publish_mode = "raw"
+        self.sample_interval = 1.0
+        self.batch = SampleBatch()
+        # In aggregate mode the samples of a window are summarized per metric instead
+        self.aggregator = WindowAggregator()
+        # Report resource metrics only when they move past their deadband (raw mode)
+        self.deadband_enabled = False
+        self.deadband = DeadbandFilter()
+        # Wire format of the payloads, see codec.FORMATS
+        self.payload_format = "json"
+        # Collectors run on their own schedules; their latest results are published
+        self.collectors = collector_registry
+        self.scheduler = None
+        # Time of the last acknowledged message, shown on the settings page
+        self.last_published = None
+        self._results = {}
+        self._results_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Threads by default; the asyncio runtime runs the whole service on one event loop
+        self.runtime = "threads"
+        self.async_runtime = None
 
         # Default settings - will be overridden by .env or database values
         self.broker_settings = {
@@ -58,33 +154,56 @@ class MQTTService:
     def init_app(self, app):
         """Initialize the service with the Flask app context."""
         self.app = app
+        self.set_runtime(app.config.get("AGENT_RUNTIME", self.runtime))
+
+        # Open the on-device outbox next to the application database
+        if self.outbox is None:
+            self.outbox = Outbox(os.path.join(app.instance_path, "outbox.sqlite"))
+
+        # Gauges read from the service served by the app when the metrics are rendered
+        OUTBOX_DEPTH.set_function(lambda: self.outbox.depth if self.outbox else 0)
+        OUTBOX_EVICTED.set_function(lambda: self.outbox.evicted_total if self.outbox else 0)
+        MQTT_CONNECTED.set_function(lambda: int(bool(self.client and self.client.is_connected())))
 
-        # Load settings from database
-        with app.app_context():
-            self._load_settings()
+        # Load settings from the settings snapshot and follow their changes
+        self._load_settings()
+        settings_repository.subscribe(self._on_settings_changed)
 
         # Setup MQTT client
         self._setup_mqtt_client()
 
+    def set_runtime(self, runtime):
+        """Select the ``threads`` or ``asyncio`` runtime; must be called while stopped."""
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Unknown runtime {runtime}, expected one of {', '.join(RUNTIMES)}")
+        self.runtime = runtime
+        self.async_runtime = AsyncRuntime(self) if runtime == "asyncio" else None
+
     def _load_settings(self):
-        """Load MQTT settings from the database."""
-        settings = {
-            s.key: s.value
-            for s in Settings.query.filter(
-                Settings.key.in_(
-                    [
-                        "mqtt_broker_host",
-                        "mqtt_broker_port",
-                        "mqtt_client_id",
-                        "mqtt_username",
-                        "mqtt_password",
-                        "mqtt_topic_prefix",
-                        "mqtt_publish_interval",
-                    ]
-                )
-            ).all()
-        }
+        """Load MQTT settings from the settings repository."""
+        self._apply_settings(self._mqtt_settings())
+
+    def _mqtt_settings(self):
+        """Return the stored MQTT settings."""
+        snapshot = settings_repository.snapshot()
+        return {key: snapshot[key] for key in MQTT_SETTINGS_KEYS if key in snapshot}
 
+    def _on_settings_changed(self, changes, version):
+        """Apply saved settings when MQTT settings are among them, starting or stopping."""
+        if not any(key in changes for key in MQTT_SETTINGS_KEYS):
+            return
+        # All of them, since a setting like a deadband depends on the others
+        settings = self._mqtt_settings()
+        enabled = settings.get("mqtt_enabled", "false").lower() == "true"
+        # Stopped first, so the settings are applied without the service thread
+        if not enabled and self.is_running:
+            self.stop(wait=False)
+        self.update_settings(settings)
+        if enabled and not self.is_running:
+            self.start()
+
+    def _apply_settings(self, settings):
+        """Apply MQTT settings given as the string values stored in the database."""
         if settings.get("mqtt_broker_host"):
             self.broker_settings["host"] = settings.get("mqtt_broker_host")
 
@@ -106,9 +225,62 @@ class MQTTService:
         if settings.get("mqtt_publish_interval"):
             self.publish_interval = int(settings.get("mqtt_publish_interval"))
 
+        if settings.get("mqtt_delta_publish"):
+            self.delta_publish = settings.get("mqtt_delta_publish").lower() == "true"
+
+        if settings.get("mqtt_inflight_window"):
+            self.pipeline.configure(window=int(settings.get("mqtt_inflight_window")))
+
+        if settings.get("mqtt_publish_timeout"):
+            self.pipeline.configure(timeout=float(settings.get("mqtt_publish_timeout")))
+
+        if settings.get("mqtt_publish_mode") in PUBLISH_MODES:
+            self.publish_mode = settings.get("mqtt_publish_mode")
+
+        if settings.get("mqtt_sample_interval"):
+            self.sample_interval = float(settings.get("mqtt_sample_interval"))
+
+        if settings.get("mqtt_reconnect_max_delay"):
+            self.reconnect_max_delay = float(settings.get("mqtt_reconnect_max_delay"))
+
+        if settings.get("mqtt_payload_format") in codec.FORMATS:
+            self.payload_format = settings.get("mqtt_payload_format")
+
+        if settings.get("mqtt_deadband_enabled"):
+            self.deadband_enabled = settings.get("mqtt_deadband_enabled").lower() == "true"
+
+        bands = {}
+        for name in codec.RESOURCES_FIELDS:
+            try:
+                band = Deadband.parse(settings.get(f"mqtt_deadband_{name}"))
+            except ValueError as e:
+                logger.warning(f"Ignoring deadband of {name}: {str(e)}")
+                continue
+            if band != Deadband():
+                bands[name] = band
+        heartbeat = settings.get("mqtt_deadband_heartbeat")
+        heartbeat = float(heartbeat) if heartbeat else self.deadband.heartbeat
+        # Reconfiguring re-sends every metric, so only do it when the deadbands changed
+        if bands != self.deadband.bands or heartbeat != self.deadband.heartbeat:
+            self.deadband.configure(bands=bands, heartbeat=heartbeat)
+
+        if self.outbox is not None:
+            if settings.get("mqtt_outbox_max_messages"):
+                self.outbox.configure(max_messages=int(settings.get("mqtt_outbox_max_messages")))
+            if settings.get("mqtt_outbox_max_age"):
+                # Stored in hours
+                self.outbox.configure(max_age=float(settings.get("mqtt_outbox_max_age")) * 3600)
+            if settings.get("mqtt_outbox_drain_rate"):
+                self.outbox.configure(drain_rate=float(settings.get("mqtt_outbox_drain_rate")))
+
     def _setup_mqtt_client(self):
         """Set up the MQTT client with callbacks."""
-        self.client = paho_mqtt.Client(client_id=self.client_id, clean_session=True)
+        # Reconnects are made by the connection manager, with backoff and jitter
+        self.client = paho_mqtt.Client(
+            client_id=self.client_id, clean_session=True, reconnect_on_failure=False
+        )
+        self.client.max_inflight_messages_set(self.pipeline.window)
+        self.pipeline.reset()
 
         # Set up callbacks
         self.client.on_connect = self._on_connect
@@ -128,17 +300,28 @@ class MQTTService:
             logger.info(
                 f"Connected to MQTT broker at {self.broker_settings['host']}:{self.broker_settings['port']}"
             )
+            # Re-send the static topics once per connection in case the broker lost them
+            self._published_hashes.clear()
         else:
             logger.error(f"Failed to connect to MQTT broker with code {rc}")
+        CONNECTIONS.labels("accepted" if rc == 0 else "refused").inc()
+        if self.connection:
+            self.connection.connected(rc)
 
     def _on_disconnect(self, client, userdata, rc):
         """Callback for when the client disconnects from the broker."""
         if rc != 0:
             logger.warning("Unexpected disconnection from MQTT broker")
+        DISCONNECTIONS.labels("requested" if rc == 0 else "lost").inc()
+        if self.connection:
+            self.connection.disconnected(rc)
 
     def _on_publish(self, client, userdata, mid):
         """Callback for when a message is published."""
         logger.debug(f"Message {mid} published successfully")
+        self.pipeline.ack(mid)
+        if self.async_runtime is not None:
+            self.async_runtime.acknowledged()
 
     def start(self):
         """Start the MQTT service in a separate thread."""
@@ -146,124 +329,464 @@ class MQTTService:
             logger.warning("MQTT service is already running")
             return
 
+        self._wait_for_previous_run()
         self.is_running = True
-        self.thread = threading.Thread(target=self._run)
+        # Every run gets its own stop event and scheduler, so that a run that is still shutting
+        # down cannot be confused with the new one
+        self._stop_event = threading.Event()
+        self.scheduler = self._create_scheduler()
+        run = self.async_runtime.run if self.async_runtime is not None else self._run
+        self.thread = threading.Thread(target=run, args=(self.scheduler, self._stop_event))
         self.thread.daemon = True
         self.thread.start()
-        logger.info("MQTT service started")
+        logger.info(f"MQTT service started with the {self.runtime} runtime")
 
-    def stop(self):
-        """Stop the MQTT service."""
+    def stop(self, wait=True):
+        """Stop the MQTT service, waiting for its thread unless ``wait`` is False."""
         self.is_running = False
-        if self.client:
-            self.client.disconnect()
-        if self.thread:
+        self._stop_event.set()
+        if self.scheduler:
+            self.scheduler.wake()
+        if wait and self.thread:
             self.thread.join(timeout=5)
         logger.info("MQTT service stopped")
 
-    def _run(self):
-        """Run the MQTT service, collecting and publishing data periodically."""
+    def status(self):
+        """Return the connection and publishing state shown on the MQTT settings page."""
+        return {
+            "connected": bool(self.is_running and self.client and self.client.is_connected()),
+            "publish_latency": self.pipeline.latency_stats(),
+            "outbox": self.outbox.stats() if self.outbox else None,
+            "last_published": self.last_published,
+            "agent_metrics": agent_summary(),
+        }
+
+    def update_settings(self, settings):
+        """Apply changed MQTT settings without restarting the service.
+
+        The settings are applied in place on the service thread and this method returns
+        immediately. Interval, topic and format changes take effect from the next cycle; only a
+        broker, credential or client id change reconnects.
+        """
+        if self.is_running and self.scheduler is not None:
+            self.scheduler.call_soon(lambda: self._reconfigure(settings))
+        else:
+            self._wait_for_previous_run()
+            self._apply_settings(settings)
+            self._setup_mqtt_client()
+
+    def _wait_for_previous_run(self):
+        """
+        Wait for the thread of a run stopped without waiting, which still owns the client and
+        the connection until it has cleaned them up.
+        """
+        thread = self.thread
+        if thread is None or thread is threading.current_thread() or not thread.is_alive():
+            return
+        thread.join(timeout=5)
+        if thread.is_alive():
+            logger.warning("The previous run of the MQTT service did not stop in time")
+
+    def _reconfigure(self, settings):
+        """Apply settings to the running service, acting only on what changed."""
+        connection_settings = self._connection_settings()
+        publishing = (self.publish_mode, self.publish_interval, self.sample_interval)
+        self._apply_settings(settings)
+
+        if self._connection_settings() != connection_settings:
+            logger.info("Broker settings changed, reconnecting")
+            if self.connection:
+                self.connection.stop()
+            self._setup_mqtt_client()
+            self.connection = self._create_connection()
+            self.connection.start()
+        else:
+            self.client.max_inflight_messages_set(self.pipeline.window)
+            if self.connection:
+                self.connection.backoff.cap = max(self.reconnect_max_delay, 1.0)
+
+        if (self.publish_mode, self.publish_interval, self.sample_interval) != publishing:
+            logger.info(f"Publishing {self.publish_mode} data every {self.publish_interval}s")
+            previous_mode = publishing[0]
+            self.scheduler.remove_job("sample")
+            self.scheduler.remove_job("publish")
+            if previous_mode != self.publish_mode and previous_mode in ("batch", "aggregate"):
+                # Send what was collected in the previous mode instead of dropping it
+                flush = self._publish_job(self._publishing_jobs(previous_mode)[1])
+                if self.async_runtime is not None:
+                    self.async_runtime.spawn(flush())
+                else:
+                    flush()
+            self._schedule_publishing(self.scheduler)
+
+    def _connection_settings(self):
+        """Return the settings that require a new connection when they change."""
+        return (
+            self.broker_settings["host"],
+            self.broker_settings["port"],
+            self.broker_settings["username"],
+            self.broker_settings["password"],
+            self.client_id,
+        )
+
+    def _create_connection(self):
+        """Create the connection manager of the current client and broker."""
+        backoff = ExponentialBackoff(cap=max(self.reconnect_max_delay, 1.0))
+        if self.async_runtime is not None:
+            return self.async_runtime.create_connection(
+                self.client,
+                self.broker_settings["host"],
+                self.broker_settings["port"],
+                backoff=backoff,
+            )
+        return ConnectionManager(
+            self.client,
+            self.broker_settings["host"],
+            self.broker_settings["port"],
+            backoff=backoff,
+        )
+
+    def _run(self, scheduler, stop_event):
+        """Run the MQTT service, collecting and publishing data on the scheduler."""
         try:
-            # Connect to the broker
-            self.client.connect(self.broker_settings["host"], self.broker_settings["port"])
-            self.client.loop_start()
+            # Connect in the background, sampling starts right away and samples taken while
+            # disconnected go to the outbox
+            self.connection = self._create_connection()
+            self.connection.start()
 
-            while self.is_running:
-                # Collect and publish hardware information
-                self._publish_hardware_info()
-                # Sleep for the configured interval
-                time.sleep(self.publish_interval)
+            scheduler.run(stop_event)
 
         except Exception as e:
             logger.error(f"Error in MQTT service: {str(e)}")
+            SERVICE_ERRORS.inc()
         finally:
-            if self.client:
-                self.client.loop_stop()
-                if self.client.is_connected():
-                    self.client.disconnect()
-
-    def _get_hardware_info(self):
-        """Collect hardware information from the system."""
-        # System information
-        system_info = {
-            "os_name": platform.system(),
-            "os_version": platform.version(),
-            "os_release": platform.release(),
-            "device_version": os.environ.get("DEVICE_VERSION", "0.1.0"),
-            "python_version": platform.python_version(),
-            "hostname": platform.node(),
-            "processor": platform.processor(),
-            "architecture": platform.machine(),
-        }
+            scheduler.shutdown()
+            # The last connection of this run, replaced by reconnects on this thread only
+            connection = self.connection
+            if connection:
+                connection.stop()
+
+    def _create_scheduler(self):
+        """Schedule every collector and the publishing jobs."""
+        if self.async_runtime is not None:
+            scheduler = self.async_runtime.create_scheduler()
+        else:
+            scheduler = Scheduler(max_workers=2)
+        for collector in self.collectors:
+            scheduler.add_job(
+                f"collect:{collector.name}",
+                lambda collector=collector: self._run_collector(collector),
+                collector.interval,
+                blocking=collector.blocking,
+            )
+        self._schedule_publishing(scheduler)
+        return scheduler
+
+    def _publishing_jobs(self, mode):
+        """Return the sampling function and the topic builder of a publish mode."""
+        if mode == "batch":
+            return self._sample_into_batch, self._batch_topics
+        if mode == "aggregate":
+            return self._sample_into_window, self._aggregate_topics
+        return None, self._hardware_info_topics
+
+    def _publish_job(self, build_topics):
+        """Return the function publishing the topics of ``build_topics`` with this runtime."""
+        if self.async_runtime is not None:
+            # A coroutine function, run as a task that waits for acknowledgements on the loop
+            return functools.partial(self.async_runtime.publish, build_topics)
+        return functools.partial(self._publish, build_topics)
+
+    def _schedule_publishing(self, scheduler):
+        """Add the sampling and publishing jobs of the current publish mode."""
+        sample, build_topics = self._publishing_jobs(self.publish_mode)
+        publish = self._publish_job(build_topics)
+        # Publishing waits for broker acknowledgements, so it runs on the worker pool
+        if sample is not None:
+            scheduler.add_job("sample", sample, self.sample_interval)
+            scheduler.add_job(
+                "publish",
+                publish,
+                self.publish_interval,
+                blocking=True,
+                delay=self.publish_interval,
+            )
+        else:
+            scheduler.add_job("publish", publish, self.publish_interval, blocking=True)
 
-        # Network information
+    def _run_collector(self, collector):
+        """Run one collector and keep its result for the next publish."""
         try:
-            hostname = socket.gethostname()
-            ip_address = socket.gethostbyname(hostname)
-            network_info = {
-                "hostname": hostname,
-                "ip_address": ip_address,
-            }
+            with COLLECTION_DURATION.labels(collector.name).time():
+                result = collector.collect()
         except Exception as e:
-            logger.error(f"Error getting network information: {str(e)}")
-            network_info = {"error": str(e)}
-
-        # Resource usage
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage("/")
-
-        resource_usage = {
-            "cpu_percent": cpu_percent,
-            "memory_percent": memory.percent,
-            "memory_used_mb": memory.used / (1024 * 1024),
-            "memory_total_mb": memory.total / (1024 * 1024),
-            "disk_percent": disk.percent,
-            "disk_used_gb": disk.used / (1024**3),
-            "disk_total_gb": disk.total / (1024**3),
-        }
+            logger.error(f"Error in collector {collector.name}: {str(e)}")
+            return None
+        with self._results_lock:
+            self._results[collector.name] = result
+        return result
+
+    def _collect_sections(self):
+        """Merge the latest collector results into sections, in registration order."""
+        with self._results_lock:
+            results = dict(self._results)
+
+        sections = {"system": {}, "network": {}, "resources": {}}
+        for collector in self.collectors:
+            result = results.get(collector.name)
+            if result is None:
+                # The collector has not run yet, collect its first value inline
+                result = self._run_collector(collector)
+                if result is None:
+                    continue
+            sections.setdefault(collector.section, {}).update(result)
+        return sections
+
+    def _get_hardware_info(self):
+        """Collect hardware information from the system."""
+        sections = self._collect_sections()
 
         # Combined hardware information
         hardware_info = {
             "timestamp": datetime.now().isoformat(),
             "device_id": self.client_id,
-            "system": system_info,
-            "network": network_info,
-            "resources": resource_usage,
+            **sections,
         }
 
         return hardware_info
 
-    def _publish_hardware_info(self):
-        """Publish hardware information to MQTT broker."""
-        if not self.client.is_connected():
-            logger.warning("Not connected to MQTT broker, attempting to reconnect...")
-            try:
-                self.client.reconnect()
-            except Exception as e:
-                logger.error(f"Failed to reconnect: {str(e)}")
-                return
+    def _get_resource_usage(self, snapshot):
+        """Convert a sampler snapshot into the published resource usage metrics."""
+        return {**cpu_metrics(snapshot), **memory_metrics(snapshot), **disk_metrics(snapshot)}
 
+    def _sample_into_batch(self):
+        """Add a fresh resource sample to the batch buffer."""
+        if self.batch.is_full:
+            logger.warning("Batch buffer is full, skipping sample until the next flush")
+            SAMPLES_DROPPED.labels("batch_full").inc()
+            return
+        # Ask for a snapshot younger than the sampling period so no sample is repeated
+        snapshot = resource_sampler.get_snapshot(max_age=self.sample_interval / 2)
+        self.batch.add(self._get_resource_usage(snapshot), timestamp=snapshot.timestamp)
+
+    def _sample_into_window(self):
+        """Add a fresh resource sample to the aggregation window."""
+        snapshot = resource_sampler.get_snapshot(max_age=self.sample_interval / 2)
+        self.aggregator.add(self._get_resource_usage(snapshot), timestamp=snapshot.timestamp)
+
+    def _aggregate_topics(self):
+        """Return the topics of an aggregate cycle: the window rollup on the resources topic."""
+        rollup = self.aggregator.flush(self.client_id)
+        if rollup is None:
+            return None
+
+        sections = self._collect_sections()
+        topics = {name: section for name, section in sections.items() if name != "resources"}
+        topics["resources"] = rollup
+        logger.debug(f"Publishing the rollup of {rollup['count']} samples")
+        return topics, datetime.now().isoformat()
+
+    def _batch_topics(self):
+        """Return the topics of a batch cycle: the buffered samples as a single message."""
+        batch = self.batch.flush(self.client_id)
+        if batch is None:
+            return None
+
+        sections = self._collect_sections()
+        # Resource samples are part of the batch, every other section keeps its own topic
+        topics = {name: section for name, section in sections.items() if name != "resources"}
+        topics["batch"] = batch
+        logger.debug(f"Publishing a batch of {batch['count']} samples")
+        return topics, datetime.now().isoformat()
+
+    def _hardware_info_topics(self):
+        """Return the topics of a raw cycle: every section, plus everything together."""
         hardware_info = self._get_hardware_info()
 
-        # Publish to different topics
         topics = {
-            "system": hardware_info["system"],
-            "network": hardware_info["network"],
-            "resources": hardware_info["resources"],
-            "full": hardware_info,
+            name: section for name, section in hardware_info.items() if isinstance(section, dict)
         }
+        topics["full"] = hardware_info
+
+        if self.deadband_enabled:
+            resources = self.deadband.filter(hardware_info["resources"])
+            if resources is None:
+                # Nothing moved past its deadband, so the complete state has not changed either
+                logger.debug("Resources within their deadbands, skipping resources and full")
+                del topics["resources"], topics["full"]
+            else:
+                topics["resources"] = {"timestamp": hardware_info["timestamp"], **resources}
+
+        return topics, hardware_info["timestamp"]
+
+    def _publish_hardware_info(self):
+        """Publish hardware information to MQTT broker."""
+        self._publish(self._hardware_info_topics)
+
+    def _publish(self, build_topics):
+        """Build the topics of a publish cycle and publish them."""
+        with PUBLISH_CYCLE_DURATION.time():
+            cycle = build_topics()
+            if cycle is not None:
+                self._publish_topics(*cycle)
 
+    def _publish_topics(self, topics, timestamp):
+        """Publish one payload per topic suffix, queueing them in the outbox when offline."""
+        if not self.client.is_connected():
+            # The connection manager reconnects in the background, never wait for it here
+            logger.warning("Not connected to MQTT broker, keeping the sample in the outbox")
+            self._store_offline(topics, timestamp)
+            return
+
+        # Send every topic through the in-flight window, then wait for the acknowledgements
+        deadline = time.monotonic() + self.pipeline.timeout
+        content_hashes = {}
+        unsent = {}
+        for topic_suffix, topic, payload, message, retain in self._encode_topics(
+            topics, content_hashes
+        ):
+            sent = self.pipeline.submit(
+                self.client, topic, message, qos=1, retain=retain, deadline=deadline
+            )
+            if sent is None:
+                logger.warning(f"Failed to publish to {topic}")
+                unsent[topic_suffix] = payload
+
+        completed, pending = self.pipeline.drain(deadline)
+        if self._finish_publish(completed, pending, content_hashes, unsent, timestamp):
+            # Fresh samples went out first, now forward part of the backlog
+            self._drain_outbox()
+
+    def _encode_topics(self, topics, content_hashes):
+        """
+        Yield ``(topic_suffix, topic, payload, message, retain)`` for every topic to send.
+
+        In delta publishing mode unchanged static topics are skipped, and the hashes of the
+        changed ones are added to ``content_hashes`` until their acknowledgement.
+        """
         for topic_suffix, payload in topics.items():
             topic = f"{self.broker_settings['topic_prefix']}/{topic_suffix}"
-            message_info = self.client.publish(
-                topic=topic, payload=json.dumps(payload), qos=1, retain=False
+            message = codec.encode(payload, self.payload_format)
+
+            retain = False
+            if self.delta_publish and topic_suffix in STATIC_TOPICS:
+                content_hash = hashlib.sha256(message).hexdigest()
+                if self._published_hashes.get(topic_suffix) == content_hash:
+                    logger.debug(f"Skipping unchanged {topic}")
+                    continue
+                content_hashes[topic] = (topic_suffix, content_hash)
+                retain = True
+
+            yield topic_suffix, topic, payload, message, retain
+
+    def _finish_publish(self, completed, pending, content_hashes, unsent, timestamp):
+        """Record the outcome of a publish cycle, returning True when the backlog can be sent."""
+        for message in completed:
+            logger.info(f"Published to {message.topic} in {message.latency * 1000:.1f} ms")
+            PUBLISH_ACK_LATENCY.observe(message.latency)
+            if message.topic in content_hashes:
+                topic_suffix, content_hash = content_hashes[message.topic]
+                self._published_hashes[topic_suffix] = content_hash
+        for message in pending:
+            logger.warning(f"Failed to publish to {message.topic}: no acknowledgement in time")
+
+        if completed:
+            MESSAGES_PUBLISHED.inc(len(completed))
+            LAST_PUBLISH.set(time.time())
+            self.last_published = datetime.now().isoformat(timespec="seconds")
+        if pending:
+            PUBLISH_FAILURES.labels("no_ack").inc(len(pending))
+        if unsent:
+            PUBLISH_FAILURES.labels("not_sent").inc(len(unsent))
+            self._store_offline(unsent, timestamp)
+            return False
+        return self.outbox is not None and self.outbox.depth > 0
+
+    def _store_offline(self, topics, timestamp):
+        """Append the samples of a cycle that could not be published to the outbox."""
+        if self.outbox is None:
+            logger.warning("No outbox available, dropping sample")
+            SAMPLES_DROPPED.labels("no_outbox").inc()
+            return
+
+        messages = []
+        for topic_suffix, payload in topics.items():
+            # Static topics are re-sent after the reconnect anyway
+            if topic_suffix in STATIC_TOPICS:
+                continue
+            # Keep the sampling time, the message will be forwarded later
+            if "timestamp" not in payload:
+                payload = {"timestamp": timestamp, **payload}
+            topic = f"{self.broker_settings['topic_prefix']}/{topic_suffix}"
+            messages.append((topic, codec.encode(payload, self.payload_format), 1, False))
+
+        self.outbox.append_many(messages)
+        self.outbox.evict_expired()
+        logger.info(f"Stored {len(messages)} messages in the outbox ({self.outbox.depth} queued)")
+
+    def _drain_outbox(self):
+        """
+        Forward queued messages at the configured drain rate.
+
+        The drain never takes more than half of the publish interval, so it cannot delay the next
+        fresh sample.
+        """
+        self.outbox.evict_expired()
+        start = time.monotonic()
+        end = start + self.publish_interval / 2
+        forwarded = 0
+
+        while self.outbox.depth and self.client.is_connected():
+            now = time.monotonic()
+            if now >= end:
+                break
+
+            budget = self.outbox.take_drain_budget(self.pipeline.window * 4)
+            if budget == 0:
+                time.sleep(min(1.0 / max(self.outbox.drain_rate, 1.0), end - now))
+                continue
+
+            batch_deadline = min(end, now + self.pipeline.timeout)
+            tracked = {}
+            for queued in self.outbox.peek(budget):
+                sent = self.pipeline.submit(
+                    self.client,
+                    queued.topic,
+                    queued.payload,
+                    qos=queued.qos,
+                    retain=queued.retain,
+                    deadline=batch_deadline,
+                )
+                if sent is None:
+                    break
+                tracked[sent] = queued.id
+
+            completed, pending = self.pipeline.drain(batch_deadline)
+            acked = self._remove_forwarded(tracked, completed)
+            forwarded += acked
+
+            if pending or acked < budget:
+                # The broker is not keeping up, try again in the next cycle
+                break
+
+        self._record_drain(forwarded, start)
+
+    def _remove_forwarded(self, tracked, completed):
+        """Remove the acknowledged outbox messages, returning how many there were."""
+        acked_ids = [tracked[message] for message in completed if message in tracked]
+        self.outbox.remove(acked_ids)
+        MESSAGES_PUBLISHED.inc(len(acked_ids))
+        return len(acked_ids)
+
+    def _record_drain(self, forwarded, start):
+        """Record the throughput of an outbox drain."""
+        duration = time.monotonic() - start
+        self.outbox.record_drain(forwarded, duration)
+        if forwarded:
+            logger.info(
+                f"Forwarded {forwarded} queued messages in {duration:.1f}s "
+                f"({self.outbox.depth} still queued)"
             )
-            message_info.wait_for_publish()
-            if message_info.is_published():
-                logger.info(f"Published to {topic}")
-            else:
-                logger.warning(f"Failed to publish to {topic}")
 
 
 mqtt_service = MQTTService()
@@ -277,7 +800,5 @@ def init_mqtt_service(app):
     mqtt_service.init_app(app)
 
     # Only start if enabled in settings
-    with app.app_context():
-        mqtt_enabled = Settings.query.filter_by(key="mqtt_enabled").first()
-        if mqtt_enabled and mqtt_enabled.value.lower() == "true":
-            mqtt_service.start()
+    if settings_repository.get_bool("mqtt_enabled"):
+        mqtt_service.start()
@@ -0,0 +1,207 @@
+"""
+Outbox module for IoT device agent.
+This module provides a bounded, crash-safe store-and-forward queue for messages that could not be
+published because the broker was unreachable.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("outbox")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    qos INTEGER NOT NULL,
+    retain INTEGER NOT NULL
+)
+"""
+
+
+def _to_bytes(payload):
+    """Return the payload as bytes."""
+    return payload if isinstance(payload, bytes) else payload.encode("utf-8")
+
+
+class OutboxMessage:
+    """A message waiting in the outbox."""
+
+    __slots__ = ("id", "created_at", "topic", "payload", "qos", "retain")
+
+    def __init__(self, id, created_at, topic, payload, qos, retain):
+        self.id = id
+        self.created_at = created_at
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = bool(retain)
+
+
+class Outbox:
+    """SQLite backed FIFO queue with size and age based eviction."""
+
+    def __init__(self, path, max_messages=10000, max_age=7 * 24 * 3600, drain_rate=50.0):
+        """Initialize the outbox stored in the SQLite file at ``path``."""
+        self.path = path
+        # Oldest messages are evicted once the queue holds more than this many messages
+        self.max_messages = int(max_messages)
+        # Messages older than this many seconds are evicted
+        self.max_age = float(max_age)
+        # Maximum number of queued messages sent per second after a reconnect
+        self.drain_rate = float(drain_rate)
+
+        self.evicted_total = 0
+        self.drained_total = 0
+        self.last_drain_rate = None  # Messages per second achieved by the last drain
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL keeps appends cheap and the queue consistent if the process dies mid-write
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        self._tokens = 0.0
+        self._tokens_updated = time.monotonic()
+
+    def configure(self, max_messages=None, max_age=None, drain_rate=None):
+        """Update the queue limits."""
+        if max_messages is not None:
+            self.max_messages = int(max_messages)
+        if max_age is not None:
+            self.max_age = float(max_age)
+        if drain_rate is not None:
+            self.drain_rate = float(drain_rate)
+
+    @property
+    def depth(self):
+        """Return the number of queued messages."""
+        return self._depth
+
+    def append_many(self, messages):
+        """Append ``(topic, payload, qos, retain)`` tuples in a single transaction."""
+        now = time.time()
+        rows = [
+            (now, topic, _to_bytes(payload), qos, int(retain))
+            for topic, payload, qos, retain in messages
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO outbox (created_at, topic, payload, qos, retain) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._depth += len(rows)
+            self._evict_overflow()
+            self._conn.execute("COMMIT")
+
+    def append(self, topic, payload, qos=1, retain=False):
+        """Append a single message."""
+        self.append_many([(topic, payload, qos, retain)])
+
+    def peek(self, limit):
+        """Return up to ``limit`` of the oldest queued messages without removing them."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, topic, payload, qos, retain "
+                "FROM outbox ORDER BY id LIMIT ?",
+                (int(limit),),
+            ).fetchall()
+        return [OutboxMessage(*row) for row in rows]
+
+    def remove(self, ids):
+        """Remove delivered messages."""
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            removed = 0
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                removed += self._conn.execute(
+                    f"DELETE FROM outbox WHERE id IN ({placeholders})", chunk
+                ).rowcount
+            self._conn.execute("COMMIT")
+            self._depth -= removed
+            self.drained_total += removed
+
+    def evict_expired(self):
+        """Remove messages older than the maximum age."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM outbox WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+            self._depth -= removed
+        if removed:
+            self.evicted_total += removed
+            logger.warning(f"Evicted {removed} expired messages from the outbox")
+        return removed
+
+    def take_drain_budget(self, limit):
+        """
+        Return how many queued messages may be sent now, at most ``limit``.
+
+        The budget is a token bucket refilled at ``drain_rate`` messages per second. It holds at
+        most one second worth of tokens, so a long outage never turns into a burst.
+        """
+        now = time.monotonic()
+        capacity = max(1.0, self.drain_rate)
+        self._tokens = min(capacity, self._tokens + (now - self._tokens_updated) * self.drain_rate)
+        self._tokens_updated = now
+        budget = min(int(self._tokens), int(limit), self._depth)
+        self._tokens -= budget
+        return max(0, budget)
+
+    def record_drain(self, count, duration):
+        """Record the throughput of a drain pass."""
+        if count and duration > 0:
+            self.last_drain_rate = count / duration
+
+    def oldest_age(self):
+        """Return the age in seconds of the oldest queued message, or None when empty."""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(created_at) FROM outbox").fetchone()
+        return None if row[0] is None else time.time() - row[0]
+
+    def stats(self):
+        """Return a summary of the outbox state for display."""
+        oldest_age = self.oldest_age()
+        return {
+            "depth": self.depth,
+            "max_messages": self.max_messages,
+            "drain_rate": self.drain_rate,
+            "last_drain_rate": round(self.last_drain_rate, 1) if self.last_drain_rate else None,
+            "drained_total": self.drained_total,
+            "evicted_total": self.evicted_total,
+            "oldest_age": round(oldest_age) if oldest_age is not None else None,
+        }
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _evict_overflow(self):
+        """Drop the oldest messages above the size limit. Must be called with the lock held."""
+        overflow = self._depth - self.max_messages
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)",
+            (overflow,),
+        )
+        self._depth -= overflow
+        self.evicted_total += overflow
+        logger.warning(f"Outbox full, evicted the {overflow} oldest messages")
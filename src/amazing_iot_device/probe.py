@@ -0,0 +1,199 @@
+"""
+Probe module for IoT device agent.
+This module checks MQTT brokers for the connection test of the settings page without holding a
+web server thread. A check is started as a job whose ID the page polls. Checks run on a small
+thread pool, or on the event loop of the asyncio runtime when it runs. Identical checks started
+while one is running share it, and results are reused for a few seconds. The state of every job is
+also written to a small file, so that any worker process serving the app can answer the polls.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from amazing_iot_device.async_runtime import probe_broker
+from amazing_iot_device.cache import TTLCache
+
+logger = logging.getLogger("probe")
+
+# Seconds a job can be polled after it was started
+JOB_RETENTION = 300
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def probe_key(host, port, username="", password=""):
+    """Return the key of a broker check, with the credentials hashed."""
+    credentials = hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+    return (host.strip().lower(), int(port), credentials)
+
+
+class ProbeJob:
+    """A broker check, pending until it has a result."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.result = None
+        self.started = time.monotonic()
+
+    def to_dict(self, cached=False):
+        """Return the state of the job, with the result once done."""
+        if self.result is None:
+            return {"job": self.id, "status": "pending"}
+        return {"job": self.id, "status": "done", "cached": cached, **self.result}
+
+
+class JobStore:
+    """Directory of JSON files holding the state of the jobs of every process, one per job."""
+
+    def __init__(self, path):
+        """Initialize the store in the directory at ``path``, created when missing."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, state):
+        """Save the state of a job, so that readers never see a partial one."""
+        path = self._job_path(state["job"])
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, path)
+
+    def read(self, job_id):
+        """Return the state of a job, or None when it is unknown or expired."""
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        path = self._job_path(job_id)
+        try:
+            if time.time() - os.path.getmtime(path) > JOB_RETENTION:
+                return None
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def prune(self):
+        """Remove the jobs that expired."""
+        now = time.time()
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > JOB_RETENTION:
+                        os.remove(entry.path)
+                except OSError:
+                    pass  # Removed by another process meanwhile
+
+    def _job_path(self, job_id):
+        return os.path.join(self.path, f"{job_id}.json")
+
+
+class ProbeService:
+    """Runs broker checks concurrently, merging identical ones and caching their results."""
+
+    def __init__(self, workers=2, cache_ttl=10.0, max_pending=16, timeout=5.0):
+        """Initialize the service; its threads are started on the first check."""
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self.timeout = float(timeout)
+        self._results = TTLCache(maxsize=64, ttl=cache_ttl)  # Key -> finished job
+        self._jobs = TTLCache(maxsize=256, ttl=JOB_RETENTION)  # Job ID -> job
+        self._pending = {}  # Key -> running job
+        self._executor = None
+        self._lock = threading.Lock()
+        # Shares the jobs with the other processes serving the app, when set
+        self.store = None
+
+    def init_app(self, app):
+        """Configure the service from the app config, dropping cached results."""
+        self.workers = int(app.config.get("PROBE_WORKERS", self.workers))
+        self._results.configure(ttl=app.config.get("PROBE_CACHE_TTL", self._results.ttl))
+        self.store = JobStore(
+            app.config.get("PROBE_JOBS_PATH") or os.path.join(app.instance_path, "probe-jobs")
+        )
+
+    def submit(self, host, port, username="", password="", loop=None):
+        """
+        Start checking a broker and return the state of the job, which is already done when a
+        recent result is reused. Checks run on ``loop`` when given, else on the thread pool.
+        Returns None when too many checks are running.
+        """
+        key = probe_key(host, port, username, password)
+        with self._lock:
+            job = self._results.get(key)
+            if job is not None:
+                return job.to_dict(cached=True)
+            job = self._pending.get(key)
+            # A check outliving its timeout was lost, for example with a stopped event loop
+            if job is not None and time.monotonic() - job.started < self.timeout * 2:
+                return job.to_dict()
+            if job is None and len(self._pending) >= self.max_pending:
+                return None
+            job = ProbeJob(key)
+            self._pending[key] = job
+            self._jobs.set(job.id, job)
+            if loop is None and self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="mqtt-probe")
+        self._share(job)
+
+        coroutine = probe_broker(host, port, username, password, timeout=self.timeout)
+        try:
+            if loop is not None:
+                future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+            else:
+                # A short-lived event loop per check, on a pool thread
+                future = self._executor.submit(asyncio.run, coroutine)
+        except Exception as e:
+            coroutine.close()
+            self._finish(job, {"success": False, "message": f"Error testing connection: {e}"})
+        else:
+            future.add_done_callback(lambda done: self._finish(job, self._result_of(done)))
+        return job.to_dict()
+
+    def status(self, job_id):
+        """
+        Return the state of a job, which may have been started by another process, or None when
+        it is unknown or expired.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.read(job_id) if self.store is not None else None
+
+    def _result_of(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Error testing MQTT broker connection: {str(e)}")
+            return {"success": False, "message": f"Error connecting to MQTT broker: {str(e)}"}
+
+    def _finish(self, job, result):
+        with self._lock:
+            job.result = result
+            # A check that outlived its timeout may finish after a newer one replaced it
+            if self._pending.get(job.key) is job:
+                del self._pending[job.key]
+                self._results.set(job.key, job)
+        self._share(job)
+        logger.debug(f"Broker check {job.id} done in {time.monotonic() - job.started:.2f}s")
+
+    def _share(self, job):
+        """Save the state of a job for the other processes, dropping the expired ones."""
+        if self.store is None:
+            return
+        try:
+            if job.result is None:
+                self.store.prune()
+            self.store.write(job.to_dict())
+        except OSError as e:
+            logger.error(f"Error saving broker check {job.id}: {str(e)}")
+
+
+probe_service = ProbeService()
@@ -0,0 +1,199 @@
+"""
+Publish pipeline module for IoT device agent.
+This module keeps several QoS 1 messages in flight at once instead of waiting for the broker
+acknowledgement of each message before sending the next one.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as paho_mqtt
+
+logger = logging.getLogger("publish_pipeline")
+
+# Upper bound of acknowledgements that may arrive before their publish call has returned
+MAX_EARLY_ACKS = 1024
+# Seconds an early acknowledgement waits for its publish call. Acknowledgements of messages that
+# were never registered, for example after a reset, must not match a later message reusing the ID
+EARLY_ACK_MAX_AGE = 5.0
+
+
+class InFlightMessage:
+    """A published message waiting for its broker acknowledgement."""
+
+    __slots__ = ("mid", "topic", "sent_at", "info", "acked_at")
+
+    def __init__(self, mid, topic, sent_at, info):
+        self.mid = mid
+        self.topic = topic
+        self.sent_at = sent_at
+        self.info = info
+        self.acked_at = None
+
+    @property
+    def latency(self):
+        """Return the acknowledgement latency in seconds, or None while in flight."""
+        if self.acked_at is None:
+            return None
+        return self.acked_at - self.sent_at
+
+
+class PublishPipeline:
+    """Windowed QoS 1 publisher that tracks acknowledgements asynchronously."""
+
+    def __init__(self, window=4, timeout=10.0, latency_samples=256):
+        """Initialize the pipeline."""
+        # Maximum number of unacknowledged messages at any time
+        self.window = max(1, int(window))
+        # Seconds a publish cycle may wait for the window to drain
+        self.timeout = float(timeout)
+
+        self._cond = threading.Condition()
+        self._inflight = {}
+        self._reserved = 0
+        self._early_acks = {}  # Message ID -> time of the acknowledgement, oldest first
+        self._latencies = deque(maxlen=latency_samples)
+        self._completed = []
+
+    def configure(self, window=None, timeout=None):
+        """Update the window size and cycle timeout."""
+        with self._cond:
+            if window is not None:
+                self.window = max(1, int(window))
+            if timeout is not None:
+                self.timeout = float(timeout)
+            self._cond.notify_all()
+
+    @property
+    def inflight(self):
+        """Return the number of messages waiting for an acknowledgement."""
+        return len(self._inflight)
+
+    @property
+    def available(self):
+        """Return the number of free slots in the in-flight window."""
+        return max(0, self.window - len(self._inflight) - self._reserved)
+
+    def submit(self, client, topic, payload, qos=1, retain=False, deadline=None):
+        """
+        Publish a message once a slot in the in-flight window is available.
+
+        Returns the tracked message, or None when the message could not be sent because the
+        window did not free up before ``deadline`` or the client refused the publish.
+        """
+        deadline = deadline if deadline is not None else time.monotonic() + self.timeout
+        with self._cond:
+            while len(self._inflight) + self._reserved >= self.window:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Publish window full, dropping message for {topic}")
+                    return None
+                self._wait(remaining)
+            self._reserved += 1
+
+        # paho invokes on_publish while holding its own locks, so never publish under ours
+        sent_at = time.monotonic()
+        try:
+            info = client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        except Exception as e:
+            logger.error(f"Error publishing to {topic}: {str(e)}")
+            info = None
+
+        with self._cond:
+            self._reserved -= 1
+            if info is None or info.rc != paho_mqtt.MQTT_ERR_SUCCESS:
+                self._cond.notify_all()
+                return None
+
+            message = InFlightMessage(info.mid, topic, sent_at, info)
+            early_ack = self._early_acks.pop(info.mid, None)
+            if qos == 0 or (
+                early_ack is not None and time.monotonic() - early_ack <= EARLY_ACK_MAX_AGE
+            ):
+                self._complete(message)
+            else:
+                self._inflight[info.mid] = message
+            return message
+
+    def ack(self, mid):
+        """Record the broker acknowledgement of a message, called from on_publish."""
+        with self._cond:
+            message = self._inflight.pop(mid, None)
+            if message is None:
+                # The acknowledgement overtook the publish call that is about to register it
+                now = time.monotonic()
+                for early_mid, acked_at in list(self._early_acks.items()):
+                    if now - acked_at <= EARLY_ACK_MAX_AGE:
+                        break
+                    del self._early_acks[early_mid]
+                if len(self._early_acks) < MAX_EARLY_ACKS:
+                    self._early_acks.pop(mid, None)
+                    self._early_acks[mid] = now
+                return
+            self._complete(message)
+
+    def drain(self, deadline=None):
+        """
+        Wait until every in-flight message has been acknowledged or the deadline expires.
+
+        Returns the list of messages completed since the previous drain, and the list of messages
+        that are still unacknowledged.
+        """
+        deadline = deadline if deadline is not None else time.monotonic() + self.timeout
+        with self._cond:
+            while self._inflight or self._reserved:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._wait(remaining)
+            completed, self._completed = self._completed, []
+            pending = list(self._inflight.values())
+        return completed, pending
+
+    def reset(self):
+        """Forget every in-flight message, for example after the client has been replaced."""
+        with self._cond:
+            self._inflight.clear()
+            self._early_acks.clear()
+            self._completed = []
+            self._cond.notify_all()
+
+    def latency_stats(self):
+        """Return a summary of the recent acknowledgement latencies in milliseconds."""
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {"count": 0, "mean_ms": None, "p50_ms": None, "p95_ms": None, "max_ms": None}
+
+        def percentile(fraction):
+            index = min(len(latencies) - 1, int(round(fraction * (len(latencies) - 1))))
+            return round(latencies[index] * 1000, 2)
+
+        return {
+            "count": len(latencies),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+
+    def _complete(self, message):
+        """Mark a message as acknowledged. Must be called with the condition held."""
+        message.acked_at = time.monotonic()
+        self._latencies.append(message.latency)
+        self._completed.append(message)
+        logger.debug(
+            f"Message {message.mid} on {message.topic} acknowledged in "
+            f"{message.latency * 1000:.1f} ms"
+        )
+        self._cond.notify_all()
+
+    def _wait(self, remaining):
+        """Wait for an acknowledgement. Must be called with the condition held."""
+        self._cond.wait(min(remaining, 0.1))
+        # Fall back on the message info in case an acknowledgement callback was missed
+        for mid, message in list(self._inflight.items()):
+            if message.info.is_published():
+                del self._inflight[mid]
+                self._complete(message)
@@ -0,0 +1,72 @@
+"""
+Rate limit module for IoT device agent.
+This module limits how often an operation may run per key, such as a client address, with a token
+bucket per key. Buckets are kept in a bounded least-recently-used table, so the memory used stays
+constant however many keys are seen; an evicted bucket comes back full, which is the state every
+bucket reaches after being left alone for a while.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Token buckets holding up to ``burst`` tokens each, refilled at ``rate`` tokens a second."""
+
+    def __init__(self, rate, burst, maxsize=1024, clock=time.monotonic):
+        """Initialize a limiter without buckets; a ``rate`` of 0 disables it."""
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.maxsize = int(maxsize)
+        self.rejected = 0
+        self._clock = clock
+        self._buckets = OrderedDict()  # Key -> (tokens, time of the last update)
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, burst=None, maxsize=None):
+        """Change the rate, burst or size, refilling all buckets."""
+        with self._lock:
+            if rate is not None:
+                self.rate = float(rate)
+            if burst is not None:
+                self.burst = float(burst)
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+            self._buckets.clear()
+
+    def acquire(self, key, cost=1.0):
+        """Take ``cost`` tokens from the bucket of ``key``, returning whether there were enough."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = self._clock()
+            tokens = self._tokens(key, now)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                self.rejected += 1
+                return False
+            self._buckets[key] = (tokens - cost, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return True
+
+    def retry_after(self, key, cost=1.0):
+        """Return the seconds until ``cost`` tokens are available for ``key``."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            return max(0.0, (cost - self._tokens(key, self._clock())) / self.rate)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key, now):
+        """Return the tokens of a bucket at ``now``. Must be called with the lock held."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, updated = bucket
+        return min(self.burst, tokens + (now - updated) * self.rate)
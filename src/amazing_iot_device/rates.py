@@ -0,0 +1,73 @@
+"""
+Rates module for IoT device agent.
+This module turns successive snapshots of monotonically increasing system counters (bytes,
+operations, packets, context switches, CPU seconds) into per-second rates. It takes care of
+counters that wrap around at 32 bits and of counters that restart from zero, for example after a
+reboot or when a network interface is recreated.
+"""
+
+# Counter widths a wraparound is checked against, narrowest first
+COUNTER_WIDTHS = (32, 64)
+
+
+def counter_delta(previous, current):
+    """Return how much a counter increased, or None when it was reset."""
+    if current >= previous:
+        return current - previous
+    for bits in COUNTER_WIDTHS:
+        modulus = 1 << bits
+        if previous < modulus:
+            delta = current + modulus - previous
+            # A genuine wrap covers less than half of the counter range, anything larger means
+            # the counter restarted from zero and the increase since the last sample is unknown
+            return delta if delta < modulus // 2 else None
+    return None
+
+
+class RateTracker:
+    """Per-key baselines of counter values, used to compute rates between two samples."""
+
+    def __init__(self):
+        """Initialize a tracker without baselines."""
+        self._baselines = {}
+
+    def __len__(self):
+        return len(self._baselines)
+
+    def update(self, key, counters, now):
+        """Store ``counters`` as the new baseline of ``key`` and return the rates per second.
+
+        ``now`` is a monotonic time in seconds. None is returned for the first sample of a key.
+        Counters that were reset since the previous sample are left out of the result.
+        """
+        previous = self._baselines.get(key)
+        self._baselines[key] = (now, counters)
+        if previous is None:
+            return None
+
+        then, baseline = previous
+        elapsed = now - then
+        if elapsed <= 0:
+            return None
+
+        rates = {}
+        for name, value in counters.items():
+            if name not in baseline:
+                continue
+            delta = counter_delta(baseline[name], value)
+            if delta is not None:
+                rates[name] = delta / elapsed
+        return rates
+
+    def keys(self):
+        """Return the keys that have a baseline."""
+        return list(self._baselines)
+
+    def forget(self, keys):
+        """Drop the baselines of keys that no longer exist, such as removed disks."""
+        for key in keys:
+            self._baselines.pop(key, None)
+
+    def reset(self):
+        """Drop every baseline, for example after a reboot."""
+        self._baselines.clear()
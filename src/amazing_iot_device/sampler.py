@@ -0,0 +1,220 @@
+"""
+Resource sampler module for IoT device agent.
+This module keeps a fresh, timestamped snapshot of CPU, memory and disk usage in a background
+thread so that web requests and the MQTT publisher never block on psutil.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import psutil
+
+logger = logging.getLogger("sampler")
+
+# Shortest period in seconds a CPU usage measurement may cover; over shorter ones the usage is
+# mostly rounding of the CPU time counters and reads as 0 or 100%
+MIN_CPU_WINDOW = 0.1
+
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    """Immutable point-in-time view of the device resource usage."""
+
+    timestamp: float  # Wall-clock time of the sample (seconds since epoch)
+    monotonic: float  # Monotonic time of the sample, used for staleness checks
+    cpu_percent: float
+    memory_percent: float
+    memory_used: int  # Bytes
+    memory_total: int  # Bytes
+    disk_percent: float
+    disk_used: int  # Bytes
+    disk_total: int  # Bytes
+
+    def age(self):
+        """Return the age of the snapshot in seconds."""
+        return time.monotonic() - self.monotonic
+
+
+class ResourceSampler:
+    """Background sampler that keeps the latest resource snapshot in memory."""
+
+    def __init__(self, interval=None, max_age=None, disk_path="/"):
+        """Initialize the resource sampler."""
+        # Seconds between two samples taken by the background thread
+        self.interval = float(interval or os.environ.get("SAMPLER_INTERVAL", "2"))
+        # Maximum age in seconds a snapshot may have before readers refresh it themselves
+        self.max_age = float(max_age or os.environ.get("SAMPLER_MAX_AGE", "5"))
+        self.disk_path = disk_path
+        self.thread = None
+        self.is_running = False
+        # Shares the snapshots of the process that samples, see coordination.py
+        self.source = None
+
+        self._snapshot = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # The first non-blocking call only establishes the baseline for the next delta
+        psutil.cpu_percent(interval=None)
+        self._cpu_baseline = time.monotonic()  # Until the first sample
+
+    def init_app(self, app):
+        """Initialize the sampler with the Flask app configuration."""
+        self.interval = float(app.config.get("SAMPLER_INTERVAL", self.interval))
+        self.max_age = float(app.config.get("SAMPLER_MAX_AGE", self.max_age))
+
+    def sample(self):
+        """Take a new sample and store it as the current snapshot."""
+        if self._cpu_baseline is not None:
+            # Only the first sample may follow the baseline closely, when taken right at startup
+            remaining = MIN_CPU_WINDOW - (time.monotonic() - self._cpu_baseline)
+            if remaining > 0:
+                time.sleep(remaining)
+            self._cpu_baseline = None
+
+        # interval=None compares against the previous call instead of sleeping
+        cpu_percent = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+
+        snapshot = ResourceSnapshot(
+            timestamp=time.time(),
+            monotonic=time.monotonic(),
+            cpu_percent=cpu_percent,
+            memory_percent=memory.percent,
+            memory_used=memory.used,
+            memory_total=memory.total,
+            disk_percent=disk.percent,
+            disk_used=disk.used,
+            disk_total=disk.total,
+        )
+        self._publish(snapshot)
+        return snapshot
+
+    def _publish(self, snapshot):
+        """Store a snapshot as the current one and hand it to the listeners."""
+        self._snapshot = snapshot
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Error in resource snapshot listener: {str(e)}")
+
+    def add_listener(self, listener):
+        """Call ``listener(snapshot)`` with every new snapshot, from the sampling thread."""
+        # Replaced rather than modified, so sampling threads can iterate without a lock
+        if listener not in self._listeners:
+            self._listeners = [*self._listeners, listener]
+
+    def remove_listener(self, listener):
+        """Stop calling a listener added with ``add_listener``."""
+        self._listeners = [other for other in self._listeners if other != listener]
+
+    def get_snapshot(self, max_age=None):
+        """
+        Return the latest snapshot.
+
+        The snapshot is returned as-is when it is younger than ``max_age`` seconds (defaults to the
+        configured maximum staleness). Otherwise a new sample is taken inline, which is cheap since
+        the CPU measurement is non-blocking.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.age() <= max_age:
+            return snapshot
+
+        with self._lock:
+            # Another reader may have refreshed the snapshot while we were waiting
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.age() <= max_age:
+                return snapshot
+            if self.source is not None:
+                snapshot = self.source.read_snapshot()
+                if snapshot is not None and snapshot.age() <= max_age:
+                    self._publish(snapshot)
+                    return snapshot
+            # Sampled here when the process that shares its snapshots is gone
+            return self.sample()
+
+    def reset(self):
+        """Drop the current snapshot so that the next read takes a fresh sample."""
+        self._snapshot = None
+
+    def start(self):
+        """Start the sampler in a separate thread."""
+        if self.is_running:
+            logger.warning("Resource sampler is already running")
+            return
+
+        self.source = None
+        self._start_thread(self._run)
+        logger.info(f"Resource sampler started with a {self.interval}s interval")
+
+    def follow(self, source):
+        """
+        Take the snapshots another process shares through ``source`` instead of sampling, in a
+        thread that hands every new one to the listeners.
+        """
+        if self.is_running:
+            logger.warning("Resource sampler is already running")
+            return
+
+        self.source = source
+        self._start_thread(self._follow)
+        logger.info("Resource sampler follows the snapshots of another process")
+
+    def _start_thread(self, target):
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=target, name="resource-sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the sampling or following thread."""
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.source = None
+        logger.info("Resource sampler stopped")
+
+    def _run(self):
+        """Sample resource usage periodically until stopped."""
+        while self.is_running:
+            try:
+                with self._lock:
+                    self.sample()
+            except Exception as e:
+                logger.error(f"Error sampling resource usage: {str(e)}")
+            self._stop_event.wait(self.interval)
+
+    def _follow(self):
+        """Publish the new snapshots of the source until stopped."""
+        while self.is_running:
+            try:
+                snapshot = self.source.read_snapshot()
+                current = self._snapshot
+                if snapshot is not None and (
+                    current is None or snapshot.timestamp > current.timestamp
+                ):
+                    with self._lock:
+                        self._publish(snapshot)
+            except Exception as e:
+                logger.error(f"Error reading shared resource usage: {str(e)}")
+            # Polled twice per interval, so a shared snapshot is at most half an interval late
+            self._stop_event.wait(self.interval / 2)
+
+
+resource_sampler = ResourceSampler()
+
+
+def init_resource_sampler(app):
+    """Initialize and start the resource sampler."""
+    resource_sampler.init_app(app)
+    # Also with the asyncio runtime, whose event loop only takes sampling over while the MQTT
+    # service runs
+    resource_sampler.start()
@@ -0,0 +1,167 @@
+"""
+Scheduler module for IoT device agent.
+This module fires periodic jobs against monotonic deadlines kept in a heap. Deadlines advance by
+whole intervals from the previous deadline, so execution time never accumulates as drift. Jobs
+flagged as blocking run on a small worker pool so they cannot delay the other jobs.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("scheduler")
+
+
+class Job:
+    """A periodic job."""
+
+    __slots__ = ("name", "func", "interval", "blocking", "next_run", "generation", "future")
+
+    def __init__(self, name, func, interval, blocking, next_run):
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.blocking = blocking
+        self.next_run = next_run
+        # Heap entries of an older generation are stale and skipped
+        self.generation = 0
+        self.future = None
+
+
+class Scheduler:
+    """Heap based scheduler for periodic jobs."""
+
+    def __init__(self, max_workers=2):
+        """Initialize the scheduler with a worker pool of ``max_workers`` threads."""
+        self.max_workers = max_workers
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = None
+        # One-shot calls handed over from other threads, run before the due jobs
+        self._calls = collections.deque()
+
+    def add_job(self, name, func, interval, blocking=False, delay=0.0):
+        """Schedule ``func`` every ``interval`` seconds, first after ``delay`` seconds."""
+        if interval <= 0:
+            raise ValueError(f"Interval of job {name} must be positive")
+        with self._lock:
+            if name in self._jobs:
+                raise ValueError(f"Job {name} is already scheduled")
+            job = Job(name, func, interval, blocking, time.monotonic() + delay)
+            self._jobs[name] = job
+            self._push(job)
+        self.wake()
+        return job
+
+    def remove_job(self, name):
+        """Unschedule a job. Unknown names are ignored."""
+        with self._lock:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                job.generation += 1
+
+    def reschedule(self, name, interval, delay=None):
+        """Change the interval of a job; the next run moves to ``delay`` seconds from now."""
+        with self._lock:
+            job = self._jobs[name]
+            job.interval = float(interval)
+            job.generation += 1
+            if delay is not None:
+                job.next_run = time.monotonic() + delay
+            self._push(job)
+        self.wake()
+
+    def call_soon(self, func):
+        """Run ``func`` once on the scheduler thread, as soon as possible."""
+        self._calls.append(func)
+        self.wake()
+
+    def jobs(self):
+        """Return the names of the scheduled jobs."""
+        with self._lock:
+            return list(self._jobs)
+
+    def run_pending(self):
+        """Run every job that is due, returning the seconds until the next deadline."""
+        while self._calls:
+            func = self._calls.popleft()
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"Error in scheduled call: {str(e)}")
+
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return None
+                next_run, _, generation, job = self._heap[0]
+                now = time.monotonic()
+                if next_run > now:
+                    return next_run - now
+                heapq.heappop(self._heap)
+                if generation != job.generation or self._jobs.get(job.name) is not job:
+                    continue
+                self._advance(job, now)
+                self._push(job)
+
+            self._execute(job)
+
+    def run(self, stop_event):
+        """Run jobs until ``stop_event`` is set."""
+        while not stop_event.is_set():
+            timeout = self.run_pending()
+            # Sleep until the next deadline, a job change, or the stop request
+            self._wakeup.wait(timeout if timeout is not None else 1.0)
+            self._wakeup.clear()
+
+    def wake(self):
+        """Interrupt the current wait, for example after a stop request."""
+        self._wakeup.set()
+
+    def shutdown(self, wait=False):
+        """Stop the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def _push(self, job):
+        """Add a heap entry for the job. Must be called with the lock held."""
+        heapq.heappush(self._heap, (job.next_run, next(self._counter), job.generation, job))
+
+    def _advance(self, job, now):
+        """Move the deadline by whole intervals, skipping the runs that were missed."""
+        job.next_run += job.interval
+        if job.next_run <= now:
+            missed = int((now - job.next_run) // job.interval) + 1
+            job.next_run += missed * job.interval
+            logger.debug(f"Job {job.name} skipped {missed} runs")
+
+    def _execute(self, job):
+        """Run a job inline, or on the worker pool when it is blocking."""
+        if not job.blocking:
+            self._call(job)
+            return
+
+        if job.future is not None and not job.future.done():
+            # Never queue a second run of a slow job behind the first one
+            logger.warning(f"Job {job.name} is still running, skipping this run")
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="scheduler-worker"
+            )
+        job.future = self._executor.submit(self._call, job)
+
+    def _call(self, job):
+        """Call the job function, logging instead of propagating errors."""
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"Error in job {job.name}: {str(e)}")
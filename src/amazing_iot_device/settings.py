@@ -2,18 +2,26 @@
 Settings module for IoT device agent.
 """
 
-import time
-
-import paho.mqtt.client as paho_mqtt
-from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+from flask import Blueprint, abort, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import login_required
 from flask_wtf import FlaskForm
-from wtforms import BooleanField, IntegerField, PasswordField, StringField, SubmitField
+from wtforms import (
+    BooleanField,
+    FloatField,
+    IntegerField,
+    PasswordField,
+    SelectField,
+    StringField,
+    SubmitField,
+)
 from wtforms.validators import DataRequired, NumberRange, Optional, ValidationError
 
-from amazing_iot_device import db
-from amazing_iot_device.models import Settings
-from amazing_iot_device.mqtt_service import mqtt_service
+from amazing_iot_device.codec import RESOURCES_FIELDS
+from amazing_iot_device.coordination import agent_status
+from amazing_iot_device.deadband import Deadband
+from amazing_iot_device.mqtt_service import MQTT_SETTINGS_KEYS, mqtt_service
+from amazing_iot_device.probe import probe_service
+from amazing_iot_device.settings_repository import settings_repository
 
 settings_bp = Blueprint("settings", __name__, url_prefix="/settings")
 
@@ -44,6 +52,63 @@ class MQTTSettingsForm(FlaskForm):
             NumberRange(min=5, message="Interval must be at least 5 seconds"),
         ],
     )
+    mqtt_publish_mode = SelectField(
+        "Publish Mode",
+        choices=[
+            ("raw", "One message per sample"),
+            ("batch", "Batched samples"),
+            ("aggregate", "Aggregated windows (min/max/mean/p95)"),
+        ],
+        default="raw",
+    )
+    mqtt_sample_interval = FloatField(
+        "Sample Interval (seconds)",
+        validators=[
+            Optional(),
+            NumberRange(
+                min=0.1, max=60, message="Sample interval must be between 0.1 and 60 seconds"
+            ),
+        ],
+    )
+    mqtt_payload_format = SelectField(
+        "Payload Format",
+        choices=[
+            ("json", "JSON"),
+            ("binary", "Binary (struct/CBOR)"),
+            ("binary+zlib", "Binary, compressed"),
+        ],
+        default="json",
+    )
+    mqtt_delta_publish = BooleanField("Publish system/network topics only when they change")
+    mqtt_deadband_enabled = BooleanField("Publish resources only when they move past a deadband")
+    mqtt_deadband_heartbeat = IntegerField(
+        "Deadband Heartbeat (seconds)",
+        validators=[Optional(), NumberRange(min=10, max=86400)],
+    )
+    mqtt_inflight_window = IntegerField(
+        "In-flight Window (messages)",
+        validators=[Optional(), NumberRange(min=1, max=100)],
+    )
+    mqtt_publish_timeout = IntegerField(
+        "Publish Timeout (seconds)",
+        validators=[Optional(), NumberRange(min=1, max=300)],
+    )
+    mqtt_reconnect_max_delay = IntegerField(
+        "Reconnect Backoff Cap (seconds)",
+        validators=[Optional(), NumberRange(min=5, max=3600)],
+    )
+    mqtt_outbox_max_messages = IntegerField(
+        "Outbox Size (messages)",
+        validators=[Optional(), NumberRange(min=100, max=1000000)],
+    )
+    mqtt_outbox_max_age = IntegerField(
+        "Outbox Retention (hours)",
+        validators=[Optional(), NumberRange(min=1, max=720)],
+    )
+    mqtt_outbox_drain_rate = IntegerField(
+        "Outbox Drain Rate (messages/second)",
+        validators=[Optional(), NumberRange(min=1, max=1000)],
+    )
     submit = SubmitField("Save Settings")
 
     def validate_mqtt_broker_host(self, field):
@@ -61,32 +126,53 @@ class MQTTSettingsForm(FlaskForm):
             )
 
 
+def validate_deadband(form, field):
+    """Validate an "absolute,relative" deadband field."""
+    try:
+        Deadband.parse(field.data)
+    except ValueError as e:
+        raise ValidationError(
+            "Use an absolute threshold and an optional relative one, e.g. 2,0.05"
+        ) from e
+
+
+# Names of the per-metric deadband fields, one per published resource metric
+DEADBAND_FIELDS = [f"mqtt_deadband_{name}" for name in RESOURCES_FIELDS]
+for _name, _field in zip(RESOURCES_FIELDS, DEADBAND_FIELDS, strict=True):
+    setattr(
+        MQTTSettingsForm,
+        _field,
+        StringField(
+            _name.replace("_", " ").capitalize(), validators=[Optional(), validate_deadband]
+        ),
+    )
+
+
 @settings_bp.route("/")
 @login_required
 def index():
     """Display all available settings."""
-    settings = Settings.query.all()
-    return render_template("settings/index.html", settings=settings)
+    return render_template("settings/index.html", settings=settings_repository.snapshot())
 
 
 @settings_bp.route("/edit/<key>", methods=["GET", "POST"])
 @login_required
 def edit(key):
     """Edit a specific setting value."""
-    setting = Settings.query.filter_by(key=key).first_or_404()
+    if key not in settings_repository:
+        abort(404)
     form = SettingForm()
 
     if form.validate_on_submit():
-        setting.value = form.value.data
-        db.session.commit()
+        settings_repository.set(key, form.value.data)
         flash(f"Setting {key} updated successfully!")
         return redirect(url_for("settings.index"))
 
     # Pre-fill the form with the current setting value
     if request.method == "GET":
-        form.value.data = setting.value
+        form.value.data = settings_repository.get(key)
 
-    return render_template("settings/edit.html", form=form, setting=setting)
+    return render_template("settings/edit.html", form=form, key=key)
 
 
 @settings_bp.route("/mqtt", methods=["GET", "POST"])
@@ -95,24 +181,9 @@ def mqtt():
     """Manage MQTT settings."""
     form = MQTTSettingsForm()
 
-    # Query all MQTT settings
-    mqtt_settings = {
-        s.key: s.value
-        for s in Settings.query.filter(
-            Settings.key.in_(
-                [
-                    "mqtt_enabled",
-                    "mqtt_broker_host",
-                    "mqtt_broker_port",
-                    "mqtt_client_id",
-                    "mqtt_username",
-                    "mqtt_password",
-                    "mqtt_topic_prefix",
-                    "mqtt_publish_interval",
-                ]
-            )
-        ).all()
-    }
+    # MQTT settings from the in-memory snapshot
+    snapshot = settings_repository.snapshot()
+    mqtt_settings = {key: snapshot[key] for key in MQTT_SETTINGS_KEYS if key in snapshot}
 
     if form.validate_on_submit():
         # Update settings in database
@@ -125,25 +196,28 @@ def mqtt():
             "mqtt_password": form.mqtt_password.data,
             "mqtt_topic_prefix": form.mqtt_topic_prefix.data,
             "mqtt_publish_interval": str(form.mqtt_publish_interval.data),
+            "mqtt_delta_publish": "true" if form.mqtt_delta_publish.data else "false",
+            "mqtt_inflight_window": str(form.mqtt_inflight_window.data or 4),
+            "mqtt_publish_timeout": str(form.mqtt_publish_timeout.data or 10),
+            "mqtt_reconnect_max_delay": str(form.mqtt_reconnect_max_delay.data or 120),
+            "mqtt_outbox_max_messages": str(form.mqtt_outbox_max_messages.data or 10000),
+            "mqtt_outbox_max_age": str(form.mqtt_outbox_max_age.data or 168),
+            "mqtt_outbox_drain_rate": str(form.mqtt_outbox_drain_rate.data or 50),
+            "mqtt_publish_mode": form.mqtt_publish_mode.data,
+            "mqtt_sample_interval": str(form.mqtt_sample_interval.data or 1.0),
+            "mqtt_payload_format": form.mqtt_payload_format.data,
+            "mqtt_deadband_enabled": "true" if form.mqtt_deadband_enabled.data else "false",
+            "mqtt_deadband_heartbeat": str(form.mqtt_deadband_heartbeat.data or 300),
         }
+        for field in DEADBAND_FIELDS:
+            settings_to_update[field] = (form[field].data or "").strip()
 
-        for key, value in settings_to_update.items():
-            setting = Settings.query.filter_by(key=key).first()
-            if setting:
-                setting.value = value
-            else:
-                setting = Settings(key=key, value=value)
-                db.session.add(setting)
+        # Saved in a single upsert. The MQTT service of the process that publishes is subscribed
+        # to the changes, applies them in place and starts or stops accordingly
+        settings_repository.update(settings_to_update)
 
-        db.session.commit()
-
-        # Restart MQTT service with new settings
-        mqtt_service.stop()
         if form.mqtt_enabled.data:
-            mqtt_service._load_settings()
-            mqtt_service._setup_mqtt_client()
-            mqtt_service.start()
-            flash("MQTT settings updated and service restarted!", "success")
+            flash("MQTT settings updated and applied!", "success")
         else:
             flash("MQTT settings updated and service stopped!", "warning")
 
@@ -159,86 +233,74 @@ def mqtt():
         form.mqtt_password.data = mqtt_settings.get("mqtt_password", "")
         form.mqtt_topic_prefix.data = mqtt_settings.get("mqtt_topic_prefix", "iot/device")
         form.mqtt_publish_interval.data = int(mqtt_settings.get("mqtt_publish_interval", "60"))
-
-    # Get MQTT status (connected or not)
-    mqtt_status = (
-        mqtt_service.client and mqtt_service.client.is_connected()
-        if mqtt_service.is_running
-        else False
-    )
+        form.mqtt_delta_publish.data = (
+            mqtt_settings.get("mqtt_delta_publish", "false").lower() == "true"
+        )
+        form.mqtt_inflight_window.data = int(mqtt_settings.get("mqtt_inflight_window", "4"))
+        form.mqtt_publish_timeout.data = int(mqtt_settings.get("mqtt_publish_timeout", "10"))
+        form.mqtt_reconnect_max_delay.data = int(
+            mqtt_settings.get("mqtt_reconnect_max_delay", "120")
+        )
+        form.mqtt_outbox_max_messages.data = int(
+            mqtt_settings.get("mqtt_outbox_max_messages", "10000")
+        )
+        form.mqtt_outbox_max_age.data = int(mqtt_settings.get("mqtt_outbox_max_age", "168"))
+        form.mqtt_outbox_drain_rate.data = int(mqtt_settings.get("mqtt_outbox_drain_rate", "50"))
+        form.mqtt_publish_mode.data = mqtt_settings.get("mqtt_publish_mode", "raw")
+        form.mqtt_sample_interval.data = float(mqtt_settings.get("mqtt_sample_interval", "1.0"))
+        form.mqtt_payload_format.data = mqtt_settings.get("mqtt_payload_format", "json")
+        form.mqtt_deadband_enabled.data = (
+            mqtt_settings.get("mqtt_deadband_enabled", "false").lower() == "true"
+        )
+        form.mqtt_deadband_heartbeat.data = int(mqtt_settings.get("mqtt_deadband_heartbeat", "300"))
+        for field in DEADBAND_FIELDS:
+            form[field].data = mqtt_settings.get(field, "")
+
+    # The MQTT service runs in the elected process, which may be another worker
+    status = agent_status()
 
     return render_template(
         "settings/mqtt.html",
         form=form,
+        deadband_fields=DEADBAND_FIELDS,
         mqtt_settings=mqtt_settings,
-        mqtt_status=mqtt_status,
-        last_published=None,
-    )  # You could track last published time
+        status=status,
+    )
 
 
 @settings_bp.route("/test-mqtt-connection", methods=["POST"])
 @login_required
 def test_mqtt_connection():
-    """Test connection to MQTT broker with current settings."""
-    # Get current MQTT settings
-    broker_host = request.form.get("host")
-    broker_port = int(request.form.get("port"))
+    """Start testing the connection to an MQTT broker, returning a job to poll."""
+    broker_host = request.form.get("host", "").strip()
+    try:
+        broker_port = int(request.form.get("port", ""))
+    except ValueError:
+        broker_port = 0
+    if not broker_host or not 0 < broker_port < 65536:
+        return jsonify({"success": False, "message": "Enter a broker host and port"}), 400
     username = request.form.get("username", "")
     password = request.form.get("password", "")
 
-    # Create a temporary client for testing
-    client_id = f"amazingiot-test-{int(time.time())}"
-    test_client = paho_mqtt.Client(client_id=client_id, clean_session=True)
-
-    # Set up authentication if credentials are provided
-    if username and password:
-        test_client.username_pw_set(username, password)
+    # Probe on the agent event loop when it runs, instead of a pool thread
+    runtime = mqtt_service.async_runtime
+    loop = runtime.loop if runtime is not None else None
+    job = probe_service.submit(broker_host, broker_port, username, password, loop=loop)
+    if job is None:
+        message = "Too many connection tests are running, try again shortly"
+        return jsonify({"success": False, "message": message}), 503
+    return jsonify(job), 202 if job["status"] == "pending" else 200
 
-    # Set up a flag to track connection success
-    connected = [False]
-    connection_error = [None]
 
-    def on_connect(client, userdata, flags, rc):
-        if rc == 0:
-            connected[0] = True
-        else:
-            connection_error[0] = f"Failed to connect with code {rc}"
-
-    test_client.on_connect = on_connect
-
-    try:
-        # Try to connect with a short timeout
-        test_client.connect_async(broker_host, broker_port)
-        test_client.loop_start()
-
-        # Wait for connection or timeout
-        timeout = time.time() + 5  # 5 seconds timeout
-        while not connected[0] and time.time() < timeout:
-            time.sleep(0.1)
-
-        # Check connection result
-        if connected[0]:
-            result = {
-                "success": True,
-                "message": f"Successfully connected to MQTT broker at {broker_host}:{broker_port}",
-            }
-        else:
-            result = {
-                "success": False,
-                "message": connection_error[0]
-                or f"Timed out connecting to {broker_host}:{broker_port}",
-            }
-
-    except Exception as e:
-        result = {"success": False, "message": f"Error connecting to MQTT broker: {str(e)}"}
-
-    finally:
-        # Clean up
-        test_client.loop_stop()
-        if test_client.is_connected():
-            test_client.disconnect()
-
-    return jsonify(result)
+@settings_bp.route("/test-mqtt-connection/<job_id>")
+@login_required
+def mqtt_connection_test_status(job_id):
+    """Return the state of a connection test started by ``test_mqtt_connection``."""
+    job = probe_service.status(job_id)
+    if job is None:
+        # Expired, or started by another worker process
+        return jsonify({"status": "unknown"}), 404
+    return jsonify(job)
 
 
 def init_default_settings(app):
@@ -252,8 +314,4 @@ def init_default_settings(app):
     }
 
     with app.app_context():
-        for key, value in default_settings.items():
-            if not Settings.query.filter_by(key=key).first():
-                setting = Settings(key=key, value=value)
-                db.session.add(setting)
-        db.session.commit()
+        settings_repository.set_defaults(default_settings)
@@ -0,0 +1,233 @@
+"""
+Settings repository module for IoT device agent.
+This module keeps the settings stored in the database in an in-memory snapshot, so that reading a
+setting is a dictionary lookup. Writes go through the repository: they are saved in a single
+upsert, replace the snapshot, bump its version and notify the subscribers of the changed keys.
+When several processes serve the app, a version counter they share tells each of them to reload
+the snapshot after another one wrote.
+"""
+
+import contextlib
+import logging
+import threading
+from types import MappingProxyType
+
+from flask import has_app_context
+from sqlalchemy.dialects.sqlite import insert
+
+from amazing_iot_device import db
+from amazing_iot_device.models import Settings
+
+logger = logging.getLogger("settings_repository")
+
+TRUE_VALUES = ("true", "1", "yes", "on")
+
+
+class SettingsRepository:
+    """Write-through cache of the Settings table with typed accessors and change callbacks."""
+
+    def __init__(self):
+        """Initialize an empty repository, loaded from the database on first read."""
+        self.app = None
+        self._values = None
+        self._version = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._shared = None  # Settings version counter shared with other processes
+        self._seen = None  # Value of the shared counter the snapshot was loaded at
+
+    def init_app(self, app):
+        """Bind the repository to the database of the app, dropping any loaded snapshot."""
+        self.app = app
+        self._values = None
+
+    @property
+    def version(self):
+        """Return a number incremented by every write."""
+        return self._version
+
+    def snapshot(self):
+        """Return a read-only view of all settings, which later writes do not modify."""
+        return MappingProxyType(self._load())
+
+    def get(self, key, default=None):
+        """Return the string value of a setting."""
+        return self._load().get(key, default)
+
+    def get_bool(self, key, default=False):
+        """Return a setting stored as "true" or "false" as a boolean."""
+        value = self._load().get(key)
+        return default if not value else value.lower() in TRUE_VALUES
+
+    def get_int(self, key, default=None):
+        """Return a setting as an integer, or ``default`` when unset or invalid."""
+        return self._convert(key, int, default)
+
+    def get_float(self, key, default=None):
+        """Return a setting as a float, or ``default`` when unset or invalid."""
+        return self._convert(key, float, default)
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def share(self, counter):
+        """
+        Follow the writes of other processes through ``counter``, an object with a
+        ``settings_version`` property and a ``bump_settings_version`` method, or stop with None.
+        """
+        with self._lock:
+            self._shared = counter
+            self._seen = None if counter is None else counter.settings_version
+
+    def refresh(self):
+        """Reload the snapshot if another process wrote, notifying the subscribers."""
+        if self.app is not None:
+            self._load()
+
+    def update(self, values):
+        """
+        Save settings given as a mapping of keys to string values, in a single upsert.
+
+        Only values that differ from the stored ones are written. Returns the changed settings.
+        """
+        # Brings in the writes of other processes first, so only this save is reported below
+        self._load()
+        with self._lock:
+            current = self._current()
+            changes = {
+                key: str(value) for key, value in values.items() if current.get(key) != str(value)
+            }
+            if not changes:
+                return {}
+            self._upsert(changes)
+            # Replaced rather than modified, so readers never see a half-applied write
+            self._values = {**current, **changes}
+            self._version += 1
+            version = self._version
+            self._announce()
+        self._notify(changes, version)
+        return changes
+
+    def set(self, key, value):
+        """Save a single setting."""
+        return self.update({key: value})
+
+    def set_defaults(self, values):
+        """Save the settings that do not exist yet, leaving the others untouched."""
+        self._load()
+        with self._lock:
+            current = self._current()
+            missing = {key: str(value) for key, value in values.items() if key not in current}
+            if not missing:
+                return {}
+            self._upsert(missing, overwrite=False)
+            self._values = {**current, **missing}
+            self._version += 1
+            version = self._version
+            self._announce()
+        self._notify(missing, version)
+        return missing
+
+    def reload(self):
+        """Read the snapshot again, for example after the table was changed by other means."""
+        self._reload()
+
+    def subscribe(self, callback):
+        """Call ``callback(changes, version)`` after every write, from the writing thread."""
+        if callback not in self._subscribers:
+            self._subscribers = [*self._subscribers, callback]
+
+    def unsubscribe(self, callback):
+        """Stop calling a callback added with ``subscribe``."""
+        self._subscribers = [other for other in self._subscribers if other != callback]
+
+    def _load(self):
+        """Return the settings, reading them from the database if not loaded or outdated."""
+        values = self._values
+        shared = self._shared
+        if values is not None and (shared is None or shared.settings_version == self._seen):
+            return values
+        return self._reload()
+
+    def _reload(self):
+        """Read the settings from the database, notifying the subscribers of any change."""
+        with self._lock:
+            shared = self._shared
+            # Read first, so a write landing during the query triggers another reload
+            seen = None if shared is None else shared.settings_version
+            values = self._read()
+            previous = self._values
+            self._values = values
+            self._seen = seen
+            changes = {}
+            if previous is not None:
+                changes = {
+                    key: value for key, value in values.items() if previous.get(key) != value
+                }
+            if changes:
+                self._version += 1
+            version = self._version
+        if changes:
+            self._notify(changes, version)
+        return values
+
+    def _current(self):
+        """Return the loaded settings, or read them. Must be called with the lock held."""
+        return self._values if self._values is not None else self._read()
+
+    def _read(self):
+        with self._app_context():
+            return {s.key: s.value for s in Settings.query.order_by(Settings.id).all()}
+
+    def _announce(self):
+        """Tell the other processes about a write. Must be called with the lock held."""
+        if self._shared is None:
+            return
+        seen = self._shared.bump_settings_version()
+        # When another process wrote since the last load, its changes are read on the next access
+        self._seen = seen if self._seen is not None and seen == self._seen + 1 else None
+
+    def _convert(self, key, type_, default):
+        value = self._load().get(key)
+        if not value:
+            return default
+        try:
+            return type_(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid value of setting {key}: {value}")
+            return default
+
+    def _upsert(self, values, overwrite=True):
+        """Insert or replace settings in one statement and commit."""
+        statement = insert(Settings).values(
+            [{"key": key, "value": value} for key, value in values.items()]
+        )
+        if overwrite:
+            statement = statement.on_conflict_do_update(
+                index_elements=[Settings.key], set_={"value": statement.excluded.value}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=[Settings.key])
+        with self._app_context():
+            try:
+                db.session.execute(statement)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _notify(self, changes, version):
+        for callback in self._subscribers:
+            try:
+                callback(changes, version)
+            except Exception as e:
+                logger.error(f"Error in settings subscriber: {str(e)}")
+
+    def _app_context(self):
+        """Return an app context for database access outside of a request."""
+        if has_app_context() or self.app is None:
+            return contextlib.nullcontext()
+        return self.app.app_context()
+
+
+settings_repository = SettingsRepository()
@@ -0,0 +1,110 @@
+"""
+Storage module for IoT device agent.
+This module tunes the SQLite database of the agent. Every new connection gets the pragmas of the
+configured storage profile, and the connection pool is sized for the threads of the web server and
+the agent services, so that connections are reused instead of opened per request.
+"""
+
+import logging
+
+from sqlalchemy import event
+
+logger = logging.getLogger("storage")
+
+# Pragmas of every storage profile, applied in order to every new connection
+PROFILES = {
+    # SQLite's own defaults: a rollback journal, synced twice per commit, and readers that wait
+    # for the writer. Set explicitly, since the WAL mode of another profile stays in the file
+    "legacy": {
+        "busy_timeout": 5000,
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+    },
+    # Write-ahead log: readers never wait for the writer, and a commit appends to the log, which
+    # is only synced at checkpoints. A power loss may lose the last commits, but never corrupts
+    # the database
+    "balanced": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8192,  # KiB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    # As balanced, but every commit is synced before it returns
+    "durable": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8192,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+# Pragmas a profile or the SQLITE_PRAGMAS setting may set
+PRAGMAS = (
+    "busy_timeout",
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "wal_autocheckpoint",
+)
+
+
+def storage_pragmas(app):
+    """Return the pragmas of the configured profile, with the configured overrides."""
+    profile = app.config.get("SQLITE_PROFILE", "balanced")
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown SQLite profile {profile}, expected one of {', '.join(PROFILES)}")
+    pragmas = {**PROFILES[profile], **app.config.get("SQLITE_PRAGMAS", {})}
+    unknown = [name for name in pragmas if name not in PRAGMAS]
+    if unknown:
+        raise ValueError(f"Unsupported SQLite pragmas: {', '.join(unknown)}")
+    return pragmas
+
+
+def _is_file_database(uri):
+    return uri.startswith("sqlite") and ":memory:" not in uri and "mode=memory" not in uri
+
+
+def configure_storage(app):
+    """Size the connection pool of a SQLite file database; call before ``db.init_app``."""
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not _is_file_database(uri):
+        return
+    pool_size = int(app.config.get("SQLITE_POOL_SIZE", 10))
+    options = {
+        # A connection per thread that uses the database at the same time, and as many again
+        # for bursts, which are closed when returned
+        "pool_size": pool_size,
+        "max_overflow": pool_size,
+        "pool_timeout": 10,
+    }
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **options,
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    }
+
+
+def init_storage(app, engine):
+    """Apply the storage profile to every new connection of ``engine``."""
+    if not _is_file_database(str(engine.url)):
+        return
+    pragmas = storage_pragmas(app)
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                result = cursor.execute(f"PRAGMA {name}={value}").fetchone()
+                if name == "journal_mode" and result and result[0].lower() != value.lower():
+                    # For example on file systems without shared memory support
+                    logger.warning(f"SQLite journal mode is {result[0]}, not {value}")
+        finally:
+            cursor.close()
+
+    logger.info(f"SQLite storage profile: {app.config.get('SQLITE_PROFILE', 'balanced')}")
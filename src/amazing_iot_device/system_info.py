@@ -0,0 +1,80 @@
+"""
+System information module for IoT device agent.
+Static facts about the device are computed once per process, and the host/IP lookup is cached
+for a configurable time-to-live so that it does not hit DNS on every publish cycle.
+"""
+
+import functools
+import logging
+import os
+import platform
+import socket
+import threading
+import time
+
+logger = logging.getLogger("system_info")
+
+
+@functools.cache
+def _static_system_info():
+    """Compute the static system facts once."""
+    return {
+        "os_name": platform.system(),
+        "os_version": platform.version(),
+        "os_release": platform.release(),
+        "device_version": os.environ.get("DEVICE_VERSION", "0.1.0"),
+        "python_version": platform.python_version(),
+        "hostname": platform.node(),
+        "processor": platform.processor(),
+        "architecture": platform.machine(),
+    }
+
+
+def get_system_info():
+    """Return a copy of the static system information."""
+    return dict(_static_system_info())
+
+
+class NetworkInfoCache:
+    """Cache for the host name and IP address lookup."""
+
+    def __init__(self, ttl=None):
+        """Initialize the cache with a time-to-live in seconds."""
+        self.ttl = float(ttl or os.environ.get("NETWORK_INFO_TTL", "300"))
+        self._info = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the cached network information, refreshing it when expired."""
+        info = self._info
+        if info is not None and time.monotonic() < self._expires_at:
+            return dict(info)
+
+        with self._lock:
+            if self._info is None or time.monotonic() >= self._expires_at:
+                self._info = self._lookup()
+                # Retry failed lookups sooner than successful ones
+                ttl = min(self.ttl, 30.0) if "error" in self._info else self.ttl
+                self._expires_at = time.monotonic() + ttl
+            return dict(self._info)
+
+    def invalidate(self):
+        """Force the next read to perform a new lookup."""
+        self._expires_at = 0.0
+
+    def _lookup(self):
+        """Resolve the host name and IP address."""
+        try:
+            hostname = socket.gethostname()
+            ip_address = socket.gethostbyname(hostname)
+            return {
+                "hostname": hostname,
+                "ip_address": ip_address,
+            }
+        except Exception as e:
+            logger.error(f"Error getting network information: {str(e)}")
+            return {"error": str(e)}
+
+
+network_info = NetworkInfoCache()
@@ -12,6 +12,7 @@ import os
 import time
 from datetime import datetime
 
+import codec
 import paho.mqtt.client as paho_mqtt
 from dotenv import load_dotenv
 
@@ -27,6 +28,15 @@ logger = logging.getLogger("mqtt-receiver")
 # Storage path for received messages
 DATA_DIR = None
 
+# Schema marker of the columnar multi-sample messages published in batch mode
+BATCH_SCHEMA = "batch/1"
+
+# Metadata key of resource samples filtered by a deadband on the device
+DEADBAND_KEY = "deadband"
+
+# Last known metric values of every device publishing deadband filtered samples
+deadband_state = {}
+
 
 # Callback when the client receives a CONNACK response from the server
 def on_connect(client, userdata, flags, rc):
@@ -46,13 +56,18 @@ def on_message(client, userdata, msg):
     """Callback when a message is received from the server."""
     logger = logging.getLogger("mqtt-receiver")
     topic = msg.topic
-    payload = msg.payload.decode("utf-8")
+
+    # Binary payloads carry a header marker, anything else is JSON text
+    if codec.is_binary(msg.payload):
+        payload = f"<{len(msg.payload)} bytes binary payload>"
+    else:
+        payload = msg.payload.decode("utf-8")
 
     logger.info(f"Received message on topic {topic}: {payload}")
 
     try:
-        # Parse the JSON payload
-        data = json.loads(payload)
+        # Parse the JSON or binary payload
+        data = codec.decode(msg.payload)
 
         # Extract device ID from the topic if available, otherwise from the data
         topic_parts = topic.split("/")
@@ -66,10 +81,72 @@ def on_message(client, userdata, msg):
 
     except json.JSONDecodeError:
         logger.error(f"Failed to decode JSON payload: {payload}")
+    except codec.CodecError as e:
+        logger.error(f"Failed to decode binary payload: {str(e)}")
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
 
 
+def expand_batch(data):
+    """Yield ``(timestamp, record)`` pairs for every sample of a batch message."""
+    start = data["start"]
+    columns = data["columns"]
+    for index, offset in enumerate(data["offsets"]):
+        timestamp = datetime.fromtimestamp(start + offset / 1000).isoformat()
+        record = {"device_id": data["device_id"], "timestamp": timestamp}
+        record.update({name: values[index] for name, values in columns.items()})
+        yield timestamp, record
+
+
+def reconstruct_deadband(device_id, data):
+    """Merge a deadband filtered sample into the last known values of the device.
+
+    Metrics missing from the sample did not move past their deadband and keep their previous
+    value, which yields a step-wise series. The returned record holds every known metric; its
+    ``complete`` flag is False while a lost message may have left a metric out of date, until
+    the next full sample.
+
+    Samples older than the last one merged, such as those forwarded from the outbox of the device
+    after a reconnect, are returned with their own metrics only and do not change the state.
+    """
+    meta = data[DEADBAND_KEY]
+    changed = {key: value for key, value in data.items() if key != DEADBAND_KEY}
+    state = deadband_state.get(device_id)
+
+    # A restarted agent counts from 1 again, starting with a full sample
+    restarted = meta.get("full") and meta["seq"] == 1
+    if state is not None and meta["seq"] <= state["seq"] and not restarted:
+        record = dict(changed)
+        record[DEADBAND_KEY] = {
+            **meta,
+            "changed": sorted(key for key in changed if key != "timestamp"),
+            "complete": bool(meta.get("full")),
+            "late": True,
+        }
+        return record
+
+    if meta.get("full"):
+        state = {"seq": meta["seq"], "values": {}, "complete": True}
+    elif state is None:
+        # First message seen from this device, the metrics it did not send are unknown
+        state = {"seq": meta["seq"], "values": {}, "complete": False}
+    elif meta["seq"] != state["seq"] + 1:
+        logger.warning(f"Deadband sequence gap for {device_id}: {state['seq']} -> {meta['seq']}")
+        state["complete"] = False
+
+    state["seq"] = meta["seq"]
+    state["values"].update(changed)
+    deadband_state[device_id] = state
+
+    record = dict(state["values"])
+    record[DEADBAND_KEY] = {
+        **meta,
+        "changed": sorted(key for key in changed if key != "timestamp"),
+        "complete": state["complete"],
+    }
+    return record
+
+
 def store_data(device_id, topic, timestamp, data):
     """Store received data to disk."""
     global DATA_DIR
@@ -81,11 +158,20 @@ def store_data(device_id, topic, timestamp, data):
     device_dir = os.path.join(DATA_DIR, device_id)
     os.makedirs(device_dir, exist_ok=True)
 
+    # Batches are stored as individual resource samples, as if they had been sent one by one
+    if isinstance(data, dict) and data.get("schema") == BATCH_SCHEMA:
+        store_batch(device_dir, data)
+        return
+
     # Format timestamp for filename
     date_str = timestamp.split("T")[0] if "T" in timestamp else timestamp.split(" ")[0]
 
     # Determine file path based on the topic
     topic_suffix = topic.split("/")[-1]
+
+    # Deadband filtered samples are stored with every metric, as if nothing had been filtered
+    if isinstance(data, dict) and DEADBAND_KEY in data:
+        data = reconstruct_deadband(device_id, data)
     file_path = os.path.join(device_dir, f"{date_str}_{topic_suffix}.jsonl")
 
     # Append the data as a new line in the file
@@ -95,6 +181,21 @@ def store_data(device_id, topic, timestamp, data):
     logger.debug(f"Stored data to {file_path}")
 
 
+def store_batch(device_dir, data):
+    """Expand a batch message into one line per sample in the daily resources files."""
+    lines_by_file = {}
+    for timestamp, record in expand_batch(data):
+        date_str = timestamp.split("T")[0]
+        file_path = os.path.join(device_dir, f"{date_str}_resources.jsonl")
+        lines_by_file.setdefault(file_path, []).append(json.dumps(record) + "\n")
+
+    for file_path, lines in lines_by_file.items():
+        with open(file_path, "a") as f:
+            f.writelines(lines)
+
+    logger.debug(f"Stored batch of {data.get('count', 0)} samples in {device_dir}")
+
+
 def main():
     """Main function to run the MQTT client."""
     logger = logging.getLogger("mqtt-receiver")
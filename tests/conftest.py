@@ -3,6 +3,7 @@ Configuration for test environment.
 """
 
 import os
+import shutil
 import sys
 import tempfile
 
@@ -12,7 +13,9 @@ import pytest
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
 
 from amazing_iot_device import create_app, db
+from amazing_iot_device.broker import Broker
 from amazing_iot_device.models import Settings, User
+from amazing_iot_device.sampler import resource_sampler
 
 
 @pytest.fixture
@@ -20,12 +23,14 @@ def app():
     """Create and configure a Flask app for testing."""
     # Create a temporary file to isolate the database for each test
     db_fd, db_path = tempfile.mkstemp()
+    jobs_path = tempfile.mkdtemp()
 
     app = create_app(
         {
             "TESTING": True,
             "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
             "WTF_CSRF_ENABLED": False,  # Disable CSRF for testing
+            "PROBE_JOBS_PATH": jobs_path,
         }
     )
 
@@ -55,9 +60,31 @@ def app():
 
     yield app
 
-    # Close and remove the temporary database
+    # Close and remove the temporary database, with its write-ahead log
+    with app.app_context():
+        db.engine.dispose()
     os.close(db_fd)
-    os.unlink(db_path)
+    for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        if os.path.exists(path):
+            os.unlink(path)
+    shutil.rmtree(jobs_path, ignore_errors=True)
+
+
+@pytest.fixture
+def mqtt_broker():
+    """An embedded MQTT broker listening on a free port of the loopback interface."""
+    broker = Broker()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+@pytest.fixture(autouse=True)
+def fresh_resource_snapshot():
+    """Make sure every test starts without a cached resource snapshot."""
+    resource_sampler.reset()
+    yield
+    resource_sampler.reset()
 
 
 @pytest.fixture
@@ -0,0 +1,71 @@
+"""
+Tests for the windowed aggregation
+"""
+
+import random
+
+import pytest
+
+from amazing_iot_device.aggregation import AGGREGATE_SCHEMA, P2Quantile, WindowAggregator
+
+
+def test_p2_quantile_small_samples_are_exact():
+    """Test that fewer than six samples give the interpolated exact quantile."""
+    estimator = P2Quantile(0.5)
+    assert estimator.value() is None
+
+    for value in (3, 1, 2):
+        estimator.add(value)
+    assert estimator.value() == 2
+
+
+@pytest.mark.parametrize("quantile", [0.5, 0.95, 0.99])
+def test_p2_quantile_tracks_the_true_quantile(quantile):
+    """Test that the streaming estimate stays close to the exact quantile."""
+    rng = random.Random(42)
+    values = [rng.gauss(50, 10) for _ in range(10000)]
+
+    estimator = P2Quantile(quantile)
+    for value in values:
+        estimator.add(value)
+
+    exact = sorted(values)[int(quantile * len(values))]
+    assert estimator.value() == pytest.approx(exact, abs=1.0)
+
+
+def test_p2_quantile_rejects_invalid_quantiles():
+    """Test that the quantile must lie strictly between 0 and 1."""
+    with pytest.raises(ValueError):
+        P2Quantile(1.0)
+
+
+def test_window_aggregator_rollup():
+    """Test that a window is summarized per metric and reset after a flush."""
+    aggregator = WindowAggregator()
+    for index, cpu in enumerate([10.0, 90.0, 20.0, 30.0]):
+        aggregator.add({"cpu_percent": cpu, "memory_percent": 50.0}, timestamp=100.0 + index)
+
+    rollup = aggregator.flush("device-1")
+
+    assert rollup["schema"] == AGGREGATE_SCHEMA
+    assert rollup["device_id"] == "device-1"
+    assert (rollup["start"], rollup["end"], rollup["count"]) == (100.0, 103.0, 4)
+    cpu = rollup["metrics"]["cpu_percent"]
+    # The spike is kept even though the last value is low
+    assert (cpu["min"], cpu["max"], cpu["mean"], cpu["last"]) == (10.0, 90.0, 37.5, 30.0)
+    assert 30.0 < cpu["p95"] <= 90.0
+    assert rollup["metrics"]["memory_percent"]["max"] == 50.0
+
+    assert len(aggregator) == 0
+    assert aggregator.flush("device-1") is None
+
+
+def test_window_aggregator_memory_is_constant():
+    """Test that the aggregator does not keep the samples themselves."""
+    aggregator = WindowAggregator()
+    for index in range(1000):
+        aggregator.add({"cpu_percent": float(index)}, timestamp=float(index))
+
+    summary = aggregator._summaries["cpu_percent"]
+    assert len(summary.quantile._heights) == 5
+    assert summary.count == 1000
@@ -0,0 +1,244 @@
+"""
+Tests for the asyncio agent runtime
+"""
+
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from amazing_iot_device.async_runtime import (
+    AsyncConnection,
+    AsyncScheduler,
+    probe_broker,
+    run_in_thread,
+)
+from amazing_iot_device.broker import Broker
+from amazing_iot_device.connection import CONNECTED, ExponentialBackoff
+from amazing_iot_device.mqtt_service import MQTTService
+from amazing_iot_device.outbox import Outbox
+from amazing_iot_device.sampler import resource_sampler
+
+
+def test_async_scheduler_runs_every_kind_of_job():
+    """Test that plain, coroutine and blocking jobs all run on the event loop scheduler."""
+    scheduler = AsyncScheduler()
+    stop_event = threading.Event()
+    calls = []
+
+    async def coroutine_job():
+        await asyncio.sleep(0)
+        calls.append("coroutine")
+
+    def blocking_job():
+        calls.append(threading.current_thread().name)
+
+    scheduler.add_job("plain", lambda: calls.append("plain"), 10)
+    scheduler.add_job("coroutine", coroutine_job, 10)
+    scheduler.add_job("blocking", blocking_job, 10, blocking=True)
+    scheduler.add_job("stop", stop_event.set, 10, delay=0.2)
+
+    asyncio.run(scheduler.run_async(stop_event))
+
+    assert sorted(calls) == ["async-runtime-call", "coroutine", "plain"]
+
+
+def test_async_scheduler_skips_a_job_still_running():
+    """Test that a coroutine job is not started again while its previous run is going."""
+    scheduler = AsyncScheduler()
+    stop_event = threading.Event()
+    started = []
+
+    async def slow_job():
+        started.append(time.monotonic())
+        await asyncio.sleep(0.35)
+
+    scheduler.add_job("slow", slow_job, 0.1)
+    scheduler.add_job("stop", stop_event.set, 10, delay=0.5)
+
+    asyncio.run(scheduler.run_async(stop_event))
+
+    assert len(started) == 2
+
+
+def test_async_scheduler_wakes_up_from_another_thread():
+    """Test that calls and stop requests from another thread wake the loop up."""
+    scheduler = AsyncScheduler()
+    stop_event = threading.Event()
+    scheduler.add_job("idle", lambda: None, 60)
+    calls = []
+
+    def stop_from_thread():
+        time.sleep(0.1)
+        scheduler.call_soon(lambda: calls.append("call"))
+        time.sleep(0.1)
+        stop_event.set()
+        scheduler.wake()
+
+    threading.Thread(target=stop_from_thread).start()
+    start = time.monotonic()
+    asyncio.run(scheduler.run_async(stop_event))
+
+    assert calls == ["call"]
+    assert time.monotonic() - start < 5
+
+
+def test_run_in_thread_returns_result_and_exception():
+    """Test that blocking calls report their result and errors through the loop."""
+
+    def fail():
+        raise ValueError("boom")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        assert await run_in_thread(loop, sum, [1, 2, 3]) == 6
+        with pytest.raises(ValueError):
+            await run_in_thread(loop, fail)
+
+    asyncio.run(main())
+
+
+def test_probe_broker(mqtt_broker):
+    """Test probing an accepting, a refusing and a silent broker."""
+    accepted = mqtt_broker.port
+    refusing_broker, silent_broker = Broker(return_code=5), Broker(silent=True)
+    refused, silent = refusing_broker.start(), silent_broker.start()
+
+    async def main():
+        return await asyncio.gather(
+            probe_broker("127.0.0.1", accepted),
+            probe_broker("127.0.0.1", refused),
+            probe_broker("127.0.0.1", silent, timeout=0.2),
+        )
+
+    try:
+        accepted_result, refused_result, silent_result = asyncio.run(main())
+    finally:
+        refusing_broker.stop()
+        silent_broker.stop()
+
+    assert accepted_result["success"] is True
+    assert refused_result == {"success": False, "message": "Failed to connect with code 5"}
+    assert silent_result["success"] is False
+    assert "Timed out" in silent_result["message"]
+
+
+def test_async_connection_resets_the_backoff_once_the_connection_lasted():
+    """Test that connections dropped at once keep backing off, and a lasting one resets it."""
+    client = MagicMock()
+
+    async def main():
+        connection = AsyncConnection(
+            asyncio.get_running_loop(),
+            client,
+            "broker",
+            1883,
+            backoff=ExponentialBackoff(base=0.001, cap=10),
+            stable_after=0.2,
+        )
+
+        client.reconnect.side_effect = lambda: connection.connected(0)
+        connection.start()
+        # Accepted, then dropped at once three times
+        for _ in range(3):
+            while connection.state != CONNECTED:
+                await asyncio.sleep(0.001)
+            connection.disconnected(7)
+            await asyncio.sleep(0.01)
+        dropped = connection.backoff.attempts
+        while connection.state != CONNECTED:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.3)
+        lasted = connection.backoff.attempts
+        connection.stop()
+        return dropped, lasted
+
+    assert asyncio.run(main()) == (3, 0)
+
+
+def test_mqtt_service_rejects_unknown_runtime():
+    """Test that only the known runtimes can be selected."""
+    mqtt_service = MQTTService()
+
+    with pytest.raises(ValueError):
+        mqtt_service.set_runtime("greenlets")
+
+    mqtt_service.set_runtime("asyncio")
+    assert mqtt_service.async_runtime is not None
+    mqtt_service.set_runtime("threads")
+    assert mqtt_service.async_runtime is None
+
+
+def test_asyncio_runtime_publishes_without_network_threads(mqtt_broker, tmp_path):
+    """Test that the asyncio runtime connects, publishes and probes on its event loop."""
+    broker, port = mqtt_broker, mqtt_broker.port
+
+    mqtt_service = MQTTService()
+    mqtt_service.set_runtime("asyncio")
+    mqtt_service.outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    mqtt_service.broker_settings.update({"host": "127.0.0.1", "port": port})
+    mqtt_service.publish_interval = 1
+    mqtt_service._setup_mqtt_client()
+    resource_sampler.start()
+    mqtt_service.start()
+    try:
+        deadline = time.monotonic() + 10
+        while "iot/device/full" not in broker.published and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert "iot/device/full" in broker.published
+        assert mqtt_service.client.is_connected()
+        # The paho network thread and the connection thread are not used
+        names = [thread.name for thread in threading.enumerate()]
+        assert not any(name.startswith("paho-mqtt-client") for name in names)
+        assert "mqtt-connection" not in names
+        # The event loop took sampling over from the sampler thread
+        assert not resource_sampler.is_running
+
+        result = mqtt_service.async_runtime.probe("127.0.0.1", port)
+        assert result["success"] is True
+        assert broker.connects == 2
+        # The samples taken before the connection was up were forwarded from the outbox
+        assert mqtt_service.outbox.depth == 0
+    finally:
+        mqtt_service.stop()
+        mqtt_service.outbox.close()
+
+    # Sampling goes on without the MQTT service
+    sampling = resource_sampler.is_running
+    resource_sampler.stop()
+    assert sampling
+    assert not mqtt_service.thread.is_alive()
+
+
+def test_asyncio_runtime_publishes_after_a_restart(mqtt_broker, tmp_path):
+    """Test that a stopped asyncio runtime publishes again once restarted, on a new loop."""
+    broker, port = mqtt_broker, mqtt_broker.port
+
+    mqtt_service = MQTTService()
+    mqtt_service.set_runtime("asyncio")
+    mqtt_service.outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    mqtt_service.broker_settings.update({"host": "127.0.0.1", "port": port})
+    mqtt_service.publish_interval = 1
+    mqtt_service._setup_mqtt_client()
+    try:
+        for _ in range(2):
+            broker.published.clear()
+            mqtt_service.start()
+
+            def published():
+                # Acknowledged, including the samples queued while connecting
+                return "iot/device/full" in broker.published and not mqtt_service.outbox.depth
+
+            deadline = time.monotonic() + 10
+            while not published() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert published()
+            # As the settings subscriber does on a restart
+            mqtt_service.stop(wait=False)
+    finally:
+        mqtt_service.stop()
+        mqtt_service.outbox.close()
+        resource_sampler.stop()
@@ -2,6 +2,14 @@
 Tests for authentication functionality
 """
 
+from sqlalchemy import event
+
+from amazing_iot_device import auth as auth_module
+from amazing_iot_device import db
+from amazing_iot_device.coordination import SharedState
+from amazing_iot_device.metrics import LOGIN_ATTEMPTS, LOGIN_LIMITER_KEYS
+from amazing_iot_device.models import User
+
 
 def test_login_page(client):
     """Test that the login page loads correctly."""
@@ -41,3 +49,113 @@ def test_login_required(client):
     response = client.get("/dashboard/")
     # Should redirect to login page
     assert response.headers["Location"].startswith("/auth/login")
+
+
+def test_logged_in_user_is_cached(app, client, auth):
+    """Test that authenticated requests load the user from the database once."""
+    auth.login()
+    queries = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda *args: queries.append(args[2]) if "FROM user" in args[2] else None,
+    )
+
+    for _ in range(3):
+        assert client.get("/dashboard/").status_code == 200
+    assert len(queries) == 1
+
+
+def test_user_changes_invalidate_the_cache(app, client, auth):
+    """Test that a changed or deleted user is loaded again on the next request."""
+    auth.login()
+    assert b"Welcome, test_user" in client.get("/dashboard/").data
+
+    with app.app_context():
+        user = User.query.filter_by(username="test_user").first()
+        user.username = "renamed_user"
+        db.session.commit()
+    assert b"Welcome, renamed_user" in client.get("/dashboard/").data
+
+    with app.app_context():
+        db.session.delete(User.query.filter_by(username="renamed_user").first())
+        db.session.commit()
+    assert client.get("/dashboard/").headers["Location"].startswith("/auth/login")
+
+
+def test_user_changes_of_other_processes_invalidate_the_cache(app, client, auth, tmp_path):
+    """Test that a user change committed by another process drops the cached users."""
+    state_path = str(tmp_path / "agent.state")
+    shared, other_process = SharedState(state_path), SharedState(state_path)
+    auth_module.user_cache.share(shared)
+    try:
+        auth.login()
+        assert b"Welcome, test_user" in client.get("/dashboard/").data
+
+        # Written by this process: the change is counted for the others
+        with app.app_context():
+            User.query.filter_by(username="test_user").first().username = "renamed_user"
+            db.session.commit()
+        assert other_process.users_version == 1
+        assert b"Welcome, renamed_user" in client.get("/dashboard/").data
+        assert len(auth_module.user_cache) == 1
+
+        # Written by another process, which only bumps the shared version
+        with app.app_context():
+            db.session.execute(db.update(User).values(username="test_user"))
+            db.session.commit()
+        assert b"Welcome, renamed_user" in client.get("/dashboard/").data
+        other_process.bump_users_version()
+        assert b"Welcome, test_user" in client.get("/dashboard/").data
+    finally:
+        auth_module.user_cache.share(None)
+        shared.close()
+        other_process.close()
+
+
+def test_login_flood_is_throttled_before_hashing(client, monkeypatch):
+    """Test that attempts over the limit are rejected without hashing the password."""
+    hashes = []
+
+    def counting_check(password_hash, password):
+        hashes.append(password)
+        return False
+
+    monkeypatch.setattr(auth_module, "check_password_hash", counting_check)
+    throttled = LOGIN_ATTEMPTS.labels("throttled").value
+
+    responses = [
+        client.post("/auth/login", data={"username": "test_user", "password": f"guess{i}"})
+        for i in range(8)
+    ]
+
+    # The username allows 5 attempts a minute
+    assert [response.status_code for response in responses] == [200] * 5 + [429] * 3
+    assert len(hashes) == 5
+    assert int(responses[-1].headers["Retry-After"]) > 0
+    assert b"Too many login attempts" in responses[-1].data
+    assert LOGIN_ATTEMPTS.labels("throttled").value == throttled + 3
+    assert LOGIN_LIMITER_KEYS.labels("username").value == 1
+
+
+def test_login_is_throttled_per_address(client):
+    """Test that one address cannot try more than its limit across usernames."""
+    statuses = [
+        client.post(
+            "/auth/login",
+            data={"username": f"user{i}", "password": "wrong"},
+            environ_base={"REMOTE_ADDR": "192.0.2.1"},
+        ).status_code
+        for i in range(11)
+    ]
+    assert statuses == [200] * 10 + [429]
+
+    # Other addresses are not affected
+    response = client.post(
+        "/auth/login",
+        data={"username": "test_user", "password": "test_password"},
+        environ_base={"REMOTE_ADDR": "192.0.2.2"},
+    )
+    assert response.status_code == 302
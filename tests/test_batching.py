@@ -0,0 +1,47 @@
+"""
+Tests for batched multi-sample messages
+"""
+
+from amazing_iot_device.batching import BATCH_SCHEMA, SampleBatch
+
+
+def test_batch_columnar_layout():
+    """Test that samples are packed column by column with shared fields once."""
+    batch = SampleBatch()
+    batch.add({"cpu_percent": 10.0, "memory_percent": 50.0}, timestamp=1000.0)
+    batch.add({"cpu_percent": 12.5, "memory_percent": 51.0}, timestamp=1001.5)
+
+    payload = batch.flush("test-device")
+
+    assert payload == {
+        "schema": BATCH_SCHEMA,
+        "device_id": "test-device",
+        "count": 2,
+        "start": 1000.0,
+        "offsets": [0, 1500],
+        "columns": {"cpu_percent": [10.0, 12.5], "memory_percent": [50.0, 51.0]},
+    }
+    assert len(batch) == 0
+    assert batch.flush("test-device") is None
+
+
+def test_batch_pads_missing_metrics():
+    """Test that metrics missing from some samples keep the columns aligned."""
+    batch = SampleBatch()
+    batch.add({"cpu_percent": 10.0}, timestamp=1000.0)
+    batch.add({"cpu_percent": 11.0, "temperature": 40.0}, timestamp=1001.0)
+    batch.add({"temperature": 41.0}, timestamp=1002.0)
+
+    columns = batch.flush("test-device")["columns"]
+
+    assert columns["cpu_percent"] == [10.0, 11.0, None]
+    assert columns["temperature"] == [None, 40.0, 41.0]
+
+
+def test_batch_is_bounded():
+    """Test that the batch reports when it reached its maximum size."""
+    batch = SampleBatch(max_samples=2)
+    batch.add({"cpu_percent": 1.0})
+    assert not batch.is_full
+    batch.add({"cpu_percent": 2.0})
+    assert batch.is_full
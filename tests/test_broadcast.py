@@ -0,0 +1,80 @@
+"""
+Tests for the broadcaster of live updates
+"""
+
+import threading
+
+from amazing_iot_device.broadcast import Broadcaster
+
+
+def test_streams_share_the_latest_message():
+    """Test that every stream gets the same frame and a late stream starts at the latest one."""
+    broadcaster = Broadcaster(event="metrics")
+    first, second = broadcaster.stream(), broadcaster.stream()
+    assert next(first).startswith("retry:")
+    assert next(second).startswith("retry:")
+
+    broadcaster.publish('{"cpu_percent": 1}')
+    frame = next(first)
+    assert frame == 'id: 1\nevent: metrics\ndata: {"cpu_percent": 1}\n\n'
+    assert next(second) is frame
+
+    # A stream that fell behind skips to the latest message
+    broadcaster.publish('{"cpu_percent": 2}')
+    broadcaster.publish('{"cpu_percent": 3}')
+    assert next(first).startswith("id: 3\n")
+    late = broadcaster.stream()
+    next(late)
+    assert next(late).startswith("id: 3\n")
+    assert broadcaster.latest() == '{"cpu_percent": 3}'
+
+    for stream in (first, second, late):
+        stream.close()
+    assert broadcaster.streams == 0
+
+
+def test_stream_wakes_up_on_publish():
+    """Test that a waiting stream returns as soon as a message is published."""
+    broadcaster = Broadcaster(keepalive=30)
+    stream = broadcaster.stream()
+    next(stream)
+
+    threading.Timer(0.05, broadcaster.publish, ("update",)).start()
+    assert next(stream).endswith("data: update\n\n")
+    stream.close()
+
+
+def test_idle_stream_sends_keepalives():
+    """Test that an idle stream calls the idle callback and keeps the connection open."""
+    broadcaster = Broadcaster(keepalive=0.01)
+    idle_calls = []
+    stream = broadcaster.stream(on_idle=lambda: idle_calls.append(1))
+    next(stream)
+
+    assert next(stream) == ": keepalive\n\n"
+    assert idle_calls == [1]
+
+    # An idle callback that publishes is answered with the message right away
+    refreshing = broadcaster.stream(on_idle=lambda: broadcaster.publish("fresh"))
+    next(refreshing)
+    assert next(refreshing).endswith("data: fresh\n\n")
+    stream.close()
+    refreshing.close()
+
+
+def test_stream_limit():
+    """Test that streams beyond the limit are refused until one is closed."""
+    broadcaster = Broadcaster(max_streams=2)
+    first, second = broadcaster.stream(), broadcaster.stream()
+
+    assert broadcaster.stream() is None
+    # Closing a stream that was never iterated gives its slot back too
+    first.close()
+    first.close()
+    third = broadcaster.stream()
+    assert third is not None
+    assert broadcaster.streams == 2
+
+    second.close()
+    third.close()
+    assert broadcaster.streams == 0
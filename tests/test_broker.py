@@ -0,0 +1,143 @@
+"""
+Tests for the embedded MQTT broker
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import paho.mqtt.client as paho_mqtt
+import pytest
+
+from amazing_iot_device.broker import Broker
+from amazing_iot_device.mqtt_protocol import AsyncMQTTClient, ConnectionRefused, topic_matches
+from amazing_iot_device.mqtt_service import MQTTService
+from amazing_iot_device.outbox import Outbox
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "src", "cloud-service", "mqtt-receiver")
+)
+
+import receiver  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "topic_filter, topic, expected",
+    [
+        ("iot/device/full", "iot/device/full", True),
+        ("iot/device/full", "iot/device/system", False),
+        ("iot/+/full", "iot/abc/full", True),
+        ("iot/+/full", "iot/abc/def/full", False),
+        ("iot/#", "iot/abc/def/full", True),
+        ("iot/#", "iot", True),
+        ("#", "iot/abc", True),
+        ("+/+", "iot/abc", True),
+        ("+", "iot/abc", False),
+        ("#", "$SYS/uptime", False),
+    ],
+)
+def test_topic_matches(topic_filter, topic, expected):
+    """Test the single and multi level wildcards of topic filters."""
+    assert topic_matches(topic_filter, topic) is expected
+
+
+def test_broker_checks_credentials():
+    """Test that only clients with valid credentials may connect when credentials are set."""
+    broker = Broker(credentials={"device": "secret"})
+    port = broker.start()
+
+    async def connect(username, password):
+        client = AsyncMQTTClient("device-1", username, password, keepalive=0)
+        try:
+            await client.connect("127.0.0.1", port)
+        except ConnectionRefused as e:
+            return e.return_code
+        await client.disconnect()
+        return 0
+
+    async def main():
+        return [
+            await connect("device", "secret"),
+            await connect("device", "wrong"),
+            await connect("", ""),
+        ]
+
+    try:
+        assert asyncio.run(main()) == [0, 4, 5]
+    finally:
+        broker.stop()
+
+
+def test_broker_keeps_retained_messages(mqtt_broker):
+    """Test that new subscribers get the retained message, until it is cleared."""
+    received = []
+
+    async def main():
+        publisher = AsyncMQTTClient("publisher", keepalive=0)
+        await publisher.connect("127.0.0.1", mqtt_broker.port)
+        await publisher.publish("iot/abc/system", b"retained", retain=True)
+        await publisher.publish("iot/def/system", b"retained", retain=True)
+        await publisher.publish("iot/def/system", b"", retain=True)
+
+        subscriber = AsyncMQTTClient(
+            "subscriber", keepalive=0, on_message=lambda topic, payload: received.append(topic)
+        )
+        await subscriber.connect("127.0.0.1", mqtt_broker.port)
+        await subscriber.subscribe("iot/#")
+        # A round trip through the broker delivers what was queued before it
+        await publisher.publish("iot/abc/full", b"live")
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await publisher.disconnect()
+        await subscriber.disconnect()
+
+    asyncio.run(main())
+    assert received == ["iot/abc/system", "iot/abc/full"]
+    assert list(mqtt_broker.retained) == ["iot/abc/system"]
+
+
+def test_agent_publishes_through_broker_to_receiver(mqtt_broker, tmp_path, monkeypatch):
+    """Test the network path from the MQTT service through the broker to the receiver."""
+    monkeypatch.setattr(receiver, "DATA_DIR", str(tmp_path / "data"))
+    subscribed = threading.Event()
+
+    receiver_client = paho_mqtt.Client(
+        client_id="receiver",
+        userdata={"host": "127.0.0.1", "port": mqtt_broker.port, "topic": "iot/device/#"},
+    )
+    receiver_client.on_connect = receiver.on_connect
+    receiver_client.on_message = receiver.on_message
+    receiver_client.on_subscribe = lambda *args: subscribed.set()
+    receiver_client.connect("127.0.0.1", mqtt_broker.port)
+    receiver_client.loop_start()
+
+    mqtt_service = MQTTService()
+    mqtt_service.outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    mqtt_service.broker_settings.update({"host": "127.0.0.1", "port": mqtt_broker.port})
+    mqtt_service.publish_interval = 1
+    try:
+        assert subscribed.wait(timeout=5)
+        mqtt_service._setup_mqtt_client()
+        mqtt_service.start()
+
+        # The static topics are only sent by a cycle that finds the connection up
+        data_dir = tmp_path / "data"
+        expected = {"full.jsonl", "system.jsonl", "resources.jsonl"}
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            stored = {path.name.split("_", 1)[1] for path in data_dir.glob("*/*.jsonl")}
+            if expected <= stored:
+                break
+            time.sleep(0.05)
+
+        assert expected <= stored
+        assert list(data_dir.glob(f"{mqtt_service.client_id}/*_full.jsonl"))
+    finally:
+        mqtt_service.stop()
+        mqtt_service.outbox.close()
+        receiver_client.loop_stop()
+        receiver_client.disconnect()
@@ -0,0 +1,54 @@
+"""
+Tests for the TTL cache
+"""
+
+from amazing_iot_device.cache import TTLCache
+
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl():
+    """Test that an entry is served until its time to live has passed."""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=4, ttl=10, clock=clock)
+    cache.set("key", "value")
+
+    clock.now = 9.9
+    assert cache.get("key") == "value"
+    clock.now = 10.0
+    assert cache.get("key") is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Test that a full cache drops the entry read least recently."""
+    cache = TTLCache(maxsize=2, ttl=10, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_zero_ttl_disables_the_cache():
+    """Test that nothing is stored with a time to live of 0."""
+    cache = TTLCache(ttl=0)
+    cache.set("key", "value")
+    assert cache.get("key", "default") == "default"
+
+    cache.configure(ttl=5)
+    cache.set("key", "value")
+    cache.pop("key")
+    assert cache.get("key") is None
@@ -0,0 +1,122 @@
+"""
+Tests for the binary payload codec
+"""
+
+import json
+import os
+
+import pytest
+
+from amazing_iot_device import codec
+
+RESOURCES = {
+    "cpu_percent": 12.3,
+    "memory_percent": 55.1,
+    "memory_used_mb": 4123.5,
+    "memory_total_mb": 7936.2,
+    "disk_percent": 45.2,
+    "disk_used_gb": 100.23,
+    "disk_total_gb": 250.0,
+}
+
+FULL = {
+    "timestamp": "2024-01-01T12:00:00.123456",
+    "device_id": "amazingiot-1234abcd",
+    "system": {"os_name": "Linux", "os_release": "6.1", "architecture": "aarch64"},
+    "network": {"hostname": "device", "ip_address": "10.0.0.2"},
+    "resources": RESOURCES,
+    "flags": [True, False, None],
+    "counters": [0, 23, 255, 65536, -1, -1000, 2**40],
+}
+
+
+@pytest.mark.parametrize("fmt", codec.FORMATS)
+def test_codec_round_trip(fmt):
+    """Test that every wire format decodes to the original payload."""
+    assert codec.decode(codec.encode(FULL, fmt)) == FULL
+
+
+def test_codec_resources_schema_is_struct_packed():
+    """Test that the resources record uses the fixed struct layout."""
+    encoded = codec.encode(RESOURCES)
+
+    assert encoded[2] == codec.SCHEMA_RESOURCES
+    assert len(encoded) == codec.HEADER.size + codec.RESOURCES_RECORD.size
+    assert codec.decode(encoded) == RESOURCES
+
+
+def test_codec_binary_is_smaller_than_json():
+    """Test that the binary formats save bytes compared to JSON."""
+    json_size = len(codec.encode(FULL, "json"))
+    binary_size = len(codec.encode(FULL, "binary"))
+    compressed_size = len(codec.encode(FULL, "binary+zlib"))
+
+    assert binary_size < json_size
+    assert compressed_size < binary_size
+    assert codec.encode(FULL, "binary+zlib")[3] & codec.FLAG_ZLIB
+
+
+def test_codec_keeps_timestamp_precision():
+    """Test that large floats such as epoch timestamps are not truncated to single precision."""
+    payload = {"start": 1704110400.123, "value": 0.5}
+
+    assert codec.decode(codec.encode(payload)) == payload
+
+
+def test_codec_detects_json():
+    """Test that JSON payloads are recognised by the absence of the header marker."""
+    data = json.dumps(RESOURCES).encode("utf-8")
+
+    assert not codec.is_binary(data)
+    assert codec.is_binary(codec.encode(RESOURCES))
+    assert codec.decode(data) == RESOURCES
+
+
+def test_codec_rejects_malformed_payloads():
+    """Test that corrupted binary payloads raise a CodecError."""
+    encoded = codec.encode(FULL)
+
+    with pytest.raises(codec.CodecError):
+        codec.decode(encoded[:-3])
+    with pytest.raises(codec.CodecError):
+        codec.decode(bytes([codec.MAGIC, 99, 0, 0]) + encoded[4:])
+    with pytest.raises(codec.CodecError):
+        codec.encode(FULL, "xml")
+
+
+def test_codec_rejects_truncated_cbor():
+    """Test that CBOR bodies cut anywhere raise a CodecError, not a struct or index error."""
+    header = bytes([codec.MAGIC, codec.FORMAT_VERSION, codec.SCHEMA_CBOR, 0])
+    bodies = [
+        b"\x18",  # Integer with a one byte argument
+        b"\x19\x01",  # Two byte argument
+        b"\x1a\x00\x01",  # Four byte argument
+        b"\x1b\x00\x00\x00\x00",  # Eight byte argument
+        b"\x78",  # String with a one byte length
+        b"\xfa\x41",  # Single precision float
+        b"\xfb\x40\x09",  # Double precision float
+        b"\x82\x01",  # Array missing an item
+        b"\xa1\x81\x01\x01",  # Map with an array as key
+        b"\x62\xff\xfe",  # String that is not UTF-8
+    ]
+    for body in bodies:
+        with pytest.raises(codec.CodecError):
+            codec.decode(header + body)
+    for length in range(len(codec.encode(FULL, "binary")) - 1):
+        with pytest.raises(codec.CodecError):
+            codec.decode(codec.encode(FULL, "binary")[: max(length, codec.HEADER.size)])
+
+    with pytest.raises(codec.CodecError):
+        codec.encode({"counter": 2**64})
+    assert codec.decode(codec.encode({"counter": 2**64 - 1})) == {"counter": 2**64 - 1}
+
+
+def test_receiver_codec_is_in_sync():
+    """Test that the receiver ships an identical copy of the codec."""
+    root = os.path.join(os.path.dirname(__file__), "..", "src")
+    with open(os.path.join(root, "amazing_iot_device", "codec.py")) as f:
+        device_codec = f.read()
+    with open(os.path.join(root, "cloud-service", "mqtt-receiver", "codec.py")) as f:
+        receiver_codec = f.read()
+
+    assert device_codec == receiver_codec
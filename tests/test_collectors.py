@@ -0,0 +1,96 @@
+"""
+Tests for the collector plugin registry
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from amazing_iot_device.codec import RESOURCES_FIELDS
+from amazing_iot_device.collectors import (
+    Collector,
+    CollectorRegistry,
+    FunctionCollector,
+    collector_registry,
+)
+from amazing_iot_device.mqtt_service import MQTTService
+
+
+def test_default_collectors_are_registered():
+    """Test that the built-in collectors each declare their own interval."""
+    names = [collector.name for collector in collector_registry]
+
+    assert names[:5] == ["system", "network", "cpu", "memory", "disk"]
+    assert collector_registry.get("network").blocking is True
+    assert collector_registry.get("cpu").interval < collector_registry.get("disk").interval
+
+
+def test_registry_rejects_invalid_collectors():
+    """Test that collectors need a name and a positive interval."""
+    registry = CollectorRegistry()
+
+    with pytest.raises(ValueError):
+        registry.register(Collector())
+    with pytest.raises(ValueError):
+        registry.register(FunctionCollector("bad", dict, interval=0))
+
+
+def test_hardware_info_merges_collector_sections():
+    """Test that the published hardware information is assembled from the collectors."""
+    registry = CollectorRegistry()
+    for collector in collector_registry:
+        registry.register(collector)
+    registry.register(FunctionCollector("custom", lambda: {"fan_rpm": 1200}, interval=30))
+    registry.register(
+        FunctionCollector("gps", lambda: {"lat": 1.0, "lon": 2.0}, interval=30, section="location")
+    )
+
+    mqtt_service = MQTTService()
+    mqtt_service.collectors = registry
+    hardware_info = mqtt_service._get_hardware_info()
+
+    # Built-in metrics keep their order, custom metrics follow
+    assert tuple(hardware_info["resources"])[: len(RESOURCES_FIELDS)] == RESOURCES_FIELDS
+    assert hardware_info["resources"]["fan_rpm"] == 1200
+    assert hardware_info["location"] == {"lat": 1.0, "lon": 2.0}
+    assert "os_name" in hardware_info["system"]
+
+
+def test_failing_collector_is_skipped():
+    """Test that a failing collector does not prevent publishing the others."""
+    registry = CollectorRegistry()
+    registry.register(FunctionCollector("ok", lambda: {"value": 1}))
+    registry.register(FunctionCollector("broken", lambda: 1 / 0))
+
+    mqtt_service = MQTTService()
+    mqtt_service.collectors = registry
+
+    assert mqtt_service._get_hardware_info()["resources"] == {"value": 1}
+
+
+def test_collector_results_are_reused_between_runs():
+    """Test that publishing uses the latest scheduled result instead of collecting again."""
+    registry = CollectorRegistry()
+    collector = registry.register(FunctionCollector("counter", lambda: {"value": 1}))
+
+    mqtt_service = MQTTService()
+    mqtt_service.collectors = registry
+    mqtt_service._run_collector(collector)
+
+    with patch.object(collector, "collect") as mock_collect:
+        assert mqtt_service._get_hardware_info()["resources"] == {"value": 1}
+    mock_collect.assert_not_called()
+
+
+def test_service_schedules_every_collector():
+    """Test that the service creates one job per collector plus the publishing jobs."""
+    mqtt_service = MQTTService()
+
+    scheduler = mqtt_service._create_scheduler()
+    assert set(scheduler.jobs()) == {
+        *(f"collect:{collector.name}" for collector in collector_registry),
+        "publish",
+    }
+
+    mqtt_service.publish_mode = "batch"
+    assert "sample" in mqtt_service._create_scheduler().jobs()
@@ -0,0 +1,175 @@
+"""
+Tests for the reconnect backoff and the connection manager
+"""
+
+import random
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from amazing_iot_device.connection import (
+    BACKOFF,
+    CONNECTED,
+    DISCONNECTED,
+    ConnectionManager,
+    ExponentialBackoff,
+)
+
+
+def test_backoff_grows_exponentially_up_to_the_cap():
+    """Test that the delay ceiling doubles per attempt and stops at the cap."""
+    backoff = ExponentialBackoff(base=1, cap=10, rng=random.Random(1))
+
+    ceilings = []
+    for _ in range(6):
+        ceilings.append(backoff.ceiling())
+        backoff.next_delay()
+    assert ceilings == [1, 2, 4, 8, 10, 10]
+
+    backoff.reset()
+    assert backoff.ceiling() == 1
+
+
+def test_backoff_survives_a_long_outage():
+    """Test that the delay stays at the cap after more attempts than a float exponent allows."""
+    backoff = ExponentialBackoff(base=1, cap=120, rng=random.Random(1))
+    backoff.attempts = 100000
+
+    assert backoff.ceiling() == 120
+    assert 0 <= backoff.next_delay() <= 120
+    assert ExponentialBackoff(base=5, cap=60, factor=1).ceiling() == 5
+
+
+def test_backoff_uses_full_jitter():
+    """Test that delays are spread over the whole range instead of clustering at the ceiling."""
+    rng = random.Random(42)
+    delays = []
+    for _ in range(1000):
+        backoff = ExponentialBackoff(base=1, cap=60, rng=rng)
+        backoff.attempts = 6
+        delays.append(backoff.next_delay())
+
+    assert all(0 <= delay <= 60 for delay in delays)
+    assert min(delays) < 5
+    assert max(delays) > 55
+    assert 25 < sum(delays) / len(delays) < 35
+
+
+def test_backoff_rejects_invalid_parameters():
+    """Test that the cap cannot be below the base delay."""
+    with pytest.raises(ValueError):
+        ExponentialBackoff(base=10, cap=1)
+
+
+@pytest.fixture
+def mock_client():
+    """Create a mock paho client whose connection state can be toggled."""
+    client = MagicMock()
+    client.connected = threading.Event()
+    client.is_connected.side_effect = client.connected.is_set
+    return client
+
+
+def test_connection_manager_retries_until_connected(mock_client):
+    """Test that failed attempts are retried with backoff, reset once the connection lasted."""
+    manager = ConnectionManager(
+        mock_client,
+        "broker",
+        1883,
+        backoff=ExponentialBackoff(base=0.01, cap=0.05),
+        stable_after=0.05,
+    )
+    attempts = []
+
+    def reconnect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionRefusedError("refused")
+
+    def loop_start():
+        # The network thread reads the CONNACK
+        mock_client.connected.set()
+        manager.connected(0)
+
+    mock_client.reconnect.side_effect = reconnect
+    mock_client.loop_start.side_effect = loop_start
+
+    manager.start()
+    for _ in range(100):
+        if manager.state == CONNECTED:
+            break
+        threading.Event().wait(0.01)
+
+    assert manager.state == CONNECTED
+    assert len(attempts) == 3
+    assert manager.backoff.attempts == 2
+    for _ in range(200):
+        if manager.backoff.attempts == 0:
+            break
+        threading.Event().wait(0.01)
+    assert manager.backoff.attempts == 0
+    mock_client.connect_async.assert_called_once_with("broker", 1883, 60)
+
+    manager.stop()
+    assert manager.state == DISCONNECTED
+    mock_client.disconnect.assert_called_once()
+
+
+def test_connection_manager_reconnects_after_connection_loss(mock_client):
+    """Test that a lost connection leads to a new attempt after a backoff."""
+    manager = ConnectionManager(
+        mock_client, "broker", 1883, backoff=ExponentialBackoff(base=10, cap=10)
+    )
+
+    def loop_start():
+        mock_client.connected.set()
+        manager.connected(0)
+
+    mock_client.loop_start.side_effect = loop_start
+    manager.start()
+    for _ in range(100):
+        if manager.state == CONNECTED:
+            break
+        threading.Event().wait(0.01)
+
+    # The broker goes away
+    mock_client.connected.clear()
+    manager.disconnected(1)
+    for _ in range(100):
+        if manager.state == BACKOFF:
+            break
+        threading.Event().wait(0.01)
+
+    assert manager.state == BACKOFF
+    assert manager.backoff.attempts == 1
+    manager.stop()
+
+
+def test_connection_manager_backs_off_from_connections_dropped_at_once(mock_client):
+    """Test that a broker accepting and then dropping the client at once gets growing delays."""
+    manager = ConnectionManager(
+        mock_client, "broker", 1883, backoff=ExponentialBackoff(base=0.001, cap=10)
+    )
+    # The CONNACK accepts the client, but the connection is already gone when it is checked
+    mock_client.loop_start.side_effect = lambda: manager.connected(0)
+    manager.start()
+    for _ in range(200):
+        if mock_client.reconnect.call_count >= 4:
+            break
+        threading.Event().wait(0.01)
+    manager.stop()
+
+    assert mock_client.reconnect.call_count >= 4
+    assert manager.backoff.attempts >= 3
+
+
+def test_connection_manager_refused_connack(mock_client):
+    """Test that a refused CONNACK counts as a failed attempt."""
+    manager = ConnectionManager(
+        mock_client, "broker", 1883, backoff=ExponentialBackoff(base=10, cap=10)
+    )
+    mock_client.loop_start.side_effect = lambda: manager.connected(5)
+
+    assert manager._attempt() is False
+    mock_client.loop_stop.assert_called_once()
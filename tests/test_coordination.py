@@ -0,0 +1,194 @@
+"""
+Tests for the coordination of the processes serving the agent
+"""
+
+import os
+import time
+
+from amazing_iot_device import db
+from amazing_iot_device.coordination import (
+    STATE_SIZE,
+    Coordinator,
+    LeaderLock,
+    SharedState,
+    StatusFile,
+)
+from amazing_iot_device.metrics import metrics_registry
+from amazing_iot_device.models import Settings
+from amazing_iot_device.sampler import resource_sampler
+from amazing_iot_device.settings_repository import settings_repository
+
+
+def wait_for(condition, timeout=5.0):
+    """Wait until ``condition()`` is true, returning its last value."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_leader_lock_is_exclusive(tmp_path):
+    """Test that only one holder at a time gets the lock."""
+    path = str(tmp_path / "agent.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    first.release()
+    assert second.try_acquire()
+    assert second.held
+    second.release()
+
+
+def test_shared_snapshot_round_trip(tmp_path):
+    """Test that a snapshot written by one mapping is read by another."""
+    path = str(tmp_path / "agent.state")
+    writer, reader = SharedState(path), SharedState(path)
+    try:
+        assert reader.read_snapshot() is None
+
+        snapshot = resource_sampler.sample()
+        writer.write_snapshot(snapshot)
+        assert reader.read_snapshot() == snapshot
+
+        assert writer.bump_settings_version() == 1
+        assert reader.settings_version == 1
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_shared_state_resets_foreign_files(tmp_path):
+    """Test that a state file of another layout is reset instead of misread."""
+    path = tmp_path / "agent.state"
+    path.write_bytes(b"\xff" * 10)
+
+    state = SharedState(str(path))
+    try:
+        assert path.stat().st_size == STATE_SIZE
+        assert state.settings_version == 0
+        assert state.read_snapshot() is None
+    finally:
+        state.close()
+
+
+def test_settings_written_by_another_process(app, tmp_path):
+    """Test that a settings write announced by another process reloads the snapshot."""
+    path = str(tmp_path / "agent.state")
+    shared, other_process = SharedState(path), SharedState(path)
+    changes = []
+
+    def subscriber(changed, version):
+        changes.append(changed)
+
+    settings_repository.share(shared)
+    settings_repository.subscribe(subscriber)
+    try:
+        assert settings_repository.get("device_name") == "Test IoT Device"
+        with app.app_context():
+            Settings.query.filter_by(key="device_name").first().value = "Renamed"
+            db.session.commit()
+        assert settings_repository.get("device_name") == "Test IoT Device"
+
+        other_process.bump_settings_version()
+        assert settings_repository.get("device_name") == "Renamed"
+        assert changes == [{"device_name": "Renamed"}]
+
+        # Writes of this process are announced to the others
+        settings_repository.set("theme", "dark")
+        assert other_process.settings_version == 2
+        settings_repository.refresh()
+        assert changes == [{"device_name": "Renamed"}, {"theme": "dark"}]
+    finally:
+        settings_repository.unsubscribe(subscriber)
+        settings_repository.share(None)
+        shared.close()
+        other_process.close()
+
+
+def test_coordinator_elects_one_leader(tmp_path):
+    """Test that one coordinator leads, and another takes over when it stops."""
+    lock_path, state_path = str(tmp_path / "agent.lock"), str(tmp_path / "agent.state")
+    led = []
+    first, second = Coordinator(interval=0.05), Coordinator(interval=0.05)
+    try:
+        first.start(lock_path, state_path, lambda: led.append("first"))
+        second.start(lock_path, state_path, lambda: led.append("second"))
+        assert first.is_leader
+        assert not second.is_leader
+        assert resource_sampler.source is second.shared
+
+        snapshot = resource_sampler.sample()
+        first.shared.write_snapshot(snapshot)
+        assert resource_sampler.get_snapshot(max_age=0.5) == snapshot
+
+        first.stop()
+        assert wait_for(lambda: second.is_leader)
+        assert led == ["first", "second"]
+        assert resource_sampler.source is None
+    finally:
+        first.stop()
+        second.stop()
+        resource_sampler.stop()
+
+
+def test_coordinator_gives_the_lock_up_when_leading_fails(tmp_path):
+    """Test that a failed start of the services is undone and retried."""
+    lock_path, state_path = str(tmp_path / "agent.lock"), str(tmp_path / "agent.state")
+    attempts, resigned = [], []
+
+    def lead():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise RuntimeError("Cannot open the outbox")
+
+    coordinator = Coordinator(interval=0.2)
+    try:
+        coordinator.start(lock_path, state_path, lead, lambda: resigned.append(True))
+        assert not coordinator.is_leader
+        assert not coordinator.lock.held
+        assert resigned == [True]
+        # Meanwhile the snapshots of another process are followed
+        assert resource_sampler.source is coordinator.shared
+
+        assert wait_for(lambda: coordinator.is_leader)
+        assert attempts == [0, 1]
+        assert resigned == [True]
+        assert resource_sampler.source is None
+    finally:
+        coordinator.stop()
+        resource_sampler.stop()
+
+
+def test_followers_serve_the_status_of_the_leader(tmp_path):
+    """Test that followers show the MQTT status and metrics reported by the leader."""
+    lock_path, state_path = str(tmp_path / "agent.lock"), str(tmp_path / "agent.state")
+    first, second = Coordinator(interval=0.2), Coordinator(interval=0.2)
+    try:
+        first.start(lock_path, state_path, lambda: None)
+        second.start(lock_path, state_path, lambda: None)
+        assert first.leader_status() is None
+        status = second.leader_status()
+        assert status["pid"] == os.getpid()
+        assert status["mqtt"]["connected"] is False
+        assert "agent_mqtt_messages_published_total" in status["metrics"]
+
+        assert metrics_registry.source == second.leader_metrics
+        assert second.leader_metrics().startswith("# Metrics of the publishing process")
+        assert first.leader_metrics() is None
+    finally:
+        first.stop()
+        second.stop()
+        resource_sampler.stop()
+    assert metrics_registry.source is None
+
+
+def test_followers_mark_a_stale_leader_status(tmp_path):
+    """Test that a status the leader stopped reporting is not shown as current."""
+    coordinator = Coordinator(interval=0.2)
+    coordinator.status_file = StatusFile(str(tmp_path / "agent-status.json"))
+    assert coordinator.leader_status() is None
+
+    coordinator.status_file.write({"pid": 1, "time": time.time() - 60, "mqtt": {}, "metrics": ""})
+    assert coordinator.leader_status() is None
+    assert coordinator.leader_metrics().startswith(f"# Metrics of process {os.getpid()}")
@@ -2,8 +2,11 @@
 Tests for dashboard functionality
 """
 
+import time
 from unittest.mock import patch
 
+import pytest
+
 
 def test_dashboard_access(client, auth):
     """Test dashboard access requires authentication."""
@@ -61,3 +64,87 @@ def test_resource_usage_data(mock_disk, mock_memory, mock_cpu, client, auth):
     assert b"25.5%" in response.data  # CPU
     assert b"60.0%" in response.data  # Memory
     assert b"45.0%" in response.data  # Disk
+
+
+def test_metrics_api(client, auth):
+    """Test the JSON resource usage and its conditional requests."""
+    response = client.get("/dashboard/api/metrics")
+    assert response.status_code == 302
+
+    auth.login()
+    response = client.get("/dashboard/api/metrics")
+    assert response.status_code == 200
+    usage = response.get_json()
+    assert 0 <= usage["cpu_percent"] <= 100
+    assert usage["memory_total"].endswith(" GB")
+    assert usage["timestamp"] > 0
+
+    # The same snapshot is not sent twice
+    response = client.get(
+        "/dashboard/api/metrics", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+
+
+def test_metrics_stream(client, auth, app):
+    """Test that new snapshots are streamed as Server-Sent Events."""
+    from amazing_iot_device.dashboard import metrics_broadcaster
+    from amazing_iot_device.sampler import resource_sampler
+
+    response = client.get("/dashboard/api/stream")
+    assert response.status_code == 302
+
+    auth.login()
+    response = client.get("/dashboard/api/stream", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = response.iter_encoded()
+    assert next(events).startswith(b"retry:")
+
+    snapshot = resource_sampler.sample()
+    frame = next(events)
+    assert b"event: metrics\n" in frame
+    assert f'"timestamp": {snapshot.timestamp}'.encode() in frame
+    assert metrics_broadcaster.streams == 1
+    response.close()
+    assert metrics_broadcaster.streams == 0
+
+
+def test_metrics_stream_limit(client, auth):
+    """Test that streams beyond the limit are refused so the page polls instead."""
+    from amazing_iot_device.dashboard import metrics_broadcaster
+
+    auth.login()
+    max_streams = metrics_broadcaster.max_streams
+    metrics_broadcaster.max_streams = 0
+    try:
+        response = client.get("/dashboard/api/stream")
+    finally:
+        metrics_broadcaster.max_streams = max_streams
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "60"
+
+
+def test_history_api(client, auth, tmp_path):
+    """Test the resource usage history behind the dashboard chart."""
+    from amazing_iot_device.history import history_store
+
+    auth.login()
+    response = client.get("/dashboard/api/history")
+    assert response.status_code == 503
+
+    history_store.open(str(tmp_path / "history.sqlite"))
+    try:
+        history_store.add(time.time() - 30, [25.0, 50.0, 75.0])
+        response = client.get("/dashboard/api/history?range=3600")
+        assert response.status_code == 200
+        history = response.get_json()
+        assert history["resolution"] == 1
+        assert history["end"] - history["start"] == pytest.approx(3600, abs=1)
+        assert history["avg"]["disk_percent"] == [75.0]
+
+        # Ranges beyond the retention are served from the coarsest rollup
+        response = client.get("/dashboard/api/history?range=99999999")
+        assert response.get_json()["resolution"] == 900
+    finally:
+        history_store.close()
@@ -0,0 +1,79 @@
+"""
+Tests for the deadband filter
+"""
+
+import pytest
+
+from amazing_iot_device.deadband import DEADBAND_KEY, Deadband, DeadbandFilter
+
+
+def test_deadband_parse():
+    """Test parsing of the "absolute,relative" setting values."""
+    assert Deadband.parse("") == Deadband()
+    assert Deadband.parse("2") == Deadband(2.0, 0.0)
+    assert Deadband.parse("0,0.05") == Deadband(0.0, 0.05)
+    assert Deadband.parse(" 1.5 , 0.1 ") == Deadband(1.5, 0.1)
+    for invalid in ("abc", "1,2,3", "-1"):
+        with pytest.raises(ValueError):
+            Deadband.parse(invalid)
+
+
+def test_deadband_uses_the_wider_band():
+    """Test that a value must leave both the absolute and the relative band."""
+    band = Deadband(absolute=2.0, relative=0.1)
+
+    assert not band.exceeded(10.0, 11.5)
+    assert band.exceeded(10.0, 12.5)
+    # Around 100 the relative band (10) is the wider one
+    assert not band.exceeded(100.0, 108.0)
+    assert band.exceeded(100.0, 111.0)
+    # Without thresholds any change is reported
+    assert Deadband().exceeded(1.0, 1.01)
+    assert not Deadband().exceeded(1.0, 1.0)
+
+
+def test_deadband_filter_reports_only_changes():
+    """Test that only metrics past their deadband are reported."""
+    deadband = DeadbandFilter(bands={"cpu_percent": Deadband(5.0)}, heartbeat=300)
+
+    first = deadband.filter({"cpu_percent": 10.0, "memory_percent": 50.0}, now=0)
+    assert first[DEADBAND_KEY] == {"seq": 1, "full": True, "heartbeat": 300.0}
+
+    # Within the band and unchanged: nothing to send
+    assert deadband.filter({"cpu_percent": 14.0, "memory_percent": 50.0}, now=10) is None
+
+    second = deadband.filter({"cpu_percent": 16.0, "memory_percent": 50.0}, now=20)
+    assert second == {
+        "cpu_percent": 16.0,
+        DEADBAND_KEY: {"seq": 2, "full": False, "heartbeat": 300.0},
+    }
+
+
+def test_deadband_filter_reports_slow_drift():
+    """Test that small steps are compared with the last reported value, not the last sample."""
+    deadband = DeadbandFilter(bands={"cpu_percent": Deadband(5.0)})
+    deadband.filter({"cpu_percent": 10.0}, now=0)
+
+    assert deadband.filter({"cpu_percent": 13.0}, now=1) is None
+    assert deadband.filter({"cpu_percent": 16.0}, now=2)["cpu_percent"] == 16.0
+
+
+def test_deadband_filter_heartbeat():
+    """Test that every metric is re-sent when the heartbeat interval expires."""
+    deadband = DeadbandFilter(heartbeat=60)
+    deadband.filter({"cpu_percent": 10.0, "memory_percent": 50.0}, now=0)
+
+    assert deadband.filter({"cpu_percent": 10.0, "memory_percent": 50.0}, now=59) is None
+    heartbeat = deadband.filter({"cpu_percent": 10.0, "memory_percent": 50.0}, now=60)
+    assert heartbeat["cpu_percent"] == 10.0
+    assert heartbeat[DEADBAND_KEY]["full"] is True
+
+
+def test_deadband_filter_configure_resets():
+    """Test that changing the thresholds re-sends the complete state."""
+    deadband = DeadbandFilter()
+    deadband.filter({"cpu_percent": 10.0}, now=0)
+
+    deadband.configure(bands={"cpu_percent": Deadband(1.0)})
+
+    assert deadband.filter({"cpu_percent": 10.0}, now=1)[DEADBAND_KEY]["seq"] == 1
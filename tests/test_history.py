@@ -0,0 +1,92 @@
+"""
+Tests for the resource usage history store
+"""
+
+import time
+
+import pytest
+
+from amazing_iot_device.history import HistoryStore
+
+
+@pytest.fixture
+def history(tmp_path):
+    """Create a history store in a temporary directory."""
+    history = HistoryStore()
+    history.open(str(tmp_path / "history.sqlite"))
+    yield history
+    history.close()
+
+
+def test_history_raw_samples(history):
+    """Test that recent samples are returned raw, with a tenth of a percent precision."""
+    now = int(time.time())
+    history.add(now - 10, [12.34, 50.0, 70.0])
+    history.add(now - 8, [20.0, 51.5, 70.0])
+
+    result = history.query(now - 60)
+
+    assert result["resolution"] == 1
+    assert result["timestamps"] == [now - 10, now - 8]
+    assert result["avg"]["cpu_percent"] == [12.3, 20.0]
+    assert result["avg"]["memory_percent"] == [50.0, 51.5]
+    assert "min" not in result
+
+
+def test_history_rollups(history):
+    """Test that older ranges are served from the minute and quarter-hour rollups."""
+    now = int(time.time())
+    start = now - now % 900 - 900
+    for offset, cpu in ((0, 10.0), (10, 30.0), (70, 50.0)):
+        history.add(start + offset, [cpu, 40.0, 60.0])
+
+    minutes = history.query(now - 2 * 3600)
+    assert minutes["resolution"] == 60
+    assert minutes["timestamps"] == [start, start + 60]
+    assert minutes["avg"]["cpu_percent"] == [20.0, 50.0]
+    assert minutes["min"]["cpu_percent"] == [10.0, 50.0]
+    assert minutes["max"]["cpu_percent"] == [30.0, 50.0]
+
+    quarters = history.query(now - 2 * 86400)
+    assert quarters["resolution"] == 900
+    assert quarters["timestamps"] == [start]
+    assert quarters["avg"]["cpu_percent"] == [30.0]
+    assert quarters["max"]["cpu_percent"] == [50.0]
+
+
+def test_history_buffers_writes(history):
+    """Test that samples are written in batches, and rollups resume after a restart."""
+    now = int(time.time())
+    minute = now - now % 60 - 120
+    history.add(minute, [10.0, 0.0, 0.0])
+    # Nothing is written before the flush interval elapsed
+    assert history._conn.execute("SELECT COUNT(*) FROM history_raw").fetchone()[0] == 0
+    history.close()
+
+    history.open(history.path)
+    history.add(minute + 1, [30.0, 0.0, 0.0])
+    result = history.query(now - 3 * 3600)
+    assert result["avg"]["cpu_percent"] == [20.0]
+    assert result["max"]["cpu_percent"] == [30.0]
+
+
+def test_history_retention(history):
+    """Test that every tier drops the rows older than its retention."""
+    now = int(time.time())
+    history.add(now - 2 * 3600, [1.0, 1.0, 1.0])
+    history.add(now - 2 * 86400, [2.0, 2.0, 2.0])
+    history.add(now - 40 * 86400, [3.0, 3.0, 3.0])
+    # Stamped before the clock was set back
+    history.add(now + 86400, [4.0, 4.0, 4.0])
+
+    stats = history.stats()
+
+    assert stats["rows"] == {"history_raw": 0, "history_1m": 1, "history_15m": 2}
+    assert stats["file_size"] > 0
+
+
+def test_history_closed_store_ignores_samples():
+    """Test that samples added before the store is opened are dropped."""
+    history = HistoryStore()
+    history.add(time.time(), [1.0, 2.0, 3.0])
+    assert history.query(time.time() - 60)["timestamps"] == []
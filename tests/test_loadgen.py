@@ -0,0 +1,77 @@
+"""
+Tests for the load generator
+"""
+
+import asyncio
+
+from amazing_iot_device import codec
+from amazing_iot_device.broker import Broker
+from amazing_iot_device.loadgen import (
+    LoadStats,
+    VirtualDevice,
+    format_report,
+    run_load,
+)
+
+
+def test_virtual_device_messages():
+    """Test that a device publishes every section and the full payload under its own prefix."""
+    device = VirtualDevice(7, "run", prefix="fleet", seed=1)
+    messages = dict(device.messages())
+
+    assert device.client_id == "loadgen-run-00007"
+    assert set(messages) == {
+        f"fleet/loadgen-run-00007/{suffix}"
+        for suffix in ("system", "network", "resources", "rates", "full")
+    }
+    full = codec.decode(messages["fleet/loadgen-run-00007/full"])
+    assert full["device_id"] == device.client_id
+    assert set(full["resources"]) == set(codec.RESOURCES_FIELDS)
+    assert 0 <= full["resources"]["cpu_percent"] <= 100
+
+    full_only = VirtualDevice(7, "run", full_only=True, payload_format="binary", seed=1)
+    assert [topic for topic, _ in full_only.messages()] == ["loadgen/loadgen-run-00007/full"]
+
+
+def test_virtual_device_interval_jitter():
+    """Test that publish intervals stay within the jitter."""
+    device = VirtualDevice(0, "run", interval=10.0, jitter=0.2, seed=1)
+    delays = [device.next_delay() for _ in range(200)]
+
+    assert all(8.0 <= delay <= 12.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_load_stats_percentiles():
+    """Test the counters, throughput and latency percentiles of a report."""
+    stats = LoadStats(seed=1)
+    for latency in range(1, 101):
+        stats.record_sent(10)
+        stats.record_ack(latency / 1000)
+
+    report = stats.report(elapsed=2.0)
+    assert report["acknowledged"] == 100
+    assert report["messages_per_s"] == 50.0
+    assert report["bytes_per_s"] == 500.0
+    assert report["latency"]["p50"] == 0.051
+    assert report["latency"]["max"] == 0.1
+    assert "p99 100.0" in format_report(report)
+
+
+def test_run_load_against_local_broker():
+    """Test a short run of a small fleet against the embedded broker."""
+    broker = Broker()
+    port = broker.start()
+    try:
+        report = asyncio.run(
+            run_load(20, "127.0.0.1", port, duration=1.0, connect_rate=1000, interval=0.2, seed=1)
+        )
+    finally:
+        broker.stop()
+
+    assert report["connected"] == 20
+    assert report["connect_failures"] == 0
+    assert report["acknowledged"] > 0
+    assert report["messages_per_s"] > 0
+    assert report["latency"]["p50"] is not None
+    assert broker.received >= report["acknowledged"]
@@ -0,0 +1,149 @@
+"""
+Tests for the agent metrics
+"""
+
+import itertools
+from unittest.mock import MagicMock
+
+import pytest
+
+from amazing_iot_device.metrics import (
+    MESSAGES_PUBLISHED,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+)
+from amazing_iot_device.mqtt_service import MQTTService
+
+
+@pytest.fixture
+def mock_mqtt_client():
+    """A connected mock MQTT client whose messages are acknowledged immediately."""
+    client = MagicMock()
+    client.is_connected.return_value = True
+    message_ids = itertools.count(1)
+
+    def publish(*args, **kwargs):
+        info = MagicMock()
+        info.rc = 0
+        info.mid = next(message_ids)
+        info.is_published.return_value = True
+        return info
+
+    client.publish.side_effect = publish
+    return client
+
+
+def test_counter_and_gauge_rendering():
+    """Test the exposition format of counters and gauges."""
+    registry = MetricsRegistry()
+    sent = registry.counter("sent_total", "Messages sent", ("topic",))
+    depth = registry.gauge("queue_depth", "Queued messages")
+
+    sent.labels("full").inc()
+    sent.labels("full").inc(2)
+    sent.labels('say "hi"').inc()
+    depth.set(5)
+    depth.dec()
+
+    text = registry.render()
+    assert "# HELP sent_total Messages sent\n# TYPE sent_total counter\n" in text
+    assert 'sent_total{topic="full"} 3\n' in text
+    assert 'sent_total{topic="say \\"hi\\""} 1\n' in text
+    assert "# TYPE queue_depth gauge\nqueue_depth 4\n" in text
+    assert sent.total() == 4
+
+
+def test_counter_rejects_decrease_and_wrong_labels():
+    """Test that counters only go up and label values must match the label names."""
+    counter = Counter("errors_total", "Errors", ("reason",))
+
+    with pytest.raises(ValueError):
+        counter.labels("timeout").inc(-1)
+    with pytest.raises(ValueError):
+        counter.labels("timeout", "extra")
+
+
+def test_gauge_function():
+    """Test that a gauge can be read from a function when rendered."""
+    gauge = Gauge("connected", "Connection state")
+    gauge.set_function(lambda: True)
+
+    assert gauge.render()[-1] == "connected 1"
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test the buckets, sum and count of a histogram."""
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 3.65" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_histogram_quantile_and_timer():
+    """Test the bucket-interpolated quantile and the timing context manager."""
+    histogram = Histogram("duration_seconds", "Duration", buckets=(1.0, 2.0, 4.0))
+    assert histogram.labels().quantile(0.5) is None
+
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.labels().quantile(0.5) == pytest.approx(1.5)
+
+    with histogram.time():
+        pass
+    assert histogram.total() == 5
+
+
+def test_histogram_rejects_unsorted_buckets():
+    """Test that bucket bounds must be sorted."""
+    with pytest.raises(ValueError):
+        Histogram("bad_seconds", "Bad", buckets=(1.0, 0.5))
+
+
+def test_metrics_endpoint_requires_authentication(client, auth, app):
+    """Test that /metrics needs a login or the metrics token."""
+    response = client.get("/metrics")
+    assert response.status_code == 302
+
+    app.config["METRICS_TOKEN"] = "scrape-token"
+    response = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 302
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    auth.login()
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert b"# TYPE agent_mqtt_messages_published_total counter" in response.data
+
+
+def test_metrics_endpoint_reports_request_latency(client, auth):
+    """Test that web requests are timed per route."""
+    auth.login()
+    client.get("/dashboard/")
+    response = client.get("/metrics")
+
+    assert (
+        b'agent_http_request_duration_seconds_count{method="GET",endpoint="/dashboard/",'
+        b'status="200"}' in response.data
+    )
+
+
+def test_mqtt_publish_updates_metrics(mock_mqtt_client):
+    """Test that acknowledged messages are counted and the publish time is kept."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    published = MESSAGES_PUBLISHED.total()
+
+    mqtt_service._publish_hardware_info()
+
+    assert MESSAGES_PUBLISHED.total() > published
+    assert mqtt_service.last_published is not None
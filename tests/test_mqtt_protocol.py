@@ -0,0 +1,116 @@
+"""
+Tests for the MQTT protocol module
+"""
+
+import asyncio
+
+import pytest
+
+from amazing_iot_device.mqtt_protocol import (
+    PUBLISH,
+    AsyncMQTTClient,
+    MQTTProtocolError,
+    connect_packet,
+    encode_remaining_length,
+    parse_publish,
+    publish_packet,
+    read_packet,
+)
+
+
+def test_remaining_length_encoding():
+    """Test the variable length encoding at the byte boundaries."""
+    assert encode_remaining_length(0) == b"\x00"
+    assert encode_remaining_length(127) == b"\x7f"
+    assert encode_remaining_length(128) == b"\x80\x01"
+    assert encode_remaining_length(16383) == b"\xff\x7f"
+    assert encode_remaining_length(268435455) == b"\xff\xff\xff\x7f"
+    with pytest.raises(MQTTProtocolError):
+        encode_remaining_length(268435456)
+
+
+def test_connect_packet_layout():
+    """Test the fields of a CONNECT packet."""
+    packet = connect_packet("probe", "user", "secret", keepalive=10)
+
+    assert packet[0] == 0x10
+    assert packet[1] == len(packet) - 2
+    assert packet[2:8] == b"\x00\x04MQTT"
+    assert packet[8] == 4
+    assert packet[9] == 0xC2
+    assert packet[10:12] == b"\x00\x0a"
+    assert packet.endswith(b"\x00\x06secret")
+    # Credentials are only sent when both are set
+    assert connect_packet("probe", "user", "")[9] == 0x02
+
+
+def test_publish_packet_round_trip():
+    """Test that a PUBLISH packet is read back with its topic, payload and flags."""
+    payload = b"x" * 300
+    packet = publish_packet("iot/device/full", payload, qos=1, packet_id=42, retain=True)
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(packet)
+        return await read_packet(reader)
+
+    packet_type, flags, body = asyncio.run(read())
+    assert packet_type == PUBLISH
+    assert parse_publish(flags, body) == ("iot/device/full", payload, 1, 42, True)
+
+
+def test_read_packet_rejects_oversized_packets():
+    """Test that the size limit is checked before reading the body."""
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(publish_packet("topic", b"x" * 100))
+        return await read_packet(reader, max_size=64)
+
+    with pytest.raises(MQTTProtocolError):
+        asyncio.run(read())
+
+
+def test_client_publishes_with_acknowledgements(mqtt_broker):
+    """Test connecting, publishing with QoS 0 and 1 and disconnecting."""
+
+    async def main():
+        client = AsyncMQTTClient("test-client", keepalive=0)
+        await client.connect("127.0.0.1", mqtt_broker.port)
+        assert client.is_connected
+        assert await client.publish("test/topic", b"payload", qos=0) is None
+        # Messages are handled in order, so the acknowledgement covers both of them
+        latency = await client.publish("test/topic", b"payload", qos=1)
+        assert latency > 0
+        await client.disconnect()
+        assert not client.is_connected
+        with pytest.raises(ConnectionError):
+            await client.publish("test/topic", b"payload")
+
+    asyncio.run(main())
+    assert mqtt_broker.received == 2
+
+
+def test_client_subscribes_with_wildcards(mqtt_broker):
+    """Test that a subscriber receives the matching messages of another client."""
+    received = []
+
+    async def main():
+        subscriber = AsyncMQTTClient(
+            "subscriber", keepalive=0, on_message=lambda topic, payload: received.append(topic)
+        )
+        publisher = AsyncMQTTClient("publisher", keepalive=0)
+        await subscriber.connect("127.0.0.1", mqtt_broker.port)
+        await publisher.connect("127.0.0.1", mqtt_broker.port)
+        assert await subscriber.subscribe("iot/+/full", qos=1) == 1
+        for topic in ("iot/a/full", "iot/a/system", "iot/b/full"):
+            await publisher.publish(topic, b"{}")
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await publisher.disconnect()
+        await subscriber.disconnect()
+
+    asyncio.run(main())
+    assert received == ["iot/a/full", "iot/b/full"]
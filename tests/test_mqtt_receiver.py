@@ -179,3 +179,121 @@ def test_json_decode_error():
         # Verify store_data was not called
         with patch("receiver.store_data") as mock_store:
             assert not mock_store.called
+
+
+def test_store_data_expands_batch():
+    """Test that batch messages are stored as individual resource samples."""
+    data = {
+        "schema": "batch/1",
+        "device_id": "test-device",
+        "count": 2,
+        "start": 1672574400.0,
+        "offsets": [0, 1000],
+        "columns": {"cpu_percent": [10.0, 20.0], "memory_percent": [50.0, 51.0]},
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir, patch.object(receiver, "DATA_DIR", temp_dir):
+        receiver.store_data("test-device", "iot/device/batch", "2023-01-01T12:00:00", data)
+
+        device_dir = os.path.join(temp_dir, "test-device")
+        files = os.listdir(device_dir)
+        assert len(files) == 1
+        assert files[0].endswith("_resources.jsonl")
+
+        with open(os.path.join(device_dir, files[0])) as f:
+            records = [json.loads(line) for line in f]
+
+    assert [record["cpu_percent"] for record in records] == [10.0, 20.0]
+    assert [record["memory_percent"] for record in records] == [50.0, 51.0]
+    assert all(record["device_id"] == "test-device" for record in records)
+    assert records[0]["timestamp"] < records[1]["timestamp"]
+
+
+def test_on_message_binary_payload():
+    """Test that binary payloads are decoded before being stored."""
+    data = {"device_id": "abc123", "timestamp": "2023-01-01T12:00:00", "os_name": "TestOS"}
+    mock_msg = MagicMock()
+    mock_msg.topic = "iot/device/abc123/system"
+    mock_msg.payload = receiver.codec.encode(data, "binary+zlib")
+
+    with patch("receiver.store_data") as mock_store:
+        receiver.on_message(MagicMock(), None, mock_msg)
+
+    mock_store.assert_called_once_with("abc123", mock_msg.topic, "2023-01-01T12:00:00", data)
+
+
+def test_store_data_reconstructs_deadband_samples():
+    """Test that deadband filtered samples are stored with the last known value of every metric."""
+    messages = [
+        {
+            "cpu_percent": 10.0,
+            "memory_percent": 50.0,
+            "deadband": {"seq": 1, "full": True, "heartbeat": 300},
+        },
+        {"cpu_percent": 20.0, "deadband": {"seq": 2, "full": False, "heartbeat": 300}},
+        # Message 3 was lost
+        {"memory_percent": 60.0, "deadband": {"seq": 4, "full": False, "heartbeat": 300}},
+    ]
+
+    with (
+        tempfile.TemporaryDirectory() as temp_dir,
+        patch.object(receiver, "DATA_DIR", temp_dir),
+        patch.object(receiver, "deadband_state", {}),
+    ):
+        for data in messages:
+            receiver.store_data("test-device", "iot/device/resources", "2023-01-01T12:00:00", data)
+
+        file_path = os.path.join(temp_dir, "test-device", "2023-01-01_resources.jsonl")
+        with open(file_path) as f:
+            records = [json.loads(line) for line in f]
+
+    assert [(r["cpu_percent"], r["memory_percent"]) for r in records] == [
+        (10.0, 50.0),
+        (20.0, 50.0),
+        (20.0, 60.0),
+    ]
+    assert records[1]["deadband"]["changed"] == ["cpu_percent"]
+    assert [r["deadband"]["complete"] for r in records] == [True, True, False]
+
+
+def test_store_data_keeps_deadband_state_on_late_samples():
+    """Test that samples replayed from the device outbox do not roll the known values back."""
+    messages = [
+        {
+            "cpu_percent": 10.0,
+            "memory_percent": 50.0,
+            "deadband": {"seq": 1, "full": True, "heartbeat": 300},
+        },
+        # Sent after a reconnect, before the backlog of messages 2 to 4
+        {"cpu_percent": 40.0, "deadband": {"seq": 5, "full": False, "heartbeat": 300}},
+        {"cpu_percent": 20.0, "deadband": {"seq": 2, "full": False, "heartbeat": 300}},
+        {
+            "cpu_percent": 30.0,
+            "memory_percent": 55.0,
+            "deadband": {"seq": 3, "full": True, "heartbeat": 300},
+        },
+        {"memory_percent": 70.0, "deadband": {"seq": 6, "full": False, "heartbeat": 300}},
+    ]
+
+    with (
+        tempfile.TemporaryDirectory() as temp_dir,
+        patch.object(receiver, "DATA_DIR", temp_dir),
+        patch.object(receiver, "deadband_state", {}),
+    ):
+        for data in messages:
+            receiver.store_data("test-device", "iot/device/resources", "2023-01-01T12:00:00", data)
+
+        file_path = os.path.join(temp_dir, "test-device", "2023-01-01_resources.jsonl")
+        with open(file_path) as f:
+            records = [json.loads(line) for line in f]
+        state = receiver.deadband_state["test-device"]
+
+    # The late samples are kept as history with their own values
+    assert [r["cpu_percent"] for r in records] == [10.0, 40.0, 20.0, 30.0, 40.0]
+    assert [r["deadband"].get("late", False) for r in records] == [False, False, True, True, False]
+    assert "memory_percent" not in records[2]
+    # The state follows the newest samples only
+    assert records[4]["memory_percent"] == 70.0
+    assert state["seq"] == 6
+    assert state["values"]["cpu_percent"] == 40.0
+    assert [r["deadband"]["complete"] for r in records] == [True, False, False, True, False]
@@ -2,11 +2,24 @@
 Tests for MQTT service functionality
 """
 
+import itertools
+import json
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+from amazing_iot_device import codec
 from amazing_iot_device.mqtt_service import MQTTService
+from amazing_iot_device.outbox import Outbox
+
+
+def scheduled_jobs(mqtt_service):
+    """Return the functions of the jobs the service schedules in its publish mode, by name."""
+    scheduler = mqtt_service._create_scheduler()
+    jobs = {name: scheduler._jobs[name].func for name in scheduler.jobs()}
+    scheduler.shutdown()
+    return jobs
 
 
 @pytest.fixture
@@ -20,10 +33,18 @@ def mock_mqtt_client():
         # Mock connection status
         mock_client_instance.is_connected.return_value = True
 
-        # Mock publish method
-        mock_client_instance.publish.return_value = MagicMock()
-        mock_client_instance.publish.return_value.is_published.return_value = True
-        mock_client_instance.publish.return_value.wait_for_publish.return_value = None
+        # Mock publish method, every message gets its own message id
+        message_ids = itertools.count(1)
+
+        def publish(*args, **kwargs):
+            message_info = MagicMock()
+            message_info.rc = 0
+            message_info.mid = next(message_ids)
+            message_info.is_published.return_value = True
+            message_info.wait_for_publish.return_value = None
+            return message_info
+
+        mock_client_instance.publish.side_effect = publish
 
         yield mock_client_instance
 
@@ -147,3 +168,289 @@ def test_mqtt_on_connect_callback(mock_client_class):
 
         # Check that error was logged
         mock_log.error.assert_called()
+
+
+def test_mqtt_delta_publish_skips_unchanged_static_topics(mock_mqtt_client):
+    """Test that delta publishing sends system/network only when their content changes."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.delta_publish = True
+
+    sample_hardware_info = {
+        "timestamp": "2023-01-01T00:00:00",
+        "device_id": "test-device",
+        "system": {"os_name": "Test OS"},
+        "network": {"hostname": "test-host"},
+        "resources": {"cpu_percent": 10},
+    }
+
+    with patch.object(mqtt_service, "_get_hardware_info", return_value=sample_hardware_info):
+        mqtt_service._publish_hardware_info()
+        mqtt_service._publish_hardware_info()
+
+    topic_prefix = mqtt_service.broker_settings["topic_prefix"]
+    calls = [call[1] for call in mock_mqtt_client.publish.call_args_list]
+    topics = [call["topic"] for call in calls]
+
+    # Static topics are only sent in the first cycle, and they are retained
+    assert topics.count(f"{topic_prefix}/system") == 1
+    assert topics.count(f"{topic_prefix}/network") == 1
+    assert topics.count(f"{topic_prefix}/resources") == 2
+    assert topics.count(f"{topic_prefix}/full") == 2
+    for call in calls:
+        assert call["retain"] is (call["topic"].rsplit("/", 1)[-1] in ("system", "network"))
+
+    # A content change publishes the topic again
+    sample_hardware_info["network"] = {"hostname": "renamed-host"}
+    with patch.object(mqtt_service, "_get_hardware_info", return_value=sample_hardware_info):
+        mqtt_service._publish_hardware_info()
+
+    topics = [call[1]["topic"] for call in mock_mqtt_client.publish.call_args_list]
+    assert topics.count(f"{topic_prefix}/network") == 2
+    assert topics.count(f"{topic_prefix}/system") == 1
+
+
+def test_mqtt_offline_samples_are_queued_and_forwarded(mock_mqtt_client, tmp_path):
+    """Test that samples taken while disconnected are stored and forwarded after reconnect."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.outbox = Outbox(str(tmp_path / "outbox.sqlite"), drain_rate=1000)
+
+    sample_hardware_info = {
+        "timestamp": "2023-01-01T00:00:00",
+        "device_id": "test-device",
+        "system": {"os_name": "Test OS"},
+        "network": {"hostname": "test-host"},
+        "resources": {"cpu_percent": 10},
+    }
+
+    # The broker is unreachable, so the sample goes to the outbox
+    mock_mqtt_client.is_connected.return_value = False
+    mock_mqtt_client.reconnect.side_effect = OSError("Connection refused")
+    with patch.object(mqtt_service, "_get_hardware_info", return_value=sample_hardware_info):
+        mqtt_service._publish_hardware_info()
+
+    assert mock_mqtt_client.publish.call_count == 0
+    # Static topics are not queued
+    assert mqtt_service.outbox.depth == 2
+    queued = mqtt_service.outbox.peek(10)
+    assert b'"timestamp": "2023-01-01T00:00:00"' in queued[0].payload
+
+    # Once connected again the fresh sample is published first, then the backlog
+    mock_mqtt_client.is_connected.return_value = True
+    with patch.object(mqtt_service, "_get_hardware_info", return_value=sample_hardware_info):
+        mqtt_service._publish_hardware_info()
+
+    topic_prefix = mqtt_service.broker_settings["topic_prefix"]
+    topics = [call[1]["topic"] for call in mock_mqtt_client.publish.call_args_list]
+    assert topics[:4] == [
+        f"{topic_prefix}/system",
+        f"{topic_prefix}/network",
+        f"{topic_prefix}/resources",
+        f"{topic_prefix}/full",
+    ]
+    assert topics[4:] == [f"{topic_prefix}/resources", f"{topic_prefix}/full"]
+    assert mqtt_service.outbox.depth == 0
+    mqtt_service.outbox.close()
+
+
+def test_mqtt_publish_batch(mock_mqtt_client):
+    """Test that batch mode publishes all buffered samples in one message."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.publish_mode = "batch"
+    jobs = scheduled_jobs(mqtt_service)
+
+    for _ in range(3):
+        jobs["sample"]()
+    jobs["publish"]()
+
+    topic_prefix = mqtt_service.broker_settings["topic_prefix"]
+    calls = {
+        call[1]["topic"]: call[1]["payload"] for call in mock_mqtt_client.publish.call_args_list
+    }
+    assert set(calls) == {
+        f"{topic_prefix}/system",
+        f"{topic_prefix}/network",
+        f"{topic_prefix}/rates",
+        f"{topic_prefix}/batch",
+    }
+
+    batch = json.loads(calls[f"{topic_prefix}/batch"])
+    assert batch["count"] == 3
+    assert batch["device_id"] == mqtt_service.client_id
+    assert len(batch["columns"]["cpu_percent"]) == 3
+    assert len(mqtt_service.batch) == 0
+
+
+def test_mqtt_publish_binary_format(mock_mqtt_client):
+    """Test that the selected wire format is used for every topic."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.payload_format = "binary+zlib"
+
+    mqtt_service._publish_hardware_info()
+
+    # system, network, resources, rates and full
+    assert mock_mqtt_client.publish.call_count == 5
+    for call in mock_mqtt_client.publish.call_args_list:
+        payload = call[1]["payload"]
+        assert codec.is_binary(payload)
+        assert isinstance(codec.decode(payload), dict)
+
+
+def test_mqtt_publish_aggregate(mock_mqtt_client):
+    """Test that aggregate mode publishes a window rollup on the resources topic."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.publish_mode = "aggregate"
+    jobs = scheduled_jobs(mqtt_service)
+
+    for _ in range(3):
+        jobs["sample"]()
+    jobs["publish"]()
+
+    topic_prefix = mqtt_service.broker_settings["topic_prefix"]
+    calls = {
+        call[1]["topic"]: call[1]["payload"] for call in mock_mqtt_client.publish.call_args_list
+    }
+    assert f"{topic_prefix}/full" not in calls
+
+    rollup = json.loads(calls[f"{topic_prefix}/resources"])
+    assert rollup["count"] == 3
+    assert set(rollup["metrics"]["cpu_percent"]) == {"min", "max", "mean", "last", "p95", "count"}
+    assert len(mqtt_service.aggregator) == 0
+
+
+def test_mqtt_deadband_suppresses_unchanged_resources(mock_mqtt_client):
+    """Test that unchanged resources are not published when the deadband is enabled."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.deadband_enabled = True
+
+    sample_hardware_info = {
+        "timestamp": "2023-01-01T00:00:00",
+        "device_id": "test-device",
+        "system": {"os_name": "Test OS"},
+        "network": {"hostname": "test-host"},
+        "resources": {"cpu_percent": 10.0, "memory_percent": 50.0},
+    }
+    with patch.object(mqtt_service, "_get_hardware_info", return_value=sample_hardware_info):
+        mqtt_service._publish_hardware_info()
+        mqtt_service._publish_hardware_info()
+        sample_hardware_info["resources"] = {"cpu_percent": 20.0, "memory_percent": 50.0}
+        mqtt_service._publish_hardware_info()
+
+    topic_prefix = mqtt_service.broker_settings["topic_prefix"]
+    resources = [
+        json.loads(call[1]["payload"])
+        for call in mock_mqtt_client.publish.call_args_list
+        if call[1]["topic"] == f"{topic_prefix}/resources"
+    ]
+    assert len(resources) == 2
+    assert resources[0]["deadband"]["full"] is True
+    assert resources[1]["cpu_percent"] == 20.0
+    assert "memory_percent" not in resources[1]
+    assert resources[1]["timestamp"] == "2023-01-01T00:00:00"
+
+
+def test_mqtt_publish_never_reconnects_inline(mock_mqtt_client, tmp_path):
+    """Test that publishing while disconnected queues the sample instead of reconnecting."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    mock_mqtt_client.is_connected.return_value = False
+
+    mqtt_service._publish_hardware_info()
+
+    mock_mqtt_client.reconnect.assert_not_called()
+    mock_mqtt_client.publish.assert_not_called()
+    assert mqtt_service.outbox.depth > 0
+    mqtt_service.outbox.close()
+
+
+def test_mqtt_update_settings_applies_in_place(mock_mqtt_client):
+    """Test that interval and topic changes are applied without reconnecting."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.connection = MagicMock()
+    mqtt_service.is_running = True
+    mqtt_service.scheduler = mqtt_service._create_scheduler()
+
+    mqtt_service.update_settings(
+        {"mqtt_publish_interval": "15", "mqtt_topic_prefix": "fleet/device"}
+    )
+    # Nothing changes until the service thread picks up the update
+    assert mqtt_service.publish_interval == 60
+
+    mqtt_service.scheduler.run_pending()
+
+    assert mqtt_service.publish_interval == 15
+    assert mqtt_service.broker_settings["topic_prefix"] == "fleet/device"
+    assert mqtt_service.scheduler._jobs["publish"].interval == 15
+    mqtt_service.connection.stop.assert_not_called()
+    assert mqtt_service.client is mock_mqtt_client
+
+
+def test_mqtt_update_settings_reconnects_on_broker_change(mock_mqtt_client):
+    """Test that a broker change replaces the connection."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    old_connection = mqtt_service.connection = MagicMock()
+    mqtt_service.is_running = True
+    mqtt_service.scheduler = mqtt_service._create_scheduler()
+
+    with patch("amazing_iot_device.mqtt_service.ConnectionManager") as mock_manager:
+        mqtt_service.update_settings({"mqtt_broker_host": "other-broker.example.com"})
+        mqtt_service.scheduler.run_pending()
+
+    old_connection.stop.assert_called_once()
+    assert mock_manager.call_args[0][1] == "other-broker.example.com"
+    mqtt_service.connection.start.assert_called_once()
+
+
+def test_mqtt_update_settings_switches_publish_mode(mock_mqtt_client):
+    """Test that a publish mode change replaces the publishing jobs."""
+    mqtt_service = MQTTService()
+    mqtt_service.client = mock_mqtt_client
+    mqtt_service.connection = MagicMock()
+    mqtt_service.is_running = True
+    mqtt_service.scheduler = mqtt_service._create_scheduler()
+    assert "sample" not in mqtt_service.scheduler.jobs()
+
+    mqtt_service.update_settings({"mqtt_publish_mode": "batch"})
+    mqtt_service.scheduler.run_pending()
+
+    assert "sample" in mqtt_service.scheduler.jobs()
+    assert mqtt_service.scheduler._jobs["publish"].func.args == (mqtt_service._batch_topics,)
+
+
+def test_mqtt_restart_waits_for_the_previous_run(mock_mqtt_client):
+    """Test that a run stopped without waiting cannot stop the connection of the next run."""
+    mqtt_service = MQTTService()
+    mqtt_service.publish_interval = 3600
+    with patch(
+        "amazing_iot_device.mqtt_service.ConnectionManager", side_effect=lambda *a, **k: MagicMock()
+    ):
+        mqtt_service.start()
+        deadline = time.monotonic() + 5
+        while mqtt_service.connection is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first_connection = mqtt_service.connection
+        # Keeps the first run busy in its cleanup while the service is restarted
+        shutdown = mqtt_service.scheduler.shutdown
+        mqtt_service.scheduler.shutdown = lambda: (time.sleep(0.3), shutdown())
+
+        mqtt_service.stop(wait=False)
+        mqtt_service.update_settings({"mqtt_broker_host": "other-broker.example.com"})
+        mqtt_service.start()
+        deadline = time.monotonic() + 5
+        while mqtt_service.connection is first_connection and time.monotonic() < deadline:
+            time.sleep(0.01)
+        second_connection = mqtt_service.connection
+
+        first_connection.stop.assert_called_once()
+        second_connection.start.assert_called_once()
+        second_connection.stop.assert_not_called()
+        mqtt_service.stop()
+    second_connection.stop.assert_called_once()
@@ -0,0 +1,80 @@
+"""
+Tests for the store-and-forward outbox
+"""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from amazing_iot_device.outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    """Create an outbox in a temporary directory."""
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), max_messages=5, max_age=3600, drain_rate=10)
+    yield outbox
+    outbox.close()
+
+
+def test_outbox_fifo(outbox):
+    """Test that messages come out in the order they were appended."""
+    outbox.append_many([("test/a", "1", 1, False), ("test/b", b"2", 1, True)])
+
+    messages = outbox.peek(10)
+
+    assert outbox.depth == 2
+    assert [message.topic for message in messages] == ["test/a", "test/b"]
+    assert messages[0].payload == b"1"
+    assert messages[1].retain is True
+
+    outbox.remove([messages[0].id])
+    assert outbox.depth == 1
+    assert outbox.drained_total == 1
+    assert [message.topic for message in outbox.peek(10)] == ["test/b"]
+
+
+def test_outbox_survives_restart(tmp_path):
+    """Test that queued messages are persisted on disk."""
+    path = str(tmp_path / "outbox.sqlite")
+    outbox = Outbox(path)
+    outbox.append("test/topic", "payload")
+    outbox.close()
+
+    reopened = Outbox(path)
+    assert reopened.depth == 1
+    assert reopened.peek(1)[0].payload == b"payload"
+    reopened.close()
+
+
+def test_outbox_evicts_oldest_when_full(outbox):
+    """Test that the outbox never holds more than its maximum size."""
+    outbox.append_many([(f"test/{index}", "{}", 1, False) for index in range(8)])
+
+    assert outbox.depth == 5
+    assert outbox.evicted_total == 3
+    assert outbox.peek(1)[0].topic == "test/3"
+
+
+def test_outbox_evicts_expired(outbox):
+    """Test that messages older than the maximum age are removed."""
+    outbox.append("test/old", "{}")
+    with patch("time.time", return_value=time.time() + 7200):
+        outbox.append("test/new", "{}")
+        assert outbox.evict_expired() == 1
+
+    assert outbox.depth == 1
+    assert outbox.peek(1)[0].topic == "test/new"
+
+
+def test_outbox_drain_budget_is_rate_limited(outbox):
+    """Test that the drain budget never exceeds one second worth of the drain rate."""
+    outbox.configure(max_messages=1000)
+    outbox.append_many([("test/topic", "{}", 1, False)] * 100)
+
+    first = outbox.take_drain_budget(1000)
+    second = outbox.take_drain_budget(1000)
+
+    assert first <= 10
+    assert second <= 1
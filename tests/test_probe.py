@@ -0,0 +1,150 @@
+"""
+Tests for the background MQTT broker probe service
+"""
+
+import asyncio
+import threading
+import time
+
+from amazing_iot_device import probe
+from amazing_iot_device.broker import Broker
+from amazing_iot_device.probe import JobStore, ProbeService
+
+
+def wait_for_job(service, job_id, timeout=5.0):
+    """Poll a job until it is done, returning its last state."""
+    deadline = time.monotonic() + timeout
+    state = service.status(job_id)
+    while state["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(0.01)
+        state = service.status(job_id)
+    return state
+
+
+def test_probe_runs_in_the_background(mqtt_broker):
+    """Test that a check returns a job at once, whose result is then cached."""
+    service = ProbeService(timeout=1.0)
+    refusing_broker = Broker(return_code=5)
+    refused = refusing_broker.start()
+    try:
+        accepted_job = service.submit("127.0.0.1", mqtt_broker.port)
+        refused_job = service.submit("127.0.0.1", refused)
+        assert accepted_job["status"] in ("pending", "done")
+
+        accepted = wait_for_job(service, accepted_job["job"])
+        refused_result = wait_for_job(service, refused_job["job"])
+    finally:
+        refusing_broker.stop()
+
+    assert accepted["success"] is True
+    assert accepted["cached"] is False
+    assert refused_result["success"] is False
+    assert refused_result["message"] == "Failed to connect with code 5"
+
+    # Reused while fresh, for the same credentials only
+    cached = service.submit("127.0.0.1", mqtt_broker.port)
+    assert cached == {**accepted, "cached": True}
+    assert service.submit("127.0.0.1", mqtt_broker.port, "user", "secret")["job"] != cached["job"]
+    assert service.status("missing") is None
+
+
+def test_identical_probes_share_one_check(monkeypatch):
+    """Test that concurrent checks of a broker run once, and that pending checks are capped."""
+    checks = []
+
+    async def slow_probe(host, port, username="", password="", timeout=5.0):
+        checks.append((host, port))
+        await asyncio.sleep(0.2)
+        return {"success": True, "message": "ok"}
+
+    monkeypatch.setattr(probe, "probe_broker", slow_probe)
+    service = ProbeService(workers=4, max_pending=2)
+
+    jobs = [service.submit("broker.local", 1883, "user", "secret") for _ in range(5)]
+    assert {job["job"] for job in jobs} == {jobs[0]["job"]}
+    assert service.submit("other.local", 1883) is not None
+    assert service.submit("third.local", 1883) is None
+
+    assert wait_for_job(service, jobs[0]["job"])["success"] is True
+    assert checks == [("broker.local", 1883), ("other.local", 1883)]
+
+
+def test_late_check_keeps_its_replacement_pending(monkeypatch):
+    """Test that a lost check finishing late does not drop the check that replaced it."""
+    loop = asyncio.new_event_loop()
+    gate = threading.Event()
+
+    async def late_probe(host, port, username="", password="", timeout=5.0):
+        return {"success": False, "message": "late"}
+
+    async def gated_probe(host, port, username="", password="", timeout=5.0):
+        await asyncio.to_thread(gate.wait, 5)
+        return {"success": True, "message": "ok"}
+
+    monkeypatch.setattr(probe, "probe_broker", late_probe)
+    service = ProbeService(timeout=0.05)
+    # Submitted to a loop that is not running, as with a stopped asyncio runtime
+    lost = service.submit("broker.local", 1883, loop=loop)
+    time.sleep(0.15)
+
+    monkeypatch.setattr(probe, "probe_broker", gated_probe)
+    replacement = service.submit("broker.local", 1883)
+    assert replacement["job"] != lost["job"]
+
+    # The lost check finally runs while its replacement is still pending
+    loop.run_until_complete(asyncio.sleep(0.05))
+    loop.close()
+    assert service.status(lost["job"])["message"] == "late"
+    assert service.submit("broker.local", 1883)["job"] == replacement["job"]
+
+    gate.set()
+    assert wait_for_job(service, replacement["job"])["success"] is True
+    assert service.submit("broker.local", 1883)["job"] == replacement["job"]
+
+
+def test_jobs_can_be_polled_from_another_process(tmp_path, monkeypatch):
+    """Test that a job started by one worker process can be polled from another."""
+    gate = threading.Event()
+
+    async def gated_probe(host, port, username="", password="", timeout=5.0):
+        await asyncio.to_thread(gate.wait, 5)
+        return {"success": True, "message": "ok"}
+
+    monkeypatch.setattr(probe, "probe_broker", gated_probe)
+    started_by, polled_by = ProbeService(), ProbeService()
+    started_by.store = JobStore(str(tmp_path))
+    polled_by.store = JobStore(str(tmp_path))
+
+    job = started_by.submit("broker.local", 1883)
+    assert polled_by.status(job["job"]) == {"job": job["job"], "status": "pending"}
+    gate.set()
+    assert wait_for_job(polled_by, job["job"]) == {
+        "job": job["job"],
+        "status": "done",
+        "cached": False,
+        "success": True,
+        "message": "ok",
+    }
+    assert polled_by.status("../../etc/passwd") is None
+    assert polled_by.status("0" * 32) is None
+
+
+def test_connection_test_endpoint(client, auth, mqtt_broker):
+    """Test that the settings page starts a connection test and polls its job."""
+    auth.login()
+    response = client.post(
+        "/settings/test-mqtt-connection", data={"host": "127.0.0.1", "port": mqtt_broker.port}
+    )
+    assert response.status_code in (200, 202)
+    job = response.get_json()["job"]
+
+    deadline = time.monotonic() + 5
+    state = client.get(f"/settings/test-mqtt-connection/{job}").get_json()
+    while state["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(0.01)
+        state = client.get(f"/settings/test-mqtt-connection/{job}").get_json()
+    assert state["success"] is True
+
+    assert client.get("/settings/test-mqtt-connection/missing").status_code == 404
+    response = client.post("/settings/test-mqtt-connection", data={"host": "", "port": "x"})
+    assert response.status_code == 400
@@ -0,0 +1,124 @@
+"""
+Tests for the windowed publish pipeline
+"""
+
+import itertools
+import threading
+import time
+from unittest.mock import MagicMock
+
+from amazing_iot_device.publish_pipeline import PublishPipeline
+
+
+class FakeClient:
+    """MQTT client stand-in that acknowledges messages from another thread."""
+
+    def __init__(self, pipeline, ack_delay=0.02, ack=True):
+        self.pipeline = pipeline
+        self.ack_delay = ack_delay
+        self.ack = ack
+        self.message_ids = itertools.count(1)
+        self.max_inflight = 0
+        self.published = []
+
+    def publish(self, topic, payload, qos, retain):
+        message_info = MagicMock()
+        message_info.rc = 0
+        message_info.mid = next(self.message_ids)
+        message_info.is_published.return_value = False
+        self.published.append(topic)
+        self.max_inflight = max(self.max_inflight, self.pipeline.inflight + 1)
+        if self.ack:
+            timer = threading.Timer(self.ack_delay, self.pipeline.ack, args=[message_info.mid])
+            timer.daemon = True
+            timer.start()
+        return message_info
+
+
+def test_pipeline_respects_window():
+    """Test that no more than window messages are in flight at once."""
+    pipeline = PublishPipeline(window=2, timeout=5)
+    client = FakeClient(pipeline)
+
+    for index in range(6):
+        assert pipeline.submit(client, f"test/{index}", "{}") is not None
+    completed, pending = pipeline.drain()
+
+    assert len(completed) == 6
+    assert pending == []
+    assert client.max_inflight <= 2
+
+
+def test_pipeline_records_latency():
+    """Test that acknowledgement latencies are recorded."""
+    pipeline = PublishPipeline(window=4, timeout=5)
+    client = FakeClient(pipeline, ack_delay=0.05)
+
+    pipeline.submit(client, "test/topic", "{}")
+    completed, _ = pipeline.drain()
+
+    assert completed[0].latency >= 0.04
+    stats = pipeline.latency_stats()
+    assert stats["count"] == 1
+    assert stats["p50_ms"] >= 40
+
+
+def test_pipeline_deadline_expires_without_acks():
+    """Test that a drain returns the unacknowledged messages once the deadline expires."""
+    pipeline = PublishPipeline(window=1, timeout=0.2)
+    client = FakeClient(pipeline, ack=False)
+
+    start = time.monotonic()
+    assert pipeline.submit(client, "test/first", "{}") is not None
+    # The window is full and nobody acknowledges, so the second message is dropped
+    assert pipeline.submit(client, "test/second", "{}", deadline=time.monotonic() + 0.1) is None
+    completed, pending = pipeline.drain(time.monotonic() + 0.1)
+
+    assert completed == []
+    assert [message.topic for message in pending] == ["test/first"]
+    assert time.monotonic() - start < 2
+
+
+def test_pipeline_handles_ack_before_registration():
+    """Test that an acknowledgement arriving before publish() returns is not lost."""
+    pipeline = PublishPipeline(window=1, timeout=1)
+    client = MagicMock()
+    client.publish.return_value.rc = 0
+    client.publish.return_value.mid = 7
+    client.publish.return_value.is_published.return_value = False
+
+    pipeline.ack(7)
+    message = pipeline.submit(client, "test/topic", "{}")
+
+    assert message.acked_at is not None
+    assert pipeline.inflight == 0
+
+
+def test_pipeline_ignores_stale_early_acks():
+    """Test that acknowledgements of unregistered messages expire and are dropped on reset."""
+    pipeline = PublishPipeline(window=1, timeout=0.05)
+    client = MagicMock()
+    client.publish.return_value.rc = 0
+    client.publish.return_value.mid = 7
+    client.publish.return_value.is_published.return_value = False
+
+    pipeline.ack(7)
+    pipeline.reset()
+    assert pipeline.submit(client, "test/topic", "{}").acked_at is None
+
+    pipeline.reset()
+    pipeline.ack(7)
+    # Acknowledged a minute ago
+    pipeline._early_acks[7] -= 60
+    assert pipeline.submit(client, "test/topic", "{}").acked_at is None
+    assert pipeline.inflight == 1
+
+
+def test_pipeline_rejected_publish():
+    """Test that a publish refused by the client is reported as not sent."""
+    pipeline = PublishPipeline(window=1, timeout=1)
+    client = MagicMock()
+    client.publish.return_value.rc = 4  # MQTT_ERR_NO_CONN
+
+    assert pipeline.submit(client, "test/topic", "{}") is None
+    assert pipeline.inflight == 0
@@ -0,0 +1,50 @@
+"""
+Tests for the token bucket rate limiter
+"""
+
+from amazing_iot_device.ratelimit import TokenBucketLimiter
+
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    """Test that a key gets its burst at once, then tokens at the refill rate."""
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=0.5, burst=3, clock=clock)
+
+    assert all(limiter.acquire("client") for _ in range(3))
+    assert not limiter.acquire("client")
+    assert limiter.retry_after("client") == 2.0
+    assert limiter.acquire("other")
+
+    clock.now = 2.0
+    assert limiter.acquire("client")
+    assert not limiter.acquire("client")
+    assert limiter.rejected == 2
+
+
+def test_buckets_are_bounded():
+    """Test that the least recently used buckets are evicted beyond the maximum size."""
+    limiter = TokenBucketLimiter(rate=1, burst=1, maxsize=100, clock=FakeClock())
+    for index in range(1000):
+        limiter.acquire(f"client-{index}")
+
+    assert len(limiter) == 100
+    assert not limiter.acquire("client-999")
+    assert limiter.acquire("client-0")
+
+
+def test_zero_rate_disables_the_limiter():
+    """Test that a limiter with a rate of 0 allows everything."""
+    limiter = TokenBucketLimiter(rate=0, burst=0)
+    assert all(limiter.acquire("client") for _ in range(100))
+    assert limiter.retry_after("client") == 0.0
+    assert len(limiter) == 0
@@ -0,0 +1,141 @@
+"""
+Tests for the counter rate helpers and the rates collector
+"""
+
+from collections import namedtuple
+from unittest.mock import patch
+
+import pytest
+
+from amazing_iot_device.collectors import RatesCollector
+from amazing_iot_device.rates import RateTracker, counter_delta
+
+DiskIO = namedtuple("DiskIO", "read_bytes write_bytes read_count write_count")
+CPUTimes = namedtuple("CPUTimes", "user nice system idle iowait guest guest_nice")
+NetIO = namedtuple(
+    "NetIO", "bytes_recv bytes_sent packets_recv packets_sent errin errout dropin dropout"
+)
+
+
+def test_counter_delta_handles_wraparound_and_resets():
+    """Test that 32-bit wraps are unwrapped and counter restarts are detected."""
+    assert counter_delta(100, 250) == 150
+    # A 32-bit counter wrapped past zero
+    assert counter_delta(2**32 - 10, 5) == 15
+    # A counter restarted from zero, the increase is unknown
+    assert counter_delta(5000, 100) is None
+    # A 64-bit counter never wraps in practice, so a decrease is a reset
+    assert counter_delta(2**40, 10) is None
+
+
+def test_rate_tracker_computes_rates_per_second():
+    """Test that rates are the counter increase divided by the elapsed time."""
+    tracker = RateTracker()
+
+    assert tracker.update("eth0", {"bytes": 1000, "packets": 10}, now=10.0) is None
+    rates = tracker.update("eth0", {"bytes": 3000, "packets": 10}, now=12.0)
+    assert rates == {"bytes": 1000.0, "packets": 0.0}
+
+    # A reset counter is left out until the next sample
+    rates = tracker.update("eth0", {"bytes": 100, "packets": 30}, now=14.0)
+    assert rates == {"packets": 10.0}
+    assert tracker.update("eth0", {"bytes": 300, "packets": 30}, now=15.0)["bytes"] == 200.0
+
+
+@pytest.fixture
+def mock_psutil():
+    """Patch the psutil counters read by the rates collector."""
+    with patch("amazing_iot_device.collectors.psutil") as mock:
+        mock.boot_time.return_value = 1000.0
+        mock.cpu_times.return_value = []
+        mock.getloadavg.return_value = (0.5, 0.25, 0.125)
+        mock.disk_partitions.return_value = []
+        mock.sensors_temperatures.return_value = {}
+        mock.cpu_stats.return_value.ctx_switches = 1000
+        mock.cpu_stats.return_value.interrupts = 500
+        mock.disk_io_counters.return_value = {
+            "sda": DiskIO(0, 0, 0, 0),
+            "loop0": DiskIO(0, 0, 0, 0),
+        }
+        mock.net_io_counters.return_value = {"eth0": NetIO(0, 0, 0, 0, 0, 0, 0, 0)}
+        yield mock
+
+
+def test_rates_collector_reports_rates_from_second_collection(mock_psutil):
+    """Test that the first collection sets baselines and the second reports rates."""
+    collector = RatesCollector()
+
+    with patch("time.monotonic", return_value=100.0):
+        first = collector.collect()
+    assert first["disks"] == {}
+    assert first["load_1"] == 0.5
+
+    mock_psutil.cpu_stats.return_value.ctx_switches = 3000
+    mock_psutil.disk_io_counters.return_value = {
+        "sda": DiskIO(4096, 8192, 1, 2),
+        "loop0": DiskIO(0, 0, 0, 0),
+    }
+    mock_psutil.net_io_counters.return_value = {"eth0": NetIO(2000, 1000, 20, 10, 0, 0, 0, 0)}
+    with patch("time.monotonic", return_value=102.0):
+        second = collector.collect()
+
+    assert second["ctx_switches_per_s"] == 1000.0
+    # Loop devices are ignored
+    assert second["disks"] == {
+        "sda": {
+            "read_bytes_per_s": 2048.0,
+            "write_bytes_per_s": 4096.0,
+            "read_iops": 0.5,
+            "write_iops": 1.0,
+        }
+    }
+    assert second["interfaces"]["eth0"]["bytes_recv_per_s"] == 1000.0
+    assert second["interfaces"]["eth0"]["packets_sent_per_s"] == 5.0
+
+
+def test_rates_collector_resets_baselines_after_reboot(mock_psutil):
+    """Test that counters are not compared across a reboot."""
+    collector = RatesCollector()
+    with patch("time.monotonic", return_value=100.0):
+        collector.collect()
+
+    # After the reboot the counters are lower but still look like plausible wraps
+    mock_psutil.boot_time.return_value = 5000.0
+    mock_psutil.disk_io_counters.return_value = {"sda": DiskIO(10, 10, 1, 1)}
+    with patch("time.monotonic", return_value=102.0):
+        result = collector.collect()
+
+    assert result["disks"] == {}
+    assert "ctx_switches_per_s" not in result
+
+
+def test_rates_collector_bounds_devices(mock_psutil):
+    """Test that the number of reported devices is capped and removed devices are forgotten."""
+    collector = RatesCollector(max_devices=2)
+    mock_psutil.net_io_counters.return_value = {
+        f"eth{index}": NetIO(0, 0, 0, 0, 0, 0, 0, 0) for index in range(5)
+    }
+    with patch("time.monotonic", return_value=100.0):
+        collector.collect()
+    with patch("time.monotonic", return_value=101.0):
+        assert set(collector.collect()["interfaces"]) == {"eth0", "eth1"}
+
+    mock_psutil.net_io_counters.return_value = {}
+    with patch("time.monotonic", return_value=102.0):
+        collector.collect()
+    assert not any(key.startswith("nic:") for key in collector._tracker.keys())
+
+
+def test_rates_collector_counts_guest_time_once(mock_psutil):
+    """Test that guest time, already part of user and nice time, is not counted twice."""
+    collector = RatesCollector()
+    mock_psutil.cpu_times.return_value = [CPUTimes(100, 0, 50, 800, 50, 0, 0)]
+    with patch("time.monotonic", return_value=100.0):
+        collector.collect()
+
+    # 40 of the 60 user seconds ran a virtual machine
+    mock_psutil.cpu_times.return_value = [CPUTimes(160, 10, 70, 900, 60, 40, 10)]
+    with patch("time.monotonic", return_value=102.0):
+        result = collector.collect()
+
+    assert result["cpu_cores"] == [45.0]
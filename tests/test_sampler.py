@@ -0,0 +1,103 @@
+"""
+Tests for the shared resource sampler
+"""
+
+import time
+from unittest.mock import patch
+
+from amazing_iot_device.sampler import MIN_CPU_WINDOW, ResourceSampler
+
+
+@patch("psutil.cpu_percent", return_value=12.5)
+def test_sample_is_non_blocking(mock_cpu):
+    """Test that sampling never asks psutil to sleep for a measurement interval."""
+    sampler = ResourceSampler(interval=1, max_age=5)
+
+    snapshot = sampler.sample()
+
+    assert snapshot.cpu_percent == 12.5
+    for call in mock_cpu.call_args_list:
+        assert call.kwargs["interval"] is None
+    assert snapshot.memory_total > 0
+    assert snapshot.disk_total > 0
+
+
+def test_first_sample_covers_a_measurable_period():
+    """Test that the first CPU measurement is not taken right after its baseline."""
+    calls = []
+
+    def cpu_percent(interval=None):
+        calls.append(time.monotonic())
+        return 12.5
+
+    with patch("psutil.cpu_percent", side_effect=cpu_percent):
+        sampler = ResourceSampler(interval=1, max_age=5)
+        sampler.sample()
+        sampler.sample()
+
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= MIN_CPU_WINDOW
+    # Later samples are not delayed
+    assert calls[2] - calls[1] < MIN_CPU_WINDOW
+
+
+def test_get_snapshot_reuses_fresh_snapshot():
+    """Test that a fresh snapshot is returned without sampling again."""
+    sampler = ResourceSampler(interval=1, max_age=60)
+
+    first = sampler.get_snapshot()
+    with patch.object(sampler, "sample") as mock_sample:
+        second = sampler.get_snapshot()
+
+    assert second is first
+    mock_sample.assert_not_called()
+
+
+def test_get_snapshot_refreshes_stale_snapshot():
+    """Test that a snapshot older than the maximum staleness is refreshed."""
+    sampler = ResourceSampler(interval=1, max_age=60)
+
+    first = sampler.get_snapshot()
+    second = sampler.get_snapshot(max_age=0)
+
+    assert second is not first
+    assert second.monotonic >= first.monotonic
+
+
+def test_background_thread_keeps_snapshot_fresh():
+    """Test that the background thread samples periodically."""
+    sampler = ResourceSampler(interval=0.05, max_age=60)
+    sampler.start()
+    try:
+        deadline = time.monotonic() + 2
+        while sampler._snapshot is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first = sampler._snapshot
+        assert first is not None
+
+        while sampler._snapshot is first and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sampler._snapshot is not first
+    finally:
+        sampler.stop()
+
+    assert sampler.is_running is False
+
+
+def test_listeners_receive_every_snapshot():
+    """Test that listeners get new snapshots and a failing listener does not stop sampling."""
+    sampler = ResourceSampler(interval=1, max_age=60)
+    received = []
+
+    def failing(snapshot):
+        raise RuntimeError("broken listener")
+
+    sampler.add_listener(failing)
+    sampler.add_listener(received.append)
+    sampler.add_listener(received.append)
+    snapshot = sampler.sample()
+    sampler.get_snapshot()
+    sampler.remove_listener(received.append)
+    sampler.sample()
+
+    assert received == [snapshot]
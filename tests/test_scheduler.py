@@ -0,0 +1,125 @@
+"""
+Tests for the drift-free job scheduler
+"""
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from amazing_iot_device.scheduler import Scheduler
+
+
+def test_scheduler_deadlines_do_not_drift():
+    """Test that deadlines advance by whole intervals regardless of execution time."""
+    scheduler = Scheduler()
+    with patch("time.monotonic", return_value=100.0):
+        job = scheduler.add_job("job", lambda: None, 10)
+
+    # The job runs late, but its next deadline stays on the original grid
+    with patch("time.monotonic", return_value=103.5):
+        assert scheduler.run_pending() == pytest.approx(6.5)
+    assert job.next_run == 110.0
+
+
+def test_scheduler_skips_missed_runs():
+    """Test that a long stall does not cause a burst of catch-up runs."""
+    calls = []
+    scheduler = Scheduler()
+    with patch("time.monotonic", return_value=100.0):
+        job = scheduler.add_job("job", lambda: calls.append(1), 10)
+
+    with patch("time.monotonic", return_value=145.0):
+        scheduler.run_pending()
+
+    assert len(calls) == 1
+    assert job.next_run == 150.0
+
+
+def test_scheduler_runs_jobs_in_deadline_order():
+    """Test that jobs with different intervals fire in deadline order."""
+    calls = []
+    scheduler = Scheduler()
+    with patch("time.monotonic", return_value=0.0):
+        scheduler.add_job("slow", lambda: calls.append("slow"), 3, delay=3)
+        scheduler.add_job("fast", lambda: calls.append("fast"), 1, delay=1)
+
+    for now in (1.0, 2.0, 3.0):
+        with patch("time.monotonic", return_value=now):
+            scheduler.run_pending()
+
+    # Jobs due at the same time run in the order they were scheduled
+    assert calls == ["fast", "fast", "slow", "fast"]
+
+
+def test_scheduler_remove_and_reschedule():
+    """Test that removed jobs stop firing and rescheduled jobs use their new interval."""
+    calls = []
+    scheduler = Scheduler()
+    with patch("time.monotonic", return_value=0.0):
+        scheduler.add_job("removed", lambda: calls.append("removed"), 1)
+        scheduler.add_job("moved", lambda: calls.append("moved"), 1)
+        scheduler.remove_job("removed")
+        scheduler.reschedule("moved", 5, delay=5)
+
+    with patch("time.monotonic", return_value=1.0):
+        assert scheduler.run_pending() == pytest.approx(4.0)
+    with patch("time.monotonic", return_value=5.0):
+        scheduler.run_pending()
+
+    assert calls == ["moved"]
+    assert scheduler.jobs() == ["moved"]
+
+
+def test_scheduler_blocking_jobs_do_not_delay_fast_jobs():
+    """Test that slow jobs run on the worker pool while fast jobs keep their schedule."""
+    fast_runs = []
+    release = threading.Event()
+    stop = threading.Event()
+
+    scheduler = Scheduler(max_workers=1)
+    scheduler.add_job("slow", lambda: release.wait(2), 10, blocking=True)
+    scheduler.add_job("fast", lambda: fast_runs.append(time.monotonic()), 0.05)
+
+    runner = threading.Thread(target=scheduler.run, args=(stop,))
+    runner.start()
+    time.sleep(0.5)
+    stop.set()
+    scheduler.wake()
+    release.set()
+    runner.join(timeout=2)
+    scheduler.shutdown(wait=True)
+
+    assert len(fast_runs) >= 5
+
+
+def test_scheduler_job_errors_are_contained():
+    """Test that a failing job does not stop the scheduler."""
+    calls = []
+    scheduler = Scheduler()
+
+    def failing():
+        raise RuntimeError("boom")
+
+    with patch("time.monotonic", return_value=0.0):
+        scheduler.add_job("failing", failing, 1)
+        scheduler.add_job("working", lambda: calls.append(1), 1)
+        scheduler.run_pending()
+
+    assert calls == [1]
+
+
+def test_scheduler_call_soon_runs_on_the_next_tick():
+    """Test that calls handed over from other threads run before the due jobs."""
+    calls = []
+    scheduler = Scheduler()
+    with patch("time.monotonic", return_value=0.0):
+        scheduler.add_job("job", lambda: calls.append("job"), 10)
+        scheduler.run_pending()
+
+    scheduler.call_soon(lambda: calls.append("call"))
+    with patch("time.monotonic", return_value=10.0):
+        scheduler.run_pending()
+
+    assert calls == ["job", "call", "job"]
@@ -56,6 +56,7 @@ def test_mqtt_settings_page(client, auth):
     assert b"Username" in response.data
     assert b"Password" in response.data
     assert b"Topic Prefix" in response.data
+    assert b"Agent Metrics" in response.data
 
 
 def test_mqtt_settings_update(client, auth, app):
@@ -91,3 +92,117 @@ def test_mqtt_settings_update(client, auth, app):
 
         mqtt_interval = Settings.query.filter_by(key="mqtt_publish_interval").first()
         assert mqtt_interval.value == "30"
+
+
+def test_mqtt_settings_publish_window(client, auth, app):
+    """Test that the publish pipeline settings are saved."""
+    auth.login()
+
+    response = client.post(
+        "/settings/mqtt",
+        data={
+            "mqtt_broker_host": "test-broker.example.com",
+            "mqtt_broker_port": 1883,
+            "mqtt_username": "",
+            "mqtt_password": "",
+            "mqtt_client_id": "",
+            "mqtt_topic_prefix": "test/device",
+            "mqtt_publish_interval": 30,
+            "mqtt_inflight_window": 8,
+            "mqtt_publish_timeout": 15,
+        },
+        follow_redirects=True,
+    )
+
+    assert b"MQTT settings updated" in response.data
+    assert b"Acknowledgement Latency" in response.data
+    with app.app_context():
+        assert Settings.query.filter_by(key="mqtt_inflight_window").first().value == "8"
+        assert Settings.query.filter_by(key="mqtt_publish_timeout").first().value == "15"
+
+
+def test_mqtt_settings_batch_mode(client, auth, app):
+    """Test that batch mode accepts sample intervals below the publish interval minimum."""
+    auth.login()
+
+    response = client.post(
+        "/settings/mqtt",
+        data={
+            "mqtt_broker_host": "test-broker.example.com",
+            "mqtt_broker_port": 1883,
+            "mqtt_username": "",
+            "mqtt_password": "",
+            "mqtt_client_id": "",
+            "mqtt_topic_prefix": "test/device",
+            "mqtt_publish_interval": 30,
+            "mqtt_publish_mode": "batch",
+            "mqtt_sample_interval": 0.5,
+        },
+        follow_redirects=True,
+    )
+
+    assert b"MQTT settings updated" in response.data
+    assert b"/batch" in response.data
+    with app.app_context():
+        assert Settings.query.filter_by(key="mqtt_publish_mode").first().value == "batch"
+        assert Settings.query.filter_by(key="mqtt_sample_interval").first().value == "0.5"
+
+
+def test_mqtt_settings_deadband(client, auth, app):
+    """Test that per-metric deadbands are validated and stored."""
+    auth.login()
+    data = {
+        "mqtt_broker_host": "test-broker.example.com",
+        "mqtt_broker_port": 1883,
+        "mqtt_username": "",
+        "mqtt_password": "",
+        "mqtt_client_id": "",
+        "mqtt_topic_prefix": "test/device",
+        "mqtt_publish_interval": 30,
+        "mqtt_deadband_enabled": "y",
+        "mqtt_deadband_heartbeat": 600,
+        "mqtt_deadband_cpu_percent": "abc",
+    }
+
+    response = client.post("/settings/mqtt", data=data, follow_redirects=True)
+    assert b"MQTT settings updated" not in response.data
+
+    data["mqtt_deadband_cpu_percent"] = "2,0.05"
+    response = client.post("/settings/mqtt", data=data, follow_redirects=True)
+    assert b"MQTT settings updated" in response.data
+    with app.app_context():
+        stored = {s.key: s.value for s in Settings.query.all()}
+    assert stored["mqtt_deadband_enabled"] == "true"
+    assert stored["mqtt_deadband_heartbeat"] == "600"
+    assert stored["mqtt_deadband_cpu_percent"] == "2,0.05"
+    assert stored["mqtt_deadband_memory_percent"] == ""
+
+
+def test_mqtt_settings_save_notifies_service(client, auth, app):
+    """Test that the MQTT service applies saved settings through its subscription."""
+    from amazing_iot_device.mqtt_service import mqtt_service
+    from amazing_iot_device.settings_repository import settings_repository
+
+    auth.login()
+    settings_repository.subscribe(mqtt_service._on_settings_changed)
+    try:
+        response = client.post(
+            "/settings/mqtt",
+            data={
+                "mqtt_broker_host": "subscribed-broker.example.com",
+                "mqtt_broker_port": 1884,
+                "mqtt_username": "",
+                "mqtt_password": "",
+                "mqtt_client_id": "",
+                "mqtt_topic_prefix": "test/device",
+                "mqtt_publish_interval": 30,
+            },
+            follow_redirects=True,
+        )
+    finally:
+        settings_repository.unsubscribe(mqtt_service._on_settings_changed)
+
+    assert b"MQTT settings updated and service stopped" in response.data
+    assert mqtt_service.broker_settings["host"] == "subscribed-broker.example.com"
+    assert mqtt_service.broker_settings["port"] == 1884
+    assert b"subscribed-broker.example.com" in client.get("/settings/mqtt").data
@@ -0,0 +1,86 @@
+"""
+Tests for the in-memory settings repository
+"""
+
+from sqlalchemy import event
+
+from amazing_iot_device import db
+from amazing_iot_device.models import Settings
+from amazing_iot_device.settings_repository import settings_repository
+
+
+def count_statements(app):
+    """Return a list collecting the SQL statements run on the app's database."""
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_settings_reads_are_served_from_memory(app):
+    """Test that settings are read from the database once."""
+    statements = count_statements(app)
+
+    assert settings_repository.get("device_name") == "Test IoT Device"
+    assert settings_repository.get_int("refresh_interval") == 30
+    assert settings_repository.get_bool("mqtt_enabled", default=True) is False
+    assert settings_repository.get_float("missing", 1.5) == 1.5
+    assert settings_repository.get_int("device_name", 7) == 7
+    assert "mqtt_broker_host" in settings_repository
+    assert len(statements) == 1
+
+
+def test_settings_update_is_one_upsert(app):
+    """Test that a save writes only the changed settings, in a single statement."""
+    changes = []
+
+    def subscriber(changed, version):
+        changes.append((changed, version))
+
+    settings_repository.subscribe(subscriber)
+    try:
+        settings_repository.get("device_name")
+        version = settings_repository.version
+        statements = count_statements(app)
+
+        changed = settings_repository.update(
+            {"device_name": "Test IoT Device", "refresh_interval": 10, "theme": "dark"}
+        )
+
+        assert changed == {"refresh_interval": "10", "theme": "dark"}
+        assert len(statements) == 1
+        assert statements[0].startswith("INSERT")
+        assert settings_repository.version == version + 1
+        assert changes == [(changed, version + 1)]
+        assert settings_repository.update({"theme": "dark"}) == {}
+        assert settings_repository.version == version + 1
+    finally:
+        settings_repository.unsubscribe(subscriber)
+
+    with app.app_context():
+        stored = {s.key: s.value for s in Settings.query.all()}
+    assert stored["refresh_interval"] == "10"
+    assert stored["theme"] == "dark"
+
+
+def test_settings_defaults_keep_existing_values(app):
+    """Test that defaults only create missing settings."""
+    added = settings_repository.set_defaults({"device_name": "Default", "theme": "light"})
+
+    assert added == {"theme": "light"}
+    assert settings_repository.get("device_name") == "Test IoT Device"
+    with app.app_context():
+        assert Settings.query.filter_by(key="theme").first().value == "light"
+
+
+def test_settings_reload_sees_external_writes(app):
+    """Test that the snapshot is only refreshed from the database when reloaded."""
+    assert settings_repository.get("device_name") == "Test IoT Device"
+    with app.app_context():
+        Settings.query.filter_by(key="device_name").first().value = "Changed elsewhere"
+        db.session.commit()
+
+    assert settings_repository.get("device_name") == "Test IoT Device"
+    settings_repository.reload()
+    assert settings_repository.get("device_name") == "Changed elsewhere"
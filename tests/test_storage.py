@@ -0,0 +1,62 @@
+"""
+Tests for the SQLite storage profiles
+"""
+
+import pytest
+from sqlalchemy import text
+
+from amazing_iot_device import create_app, db
+
+
+def pragma(app, name):
+    """Return the value of a pragma on a pooled connection of the app's database."""
+    with app.app_context():
+        return db.session.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_balanced_profile_is_applied(app):
+    """Test that new connections get the pragmas of the default profile."""
+    assert pragma(app, "journal_mode") == "wal"
+    assert pragma(app, "synchronous") == 1  # NORMAL
+    assert pragma(app, "cache_size") == -8192
+    assert pragma(app, "busy_timeout") == 5000
+    with app.app_context():
+        assert db.engine.pool.size() == 10
+
+
+def test_profile_and_overrides_are_configurable(tmp_path):
+    """Test that the profile, single pragmas and the pool size can be configured."""
+    # A database left in WAL mode by the default profile
+    wal_app = create_app(
+        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}"}
+    )
+    assert pragma(wal_app, "journal_mode") == "wal"
+    with wal_app.app_context():
+        db.engine.dispose()
+
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}",
+            "SQLITE_PROFILE": "legacy",
+            "SQLITE_PRAGMAS": {"busy_timeout": 1000},
+            "SQLITE_POOL_SIZE": 3,
+        }
+    )
+
+    assert pragma(app, "journal_mode") == "delete"
+    assert pragma(app, "synchronous") == 2  # FULL
+    assert pragma(app, "busy_timeout") == 1000
+    with app.app_context():
+        assert db.engine.pool.size() == 3
+        db.engine.dispose()
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{"SQLITE_PROFILE": "fastest"}, {"SQLITE_PRAGMAS": {"locking_mode": "EXCLUSIVE"}}],
+)
+def test_invalid_storage_config_is_rejected(tmp_path, config):
+    """Test that unknown profiles and pragmas fail at startup."""
+    with pytest.raises(ValueError):
+        create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}", **config})
@@ -0,0 +1,50 @@
+"""
+Tests for the cached system information
+"""
+
+from unittest.mock import patch
+
+from amazing_iot_device.system_info import NetworkInfoCache, get_system_info
+
+
+def test_system_info_is_computed_once():
+    """Test that the static system information is not recomputed on every call."""
+    get_system_info()
+    with patch("platform.system") as mock_system:
+        info = get_system_info()
+
+    mock_system.assert_not_called()
+    assert "os_name" in info
+    assert "architecture" in info
+
+
+def test_system_info_returns_copies():
+    """Test that callers cannot modify the cached system information."""
+    info = get_system_info()
+    info["os_name"] = "Modified"
+
+    assert get_system_info()["os_name"] != "Modified"
+
+
+@patch("socket.gethostbyname", return_value="10.0.0.5")
+@patch("socket.gethostname", return_value="device-host")
+def test_network_info_is_cached_until_ttl(mock_hostname, mock_lookup):
+    """Test that the host/IP lookup only runs once per time-to-live."""
+    cache = NetworkInfoCache(ttl=300)
+
+    assert cache.get() == {"hostname": "device-host", "ip_address": "10.0.0.5"}
+    cache.get()
+    assert mock_lookup.call_count == 1
+
+    cache.invalidate()
+    cache.get()
+    assert mock_lookup.call_count == 2
+
+
+@patch("socket.gethostbyname", side_effect=OSError("lookup failed"))
+@patch("socket.gethostname", return_value="device-host")
+def test_network_info_error(mock_hostname, mock_lookup):
+    """Test that lookup failures are reported instead of raised."""
+    cache = NetworkInfoCache(ttl=300)
+
+    assert cache.get() == {"error": "lookup failed"}
@@ -0,0 +1,30 @@
+"""
+WSGI entry point of the Amazing IoT Device Agent for production servers.
+
+Any number of worker processes and threads can serve the application: one of the processes is
+elected to sample resources and publish over MQTT, see coordination.py. For example:
+
+    gunicorn --workers 4 --threads 8 --bind 0.0.0.0:5050 wsgi:app
+
+Workers must import the application themselves, so do not use the --preload option: a lock and
+threads taken over from a parent process are not usable after a fork.
+"""
+
+import os
+import sys
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "src")))
+
+from amazing_iot_device import create_app
+from amazing_iot_device.auth import init_admin
+from amazing_iot_device.coordination import file_lock, init_coordination
+from amazing_iot_device.settings import init_default_settings
+
+# Workers start one at a time, so only the first one creates the database and the admin user
+with file_lock(__file__):
+    app = create_app()
+    init_admin(app)
+    init_default_settings(app)
+
+init_coordination(app)